@@ -0,0 +1,142 @@
+"""Genera una carpeta de capturas sintéticas con la misma forma que las de Event Hubs:
+ficheros Avro upctevents/upctforma/0/YYYY/MM/DD/HH/MM/SS.avro cada 15 minutos, con el
+esquema eventschema (un único campo Body con el evento en JSON) y la misma mezcla de
+tipos de evento y de campos que las muestras de capture/. Una parte de los ficheros se
+deja sin eventos (solo la cabecera Avro), como pasa con las capturas reales.
+
+Uso: python generate_captures.py carpeta --events 100000 [--events-per-file 18]
+     [--empty-ratio 0.2] [--seed 0]"""
+
+from fastavro import parse_schema, writer
+from pathlib import Path
+import argparse
+import datetime as dt
+import json
+import random
+
+
+CAPTURE_SCHEMA = parse_schema(
+    {
+        "type": "record",
+        "name": "eventschema",
+        "fields": [{"name": "Body", "type": "string"}],
+    }
+)
+
+CAPTURE_PREFIX = "upctevents/upctforma/0"
+CAPTURE_INTERVAL = dt.timedelta(minutes=15)
+FIRST_CAPTURE = dt.datetime(2023, 6, 1, 0, 11, 43)
+
+# Proporciones de las muestras de capture/
+EVENT_TYPES = ["LoggedIn", "LoggedOut", "Objective", "Interaction", "KeepAlive"]
+EVENT_TYPE_WEIGHTS = [36, 26, 17, 16, 5]
+DOMAINS = ["aulavirtual.upct.es", "opencontent.upct.es"]
+PROFILES = ["Learner", "Student", "Instructor"]
+PROFILE_WEIGHTS = [93, 6, 1]
+TITLES = [
+    "Correo electrónico: Fraudes y riesgos",
+    "El puesto de trabajo (medidas de protección)",
+    "Igualdad de género y conciliación",
+    "Reported Speech - Questions and Orders",
+    "Acceso a los contenidos.",
+]
+USERS = 800
+UNITS = 350
+
+
+def generate_captures(capture, events, events_per_file=18, empty_ratio=0.2, seed=0):
+    """Escribe en capture ficheros de captura hasta sumar events eventos. Devuelve el
+    número de ficheros escritos (vacíos incluidos)."""
+    rng = random.Random(seed)
+    units = [_unit(rng, index) for index in range(UNITS)]
+
+    capture_time, written, files = FIRST_CAPTURE, 0, 0
+    while written < events:
+        if rng.random() < empty_ratio:
+            file_events = 0
+        else:
+            file_events = min(rng.randint(1, 2 * events_per_file - 1), events - written)
+
+        bodies = [
+            {"Body": json.dumps(_event(rng, units, capture_time))} for _ in range(file_events)
+        ]
+        path = Path(capture) / CAPTURE_PREFIX / capture_time.strftime("%Y/%m/%d/%H/%M/%S.avro")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            writer(f, CAPTURE_SCHEMA, bodies)
+
+        written += file_events
+        files += 1
+        capture_time += CAPTURE_INTERVAL
+
+    return files
+
+
+def _unit(rng, index):
+    author, unit = rng.getrandbits(128), rng.getrandbits(128)
+    return {
+        # unas pocas unidades sin autor, como /la/ en las muestras
+        "url": "/la/" if index == 0 else f"/{author:032x}/{unit:032x}/",
+        "course": str(8000 + index * 7 % 4000),
+        "activity": str(25000 + index),
+        "title": TITLES[index % len(TITLES)],
+        "domain": DOMAINS[index % 15 == 0],
+        "unit_type": "Opencontent" if index % 15 == 0 else "Content",
+    }
+
+
+def _event(rng, units, capture_time):
+    unit = rng.choice(units)
+    user = str(rng.randint(17000, 17000 + USERS))
+    event_type = rng.choices(EVENT_TYPES, EVENT_TYPE_WEIGHTS)[0]
+    event_time = capture_time - dt.timedelta(seconds=rng.uniform(0, CAPTURE_INTERVAL.seconds))
+
+    element, notes, percentage = "", "", "0"
+    if event_type == "Objective":
+        element = f"objetivos0r{rng.randint(0, 3)}c0e0"
+        percentage = str(round(rng.uniform(0, 100), 12))
+    elif event_type == "Interaction":
+        element = f"objetivos0r{rng.randint(0, 3)}c0e0"
+        start = rng.uniform(0, 250)
+        notes = (
+            "{ 'video' : [ { 'Type' : 'Range', 'Ranges' : "
+            f"[{{'start':{start:.6f},'end':{start + rng.uniform(1, 90):.6f}}}], "
+            "'Duration' : '273' }]}"
+        )
+
+    return {
+        "user": user,
+        "name": user,
+        "email": f"{user}@upct.es",
+        "url": unit["url"],
+        "title": unit["title"],
+        "course": unit["course"],
+        "domain": unit["domain"],
+        "activity": unit["activity"],
+        "date": event_time.strftime("%Y-%m-%d %H:%M:%S"),
+        "profile": rng.choices(PROFILES, PROFILE_WEIGHTS)[0],
+        "timestamp": f"{event_time.replace(tzinfo=dt.timezone.utc).timestamp():.3f}",
+        "percentage": percentage,
+        "type": event_type,
+        "element": element,
+        "notes": notes,
+        "description": unit["title"] if element else "",
+        "state": 0,
+        "unit_type": unit["unit_type"],
+        "activity_title": unit["title"],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera capturas sintéticas")
+    parser.add_argument("capture", type=Path)
+    parser.add_argument("--events", type=int, required=True)
+    parser.add_argument("--events-per-file", type=int, default=18)
+    parser.add_argument("--empty-ratio", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    files = generate_captures(
+        args.capture, args.events, args.events_per_file, args.empty_ratio, args.seed
+    )
+    print(f"{files} ficheros de captura en {args.capture}")
@@ -0,0 +1,151 @@
+"""Compara los cargadores locales (pandas, Polars y Polars lazy) sobre capturas
+sintéticas de generate_captures.py y escribe los resultados en JSON.
+
+Cada cargador se ejecuta en un proceso aparte por tamaño, para que el pico de memoria
+(RSS) sea solo el suyo. Se hace una sola carga completa con Events.iter_batches en un
+único lote, y todo sale de ella:
+
+- load: lo que tarda la carga entera (listado, lectura, parseo del JSON y construcción
+  del dataframe; en lazy, incluido el collect)
+- list: etapa list del cargador, el listado de los ficheros de captura
+- read: etapa avro_decode del cargador, la lectura de los Body (decoding.decode_files)
+- process: load - list - read, es decir, parseo del JSON y construcción del dataframe
+
+En stages van todos los segundos por etapa que registra el cargador (metrics.py). Los
+cargadores de un mismo tamaño tienen que dar los mismos eventos y los mismos eventos de
+vídeo (video_ranges no nulo); si no, se para con un error.
+
+Uso: python run_benchmarks.py --events 10000 100000 [--backends pandas polars polars_lazy]
+     [--workers 1] [--data bench_data] [--output resultados.json]"""
+
+from generate_captures import generate_captures
+from pathlib import Path
+import argparse
+import importlib
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+
+REPO = Path(__file__).resolve().parent.parent
+
+# backend -> (carpeta, módulo del cargador local)
+BACKENDS = {
+    "pandas": ("formaLA", "events_local"),
+    "polars": ("polars", "events_polars_local"),
+    "polars_lazy": ("polars", "events_polars_lazy_local"),
+}
+
+
+def run_benchmarks(sizes, backends=tuple(BACKENDS), workers=1, data=Path("bench_data"), seed=0):
+    results = []
+    for events in sizes:
+        capture = data / f"capture_{events}_{seed}"
+        if not capture.exists():
+            generate_captures(capture, events, seed=seed)
+
+        size_results = []
+        for backend in backends:
+            completed = subprocess.run(
+                [sys.executable, __file__, "--run-one", backend, str(capture), str(workers)],
+                check=True,
+                capture_output=True,
+                text=True,
+            )
+            # el último renglón es el JSON; lo anterior, lo que impriman los cargadores
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+            result.update(events_requested=events, workers=workers)
+            size_results.append(result)
+            print(json.dumps(result), file=sys.stderr)
+
+        if len({(result["rows"], result["video_events"]) for result in size_results}) > 1:
+            raise RuntimeError(f"backends disagree on the capture of {events} events")
+        results += size_results
+
+    return results
+
+
+def run_one(backend, capture, workers):
+    folder, module_name = BACKENDS[backend]
+    sys.path.insert(0, str(REPO / folder))
+    events_module = importlib.import_module(module_name)
+    from checkpoint import LocalCheckpoint
+    from metrics import Metrics
+
+    metrics = Metrics()
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        rows = video_events = 0
+        for dataframe, _ in events_module.Events.iter_batches(
+            capture,
+            batch_events=sys.maxsize,
+            checkpoint=LocalCheckpoint(Path(tmp) / "events_metadata.json"),
+            workers=workers,
+            metrics=metrics,
+        ):
+            if hasattr(dataframe, "collect"):
+                with metrics.timer("collect"):
+                    dataframe = dataframe.collect()
+            rows += dataframe.shape[0]
+            video_events += _video_events(dataframe)
+        load = time.perf_counter() - start
+
+    # todas las etapas son de la misma carga
+    stages = {
+        "list": metrics.timers["list"],
+        "read": metrics.timers["avro_decode"],
+        "load": load,
+    }
+    stages["process"] = stages["load"] - stages["list"] - stages["read"]
+    events = metrics.counters["events"]
+
+    return {
+        "backend": backend,
+        "files": metrics.counters["files_read"],
+        "events": events,
+        "rows": rows,
+        "video_events": video_events,
+        "seconds": stages,
+        "stages": dict(metrics.timers),
+        "events_per_second": events / stages["load"] if stages["load"] > 0 else None,
+        "peak_rss_bytes": _peak_rss(),
+    }
+
+
+def _video_events(dataframe):
+    # eventos con video_ranges no nulo, en pandas o en Polars
+    ranges = dataframe["video_ranges"]
+    nulls = ranges.null_count() if hasattr(ranges, "null_count") else ranges.isna().sum()
+    return dataframe.shape[0] - int(nulls)
+
+
+def _peak_rss():
+    # ru_maxrss viene en KiB en Linux y en bytes en macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--run-one":
+        backend, capture, workers = sys.argv[2], Path(sys.argv[3]), int(sys.argv[4])
+        print(json.dumps(run_one(backend, capture, workers)))
+        sys.exit()
+
+    parser = argparse.ArgumentParser(description="Benchmark de los cargadores locales")
+    parser.add_argument("--events", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--backends", nargs="+", choices=list(BACKENDS), default=list(BACKENDS))
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--data", type=Path, default=Path("bench_data"))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.events, args.backends, args.workers, args.data, args.seed)
+    output = json.dumps(results, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        args.output.write_text(output)
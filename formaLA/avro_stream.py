@@ -0,0 +1,114 @@
+from fastavro import reader
+import io
+
+
+# Primeros bytes de todo fichero contenedor de Avro
+AVRO_MAGIC = b"Obj\x01"
+SYNC_SIZE = 16
+
+
+class AvroBlockDecoder:
+    """Decodificador incremental de un fichero contenedor de Avro que llega a trozos
+    (los chunks() de una descarga de Azure), sin tener el fichero entero en memoria.
+
+    feed(chunk) devuelve los registros de los bloques que el trozo completa. Cada bloque
+    se decodifica con fastavro junto a la cabecera del fichero (esquema, códec y marca de
+    sincronización), que se guarda al leerla; lo pendiente en memoria es como mucho un
+    bloque más un trozo. Los metadatos de la cabecera se añaden a metadata al leerla."""
+
+    def __init__(self, metadata=None):
+        self.buffer = bytearray()
+        self.header = None
+        self.metadata = {} if metadata is None else metadata
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        if self.header is None:
+            end = header_end(self.buffer)
+            if end is None:
+                return []
+            self.header = bytes(self.buffer[:end])
+            del self.buffer[:end]
+            self.metadata.update(reader(io.BytesIO(self.header)).metadata)
+
+        records = []
+        while (end := block_frame(self.buffer)[1]) is not None:
+            block = bytes(self.buffer[:end])
+            del self.buffer[:end]
+            if block[-SYNC_SIZE:] != self.header[-SYNC_SIZE:]:
+                raise ValueError("avro block does not end with the file sync marker")
+            records.extend(reader(io.BytesIO(self.header + block)))
+        return records
+
+    def close(self):
+        """Comprueba que el fichero ha llegado entero."""
+        if self.header is None or len(self.buffer) > 0:
+            raise ValueError("truncated avro file")
+
+
+def header_end(buffer):
+    """Posición en la que acaba la cabecera del fichero Avro de buffer, o None si
+    buffer todavía no la tiene entera: magic, metadatos (un map de Avro: tramos de pares
+    clave/valor que acaban en un tramo vacío) y marca de sincronización."""
+    if len(buffer) < len(AVRO_MAGIC):
+        return None
+    if buffer[: len(AVRO_MAGIC)] != AVRO_MAGIC:
+        raise ValueError("not an avro container file")
+    position = len(AVRO_MAGIC)
+    while True:
+        count, position = _read_long(buffer, position)
+        if count is None:
+            return None
+        if count == 0:
+            break
+        if count < 0:
+            # tramo con su tamaño en bytes delante
+            count = -count
+            _, position = _read_long(buffer, position)
+            if position is None:
+                return None
+        for _ in range(2 * count):
+            size, position = _read_long(buffer, position)
+            if size is None:
+                return None
+            position += size
+    position += SYNC_SIZE
+    return position if position <= len(buffer) else None
+
+
+def block_frame(buffer, position=0):
+    """(número de registros, posición en la que acaba) del bloque que empieza en
+    buffer[position], o (None, None) si buffer todavía no lo tiene entero: número de
+    registros, tamaño en bytes, datos y marca de sincronización."""
+    records, position = _read_long(buffer, position)
+    if position is None:
+        return None, None
+    size, position = _read_long(buffer, position)
+    if size is None:
+        return None, None
+    position += size + SYNC_SIZE
+    return (records, position) if position <= len(buffer) else (None, None)
+
+
+def stream_records(chunks, metadata=None):
+    """Registros de un fichero Avro que llega a trozos (chunks, un iterable de bytes),
+    según se completan sus bloques. Con un dict en metadata se le añaden los metadatos de
+    la cabecera."""
+    decoder = AvroBlockDecoder(metadata)
+    for chunk in chunks:
+        yield from decoder.feed(chunk)
+    decoder.close()
+
+
+def _read_long(buffer, position):
+    # long de Avro (varint en zigzag) en buffer[position:]; (None, None) si el buffer
+    # todavía no lo tiene entero
+    value = shift = 0
+    while position < len(buffer):
+        byte = buffer[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte & 0x80 == 0:
+            return (value >> 1) ^ -(value & 1), position
+    return None, None
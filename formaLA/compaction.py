@@ -0,0 +1,165 @@
+from fastavro import reader, writer
+from collections import namedtuple
+from itertools import chain
+from pathlib import Path
+from constants import (
+    COMPACTED_SUFFIX,
+    COMPACTION_CODEC,
+    COMPACTION_METADATA,
+    DOWNLOAD_CONCURRENCY,
+)
+from listing import covered_prefix, is_compacted, list_capture_files
+import io
+import json
+import os
+
+
+# Partes de la ruta (desde el final) que se quitan para quedarse con el periodo:
+# .../2023/06/01/00/00/00.avro -> .../2023/06/01/ (day) o .../2023/06/01/00/ (hour)
+PERIODS = {"day": 3, "hour": 2}
+# Partes de YYYY/MM/DD/HH/MM/SS.avro
+TIME_PARTS = 6
+
+# Fichero original dentro de un blob compactado (compacted_name): lo que los cargadores
+# usan de las BlobProperties del listado
+CompactedFile = namedtuple("CompactedFile", ["name", "size", "compacted_name"])
+
+
+def period_prefix(name, period="day"):
+    return name.rsplit("/", PERIODS[period])[0] + "/"
+
+
+def compacted_name(prefix):
+    """Nombre del fichero compactado del periodo prefix:
+    .../2023/06/01/ -> .../2023/06/01.compacted.avro"""
+    return prefix[:-1] + COMPACTED_SUFFIX
+
+
+def stored_name(blob):
+    """Nombre del blob en el que está guardado blob: el compactado si es un CompactedFile."""
+    return blob.compacted_name if isinstance(blob, CompactedFile) else blob.name
+
+
+def read_metadata(f):
+    # solo se lee la cabecera
+    return reader(f).metadata
+
+
+def compacted_files(name, metadata):
+    """(nombre, tamaño, primer registro, registros) de cada fichero original del fichero
+    compactado name, en orden, según sus metadatos."""
+    prefix, position = covered_prefix(name), 0
+    for relative_name, size, records in json.loads(metadata[COMPACTION_METADATA]):
+        yield prefix + relative_name, size, position, records
+        position += records
+
+
+def split_compacted(name, metadata, bodies, after=""):
+    """(nombre, tamaño, Body) de los ficheros originales del fichero compactado name con
+    nombre posterior a after; bodies son los Body de todo el fichero."""
+    for original, size, position, records in compacted_files(name, metadata):
+        if original > after:
+            yield original, size, bodies[position : position + records]
+
+
+def compact(prefix, files, codec=COMPACTION_CODEC):
+    """Fichero compactado (bytes) con los registros de files, los (nombre, bytes) de los
+    ficheros de captura del periodo prefix. Si entre ellos está el compactado del periodo
+    cuenta como los ficheros que guarda, así que se puede volver a compactar con los que
+    han llegado después. En sus metadatos van los ficheros originales, en orden, con su
+    nombre (desde prefix), tamaño y número de registros."""
+    schema, originals = None, {}
+    for name, data in files:
+        avro = reader(io.BytesIO(data))
+        schema = schema or avro.writer_schema
+        records = list(avro)
+        if is_compacted(name):
+            for original, size, position, count in compacted_files(name, avro.metadata):
+                originals[original] = size, records[position : position + count]
+        else:
+            originals[name] = len(data), records
+
+    names = sorted(originals)
+    files_metadata = [
+        [name[len(prefix) :], originals[name][0], len(originals[name][1])] for name in names
+    ]
+    output = io.BytesIO()
+    writer(
+        output,
+        schema,
+        chain.from_iterable(originals[name][1] for name in names),
+        codec=codec,
+        metadata={COMPACTION_METADATA: json.dumps(files_metadata)},
+    )
+    return output.getvalue()
+
+
+def compact_capture(capture, period="day", codec=COMPACTION_CODEC, keep_last=True):
+    """Junta los ficheros de cada día (o de cada hora, con period="hour") de la carpeta
+    capture en un fichero compactado del periodo y borra los originales. Con keep_last no
+    se toca el último periodo, en el que la captura puede estar escribiendo todavía. Los
+    ficheros que llegan tarde a un periodo ya compactado se juntan con su compactado (si
+    se compacta con el mismo period). Devuelve las rutas de los ficheros compactados."""
+    names = (path.as_posix() for path in list_capture_files(capture))
+    compacted = []
+    for prefix, group in _periods(names, period, keep_last):
+        data = compact(prefix, ((name, Path(name).read_bytes()) for name in group), codec)
+        path = Path(compacted_name(prefix))
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        for name in group:
+            if name != path.as_posix():
+                Path(name).unlink()
+        _remove_empty_directories(Path(prefix))
+        compacted.append(path)
+    return compacted
+
+
+def compact_blobs(
+    container,
+    period="day",
+    codec=COMPACTION_CODEC,
+    keep_last=True,
+    max_concurrency=DOWNLOAD_CONCURRENCY,
+):
+    """compact_capture para los blobs de un Container (o EventLoopContainer): el blob
+    compactado se sube antes de borrar los originales. Devuelve los nombres de los blobs
+    compactados."""
+    names = (blob.name for blob in container.list_blobs_after(""))
+    compacted = []
+    for prefix, group in _periods(names, period, keep_last):
+        name = compacted_name(prefix)
+        container.upload_blob(
+            name, compact(prefix, container.download_blobs(group, max_concurrency), codec)
+        )
+        container.delete_blobs(blob_names=[blob for blob in group if blob != name])
+        compacted.append(name)
+    return compacted
+
+
+def _periods(names, period, keep_last):
+    # (prefijo, nombres) de cada periodo con algo que compactar, a partir de los nombres
+    # ya en orden (el compactado de un periodo va delante de sus originales)
+    periods = {}
+    for name in names:
+        prefix = covered_prefix(name) if is_compacted(name) else period_prefix(name, period)
+        periods.setdefault(prefix, []).append(name)
+    # el último periodo es el mismo en todas las particiones
+    time_parts = TIME_PARTS - PERIODS[period]
+    last = max((prefix.split("/")[-1 - time_parts :] for prefix in periods), default=None)
+    for prefix, group in periods.items():
+        if group == [compacted_name(prefix)]:
+            continue
+        if keep_last and prefix.split("/")[-1 - time_parts :] == last:
+            continue
+        yield prefix, group
+
+
+def _remove_empty_directories(directory):
+    for path, _, _ in sorted(os.walk(directory), reverse=True):
+        if not os.listdir(path):
+            os.rmdir(path)
@@ -0,0 +1,160 @@
+from avro_stream import SYNC_SIZE, block_frame, header_end
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from fastavro import reader
+from itertools import chain, islice
+import io
+import json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.json as pa_json
+import time
+
+
+# Ficheros que decodifica cada tarea del pool, y que se juntan en un lote en read_batch:
+# los de captura son pequeños y mandar uno por tarea costaría más en comunicación entre
+# procesos que en leerlos
+CHUNK_FILES = 16
+
+# Tipos de arrow para los valores JSON del primer evento de cada lote
+JSON_ARROW_TYPES = {str: pa.string(), int: pa.int64(), float: pa.float64(), bool: pa.bool_()}
+
+
+def read_batch(file_paths, file_seconds=None):
+    """Body de cada fichero de file_paths (una lista), en el mismo orden.
+
+    No se abre un lector de Avro por cada fichero: todos los de captura tienen la misma
+    cabecera (el esquema eventschema y el códec) salvo la marca de sincronización, así
+    que se juntan sus bloques tras la cabecera del primero, con su marca, y el lote entero
+    se decodifica como un solo fichero. Solo se analiza la cabecera de los ficheros que no
+    empiezan como la del lote, que abren un lote aparte.
+
+    Con file_seconds (una lista) se le añade lo que tarda cada fichero en leerse y en
+    separar sus bloques; el decodificado es del lote entero y no se reparte."""
+    batches, prefix = [], None
+    for file_path in file_paths:
+        start = time.perf_counter()
+        with open(file_path, "rb", buffering=0) as f:
+            data = f.read()
+        with memoryview(data) as view:
+            if prefix is None or view[: len(prefix)] != prefix:
+                end = header_end(view)
+                if end is None:
+                    raise ValueError(f"truncated avro file {file_path}")
+                header = bytes(view[:end])
+                prefix = header[:-SYNC_SIZE]
+                batches.append((header, bytearray(header), []))
+            header, stream, counts = batches[-1]
+
+            # bloques del fichero, con la marca de sincronización de la cabecera del lote
+            count, position = 0, len(header)
+            while position < len(view):
+                records, next_position = block_frame(view, position)
+                if records is None:
+                    raise ValueError(f"truncated avro file {file_path}")
+                count += records
+                stream += view[position : next_position - SYNC_SIZE]
+                stream += header[-SYNC_SIZE:]
+                position = next_position
+            counts.append(count)
+        if file_seconds is not None:
+            file_seconds.append(time.perf_counter() - start)
+
+    file_bodies = []
+    for _, stream, counts in batches:
+        bodies = blob_bodies(stream)
+        position = 0
+        for count in counts:
+            file_bodies.append(bodies[position : position + count])
+            position += count
+    return file_bodies
+
+
+def decode_files(file_paths, workers=1, metrics=None):
+    """Body de cada fichero de file_paths, en el mismo orden.
+
+    Con workers > 1 los ficheros se reparten en tareas de CHUNK_FILES entre un pool de
+    procesos, con como mucho dos tareas por proceso en vuelo, así que file_paths puede ser
+    un generador. Si el consumidor corta antes (MAX_EVENTS) se cancelan las pendientes.
+
+    Con metrics, lo que tarda cada fichero en leerse (ver read_batch) se registra en el
+    histograma file_read_seconds, y lo que tarda cada tarea entera, con el decodificado
+    de sus ficheros, que se hace junto, en chunk_decode_seconds. Ambos se miden en el
+    proceso que hace la tarea, sin la espera en el pool."""
+    file_paths = iter(file_paths)
+    if workers <= 1:
+        while chunk := list(islice(file_paths, CHUNK_FILES)):
+            yield from _observe(metrics, *_timed_read_batch(chunk))
+        return
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+    pending = deque()
+    try:
+        while chunk := list(islice(file_paths, CHUNK_FILES)):
+            pending.append(executor.submit(_timed_read_batch, chunk))
+            if len(pending) >= 2 * workers:
+                yield from _observe(metrics, *pending.popleft().result())
+        while pending:
+            yield from _observe(metrics, *pending.popleft().result())
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _timed_read_batch(file_paths):
+    # read_batch y los segundos que tarda, en total y por fichero, para las tareas del pool
+    start, file_seconds = time.perf_counter(), []
+    file_bodies = read_batch(file_paths, file_seconds)
+    return time.perf_counter() - start, file_seconds, file_bodies
+
+
+def _observe(metrics, seconds, file_seconds, file_bodies):
+    if metrics is not None:
+        metrics.observe("chunk_decode_seconds", seconds)
+        for file_read_seconds in file_seconds:
+            metrics.observe("file_read_seconds", file_read_seconds)
+    return file_bodies
+
+
+def blob_bodies(data):
+    """Body de un fichero de captura ya descargado (bytes). Solo se recogen los Body; el
+    JSON se parsea en bloque en decode_bodies."""
+    with io.BytesIO(data) as f:
+        return [reading["Body"] for reading in reader(f)]
+
+
+def stream_bodies(records, metadata):
+    """decode de Container.stream_blobs: los Body de los registros según llegan y los
+    metadatos de la cabecera, para los compactados."""
+    return [record["Body"] for record in records], metadata
+
+
+def decode_bodies(file_bodies):
+    """DataFrame con los eventos de file_bodies, una lista de Body por fichero (los
+    tramos que junta sort_runs), con todos los campos como texto.
+
+    El primer evento fija el orden y el tipo de las columnas (así pyarrow no convierte
+    "date" en timestamp); el resto de campos se infieren en bloque."""
+    bodies = list(chain.from_iterable(file_bodies))
+    if len(bodies) == 0:
+        return pd.DataFrame(bodies, dtype=str)
+
+    first_event = json.loads(bodies[0])
+    schema = pa.schema(
+        [
+            (field, JSON_ARROW_TYPES.get(type(value), pa.string()))
+            for field, value in first_event.items()
+        ]
+    )
+    try:
+        table = pa_json.read_json(
+            io.BytesIO("\n".join(bodies).encode()),
+            parse_options=pa_json.ParseOptions(
+                explicit_schema=schema, unexpected_field_behavior="infer"
+            ),
+        )
+    except pa.ArrowInvalid:
+        # cambio de tipo de un campo entre eventos: se vuelve al parseo por evento
+        return pd.DataFrame([json.loads(body) for body in bodies], dtype=str)
+
+    dataframe = table.to_pandas()
+    return dataframe.astype(str).mask(dataframe.isna())
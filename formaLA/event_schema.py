@@ -0,0 +1,79 @@
+import pandas as pd
+
+
+# Campos de los eventos, en el orden en que quedan en el dataframe. Las columnas que no
+# están aquí (campos nuevos) se dejan al final tal como vienen
+EVENT_COLUMNS = [
+    "user",
+    "name",
+    "email",
+    "url",
+    "title",
+    "course",
+    "domain",
+    "activity",
+    "date",
+    "profile",
+    "timestamp",
+    "percentage",
+    "type",
+    "element",
+    "notes",
+    "description",
+    "unit_type",
+    "activity_title",
+    "time_spent",
+]
+
+# Campos que no traen todos los eventos: si no aparecen en el lote se añaden vacíos, para
+# que todos los lotes tengan las mismas columnas
+OPTIONAL_COLUMNS = ["time_spent", "unit_type"]
+
+# user, course y activity no se guardan como enteros: los usuarios anónimos vienen con su
+# IP y hay cursos y actividades con identificadores hexadecimales. Como se repiten en
+# muchas filas, van como categóricas, igual que el resto de campos con pocos valores.
+# url, date y notes se quedan como texto
+EVENT_DTYPES = {
+    "user": "category",
+    "name": "category",
+    "email": "category",
+    "title": "category",
+    "course": "category",
+    "domain": "category",
+    "activity": "category",
+    "profile": "category",
+    "timestamp": "datetime64[us]",
+    "percentage": "float64",
+    "type": "category",
+    "element": "category",
+    "description": "category",
+    "unit_type": "category",
+    "activity_title": "category",
+    "time_spent": "float64",
+    "author": "category",
+    "unit": "category",
+}
+
+
+def cast_events(events):
+    """Aplica EVENT_DTYPES a los eventos recién parseados, con los campos de
+    OPTIONAL_COLUMNS que falten como columnas nulas y en el orden de EVENT_COLUMNS.
+    timestamp pasa de segundos (texto o número) a datetime."""
+    missing = [column for column in OPTIONAL_COLUMNS if column not in events.columns]
+    events = events.assign(**{column: None for column in missing})
+    # en microsegundos, redondeando, para no perder los decimales que trae el evento
+    events["timestamp"] = pd.to_datetime(
+        (events["timestamp"].astype(float) * 1_000_000).round(), unit="us"
+    )
+    events = events.astype(
+        {column: dtype for column, dtype in EVENT_DTYPES.items() if column in events.columns}
+    )
+    return events[
+        [column for column in EVENT_COLUMNS if column in events.columns]
+        + [column for column in events.columns if column not in EVENT_COLUMNS]
+    ]
+
+
+def event_time(seconds):
+    """Timestamp en segundos como datetime comparable con la columna timestamp."""
+    return pd.Timestamp(seconds, unit="s")
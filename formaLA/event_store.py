@@ -0,0 +1,132 @@
+from functools import reduce
+import hashlib
+import operator
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from event_schema import EVENT_COLUMNS, EVENT_DTYPES
+from ordering import merge_order
+
+
+EVENT_STORE_PATH = "events_store"
+
+# Carpetas event_day=YYYY-MM-DD/course=<curso>; las claves se leen siempre como texto
+# (si no, arrow convertiría event_day en fecha y course en entero)
+PARTITIONING = ds.partitioning(
+    pa.schema([("event_day", pa.string()), ("course", pa.string())]), flavor="hive"
+)
+
+# Tipo en los Parquet de cada dtype de EVENT_DTYPES; los campos sin dtype son texto
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+ARROW_TYPES = {"category": CATEGORY, "datetime64[us]": pa.timestamp("us"), "float64": pa.float64()}
+# Tramo de video_ranges (video.parse_notes)
+VIDEO_RANGE = pa.struct([("start", pa.float64()), ("end", pa.float64())])
+
+# Esquema fijo del almacén: los campos de event_schema (cast_events trae siempre los
+# opcionales), los que Events añade detrás y las claves de partición. Se escribe y se lee
+# con él, así que leer no abre los ficheros de fuera de los días y cursos pedidos
+STORE_SCHEMA = pa.schema(
+    [
+        (column, ARROW_TYPES.get(EVENT_DTYPES.get(column), pa.string()))
+        for column in EVENT_COLUMNS
+        if column not in PARTITIONING.schema.names
+    ]
+    + [
+        ("day", pa.timestamp("us")),
+        ("video_ranges", pa.list_(pa.field("element", VIDEO_RANGE))),
+        ("video_duration", pa.float64()),
+        ("author", CATEGORY),
+        ("unit", CATEGORY),
+    ]
+    + list(PARTITIONING.schema)
+)
+
+
+def write_events(dataframe, batch, store=EVENT_STORE_PATH):
+    """Añade el dataframe de Events, ya limpio (tipos de event_schema y columnas
+    author/unit), al almacén Parquet, con un fichero por día y curso.
+
+    batch identifica el lote (su batch_last_events_file, o el cursor de iter_batches):
+    los ficheros se nombran a partir de él, así que exportar otra vez el mismo lote los
+    sobrescribe en lugar de duplicar los eventos.
+
+    Como el dataframe de Events ya está ordenado por timestamp, cada fichero que se
+    escribe es un tramo ordenado: añadir un lote no toca ni reordena los anteriores, y
+    read_events(ordered=True) los mezcla al leer."""
+    if dataframe.shape[0] == 0:
+        return
+
+    # course es categórica (event_schema); la clave de partición tiene que ser texto
+    table = pa.Table.from_pandas(
+        dataframe.assign(
+            event_day=dataframe["timestamp"].dt.strftime("%Y-%m-%d"),
+            course=dataframe["course"].astype(str),
+        ),
+        preserve_index=False,
+    )
+    ds.write_dataset(
+        table.select(STORE_SCHEMA.names).cast(STORE_SCHEMA),
+        store,
+        schema=STORE_SCHEMA,
+        format="parquet",
+        partitioning=PARTITIONING,
+        basename_template=f"part-{hashlib.sha1(batch.encode()).hexdigest()[:16]}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+
+
+def read_events(
+    store=EVENT_STORE_PATH,
+    columns=None,
+    first_day=None,
+    last_day=None,
+    courses=None,
+    ordered=False,
+):
+    """Eventos del almacén como DataFrame de pandas.
+
+    first_day y last_day ("YYYY-MM-DD", ambos incluidos) y courses se aplican sobre las
+    carpetas, de modo que solo se abren los ficheros de esos días y cursos, y de ellos
+    solo se leen las columnas de columns (todas si es None).
+
+    Con ordered, los eventos salen ordenados por timestamp: cada fichero ya lo está, así
+    que se mezclan (ordering.merge_order) en lugar de ordenar todo lo leído."""
+    conditions = []
+    if first_day is not None:
+        conditions.append(ds.field("event_day") >= first_day)
+    if last_day is not None:
+        conditions.append(ds.field("event_day") <= last_day)
+    if courses is not None:
+        conditions.append(ds.field("course").isin(list(courses)))
+
+    dataset = _dataset(store)
+    columns = list(columns or dataset.schema.names)
+    # __fragment_index dice de qué fichero viene cada fila
+    extra_columns = [
+        column
+        for column in ["timestamp", "__fragment_index"]
+        if ordered and column not in columns
+    ]
+    table = dataset.to_table(
+        columns=columns + extra_columns,
+        filter=reduce(operator.and_, conditions) if conditions else None,
+    )
+    if ordered:
+        order = merge_order(table["timestamp"].to_numpy(), table["__fragment_index"].to_numpy())
+        if order is not None:
+            table = table.take(order)
+        table = table.select(columns)
+    # Los tipos salen del esquema de arrow y no de los metadatos de pandas, que no sabe
+    # leer los tipos de arrow anidados que guarda (video_ranges): esas columnas vuelven
+    # como columnas de arrow, igual que en Events
+    return table.replace_schema_metadata().to_pandas(types_mapper=_nested_dtype)
+
+
+def _nested_dtype(arrow_type):
+    if pa.types.is_nested(arrow_type):
+        return pd.ArrowDtype(arrow_type)
+    return None
+
+
+def _dataset(store):
+    return ds.dataset(store, schema=STORE_SCHEMA, format="parquet", partitioning=PARTITIONING)
@@ -1,8 +1,14 @@
-import pandas as pd
 from pathlib import Path
-from fastavro import reader
-import json
-import timeit
+from checkpoint import LocalCheckpoint, PeriodicCheckpoint
+from constants import CHECKPOINT_INTERVAL, FOLLOW_POLL_INTERVAL
+from url_dimension import UrlDimension
+from dedup import SeenEvents
+from event_schema import cast_events, event_time
+from video import parse_notes
+from ordering import sort_runs
+from ingestion import file_batches, follow_files, list_files, read_files
+from decoding import decode_bodies
+from metrics import Metrics
 import shutil
 
 
@@ -11,160 +17,294 @@ MAX_EVENTS = 1000
 
 
 class Events:
-    def __init__(self, capture, capture_processed=None, after=""):
+    def __init__(
+        self,
+        capture,
+        capture_processed=None,
+        after="",
+        checkpoint=None,
+        manifest=None,
+        start=None,
+        end=None,
+        workers=1,
+        metrics=None,
+        url_dimension=None,
+        seen_events=None,
+    ):
+        # Sin after explícito se reanuda a partir del último fichero del checkpoint
+        self.__checkpoint = checkpoint or LocalCheckpoint()
+        after = after or self.__checkpoint.load()
+        # Con start/end (timestamps en segundos) solo se cargan los eventos de ese rango
+        self.__start, self.__end = start, end
+        # Tiempos por etapa y contadores de la carga
+        self.metrics = metrics or Metrics()
+        # author/unit/unit_type por url distinta; por defecto, solo para esta carga
+        self.__url_dimension = (url_dimension or UrlDimension()).load()
+        # hashes de los eventos ya vistos; por defecto, solo los de esta carga
+        self.__seen_events = (seen_events or SeenEvents()).load()
+
         # en lugar de contenedores, hay que definir carpetas
-        self.__retrieve_events(capture, capture_processed, after)
+        self.__retrieve_events(capture, capture_processed, after, manifest, workers)
+
+        # como resultado de lo anterior, se ha completado el atributo __bodies de self.
+        self.__build_dataframe()
+        self.__url_dimension.save()
+
+    @classmethod
+    def iter_batches(
+        cls,
+        capture,
+        after="",
+        batch_events=MAX_EVENTS,
+        checkpoint=None,
+        manifest=None,
+        start=None,
+        end=None,
+        workers=1,
+        metrics=None,
+        url_dimension=None,
+        seen_events=None,
+    ):
+        """Recorre todos los ficheros posteriores a after en un solo proceso y devuelve por
+        cada lote (dataframe, cursor), con como mucho batch_events eventos por lote (salvo
+        un fichero que por sí solo los supere). cursor es la ruta del último fichero del
+        lote: pasándola como after se reanuda a partir del lote siguiente.
+
+        Sin after explícito se empieza en el checkpoint, y cada cursor se guarda en él
+        cuando se pide el lote siguiente, es decir, cuando el anterior ya se ha procesado.
+
+        Con un LocalManifest no se abren los ficheros que según él están vacíos o no
+        tienen eventos en [start, end], y se guarda con cada lote. Con workers > 1 los
+        ficheros se decodifican en un pool de ese número de procesos. Los tiempos y
+        contadores de todos los lotes se acumulan en metrics.
+        Con url_dimension (p. ej. un LocalUrlDimension) la tabla url -> author/unit/
+        unit_type se reutiliza entre lotes y entre cargas y se guarda con cada lote.
+        Los eventos repetidos se quitan con seen_events (p. ej. un LocalSeenEvents para
+        reconocer también los de cargas anteriores), que se guarda con cada lote."""
+        checkpoint = checkpoint or LocalCheckpoint()
+        metrics = metrics or Metrics()
+        url_dimension = (url_dimension or UrlDimension()).load()
+        seen_events = (seen_events or SeenEvents()).load()
+        after = after or checkpoint.load()
+        if manifest is not None:
+            manifest.load()
+        yield from file_batches(
+            list_files(capture, after, metrics, manifest, start, end),
+            batch_events,
+            lambda bodies: cls.__from_bodies(
+                bodies, metrics, url_dimension, seen_events, start, end
+            ).dataframe,
+            checkpoint,
+            [manifest, url_dimension, seen_events],
+            manifest,
+            start,
+            end,
+            workers,
+            metrics,
+            after,
+        )
+
+    @classmethod
+    def follow(
+        cls,
+        capture,
+        callback,
+        after="",
+        batch_events=MAX_EVENTS,
+        checkpoint=None,
+        manifest=None,
+        start=None,
+        end=None,
+        workers=1,
+        metrics=None,
+        url_dimension=None,
+        seen_events=None,
+        poll_interval=FOLLOW_POLL_INTERVAL,
+        checkpoint_interval=CHECKPOINT_INTERVAL,
+        stop=None,
+    ):
+        """iter_batches sin fin, para ingerir casi en tiempo real: tras los ficheros
+        posteriores a after se queda esperando con inotify (ver CaptureWatcher) a los que
+        van llegando a capture, y los procesa en cuanto están completos. Cada lote pasa por
+        el mismo proceso que en iter_batches y se entrega a callback(dataframe, cursor).
+
+        El cursor se lleva en memoria y se guarda en checkpoint como mucho cada
+        checkpoint_interval segundos (PeriodicCheckpoint) y al salir; manifest,
+        url_dimension y seen_events se guardan con cada lote, como en iter_batches. Se
+        sale al activarse stop (un threading.Event), que se mira al menos cada
+        poll_interval segundos, o si callback lanza una excepción."""
+        checkpoint = PeriodicCheckpoint(checkpoint or LocalCheckpoint(), checkpoint_interval)
+        metrics = metrics or Metrics()
+        url_dimension = (url_dimension or UrlDimension()).load()
+        seen_events = (seen_events or SeenEvents()).load()
+        after = after or checkpoint.load()
+        if manifest is not None:
+            manifest.load()
+        follow_files(
+            capture,
+            callback,
+            batch_events,
+            lambda bodies: cls.__from_bodies(
+                bodies, metrics, url_dimension, seen_events, start, end
+            ).dataframe,
+            checkpoint,
+            [manifest, url_dimension, seen_events],
+            manifest,
+            start,
+            end,
+            workers,
+            metrics,
+            after,
+            poll_interval,
+            stop,
+        )
 
-        # como resultado de lo anterior, se ha completado el atributo __events de self.
-        self.dataframe = pd.DataFrame(self.__events, dtype=str)
+    @staticmethod
+    def __save_manifest(manifest):
+        if manifest is not None:
+            manifest.save()
+
+    @classmethod
+    def __from_bodies(
+        cls, bodies, metrics, url_dimension, seen_events, start=None, end=None
+    ):
+        # Events de un lote ya leído, sin pasar por __retrieve_events
+        events = cls.__new__(cls)
+        events.__bodies = bodies
+        events.__start, events.__end = start, end
+        events.metrics = metrics
+        events.__url_dimension = url_dimension
+        events.__seen_events = seen_events
+        events.__build_dataframe()
+        return events
+
+    def __build_dataframe(self):
+        with self.metrics.timer("json_parse"):
+            self.dataframe = decode_bodies(self.__bodies)
+        self.metrics.count("events", self.dataframe.shape[0])
 
         if self.dataframe.shape[0] > 0:
-            # In some old events avro, problem: we drop them
-            self.dataframe.drop(
-                index=self.dataframe.index[self.dataframe["percentage"] == ""], 
-                inplace=True
-            )  # hay que quitarlo
-            self.dataframe.drop(
-                columns=["_id", "state"], inplace=True, 
-                errors="ignore")
-            self.dataframe = self.dataframe.astype(
-                {
-                    "percentage": float,
-                    "timestamp": float,
-                }
-            )
-            if "time_spent" in self.dataframe.columns:
-                self.dataframe = self.dataframe.astype({"time_spent": float})
-            self.dataframe["day"] = pd.to_datetime(
-                self.dataframe["timestamp"], unit="s"
-            ).dt.floor("D")
-            self.__add_author_unit()
-            self.dataframe.sort_values(["timestamp"], inplace=True)
+            with self.metrics.timer("cast"):
+                # In some old events avro, problem: we drop them
+                self.dataframe.drop(
+                    index=self.dataframe.index[self.dataframe["percentage"] == ""], 
+                    inplace=True
+                )  # hay que quitarlo
+                self.dataframe.drop(
+                    columns=["_id", "state"], inplace=True, 
+                    errors="ignore")
+                # tipos de event_schema, comunes a todos los cargadores
+                self.dataframe = cast_events(self.dataframe)
+                # los ficheros que solapan el rango pueden traer eventos de fuera de él
+                if self.__start is not None:
+                    self.dataframe.drop(
+                        index=self.dataframe.index[
+                            self.dataframe["timestamp"] < event_time(self.__start)
+                        ],
+                        inplace=True,
+                    )
+                if self.__end is not None:
+                    self.dataframe.drop(
+                        index=self.dataframe.index[
+                            self.dataframe["timestamp"] > event_time(self.__end)
+                        ],
+                        inplace=True,
+                    )
+            with self.metrics.timer("dedup"):
+                # eventos repetidos en el lote o ya vistos en lotes anteriores
+                events_number = self.dataframe.shape[0]
+                self.dataframe = self.__seen_events.deduplicate(self.dataframe)
+                self.metrics.count("duplicates", events_number - self.dataframe.shape[0])
+            with self.metrics.timer("enrich"):
+                self.dataframe["day"] = self.dataframe["timestamp"].dt.floor("D")
+                # tramos de vídeo vistos y duración, a partir de notes
+                self.dataframe = parse_notes(self.dataframe)
+                self.__add_author_unit()
+            with self.metrics.timer("sort"):
+                # cada fichero ya viene (casi) ordenado: se mezclan en lugar de ordenar
+                # todo el lote
+                self.dataframe = sort_runs(
+                    self.dataframe, [len(bodies) for bodies in self.__bodies], self.metrics
+                )
+
    # @profile
-    def __retrieve_events(self, capture, capture_processed, after=''):
-        file_list = [
-            file for file in capture.glob("**/*.avro") if file.as_posix() > after
-        ]
-        
-        file_list.sort()
+    def __retrieve_events(
+        self, capture, capture_processed, after="", manifest=None, workers=1
+    ):
+        if manifest is not None:
+            manifest.load()
+        file_list = list_files(
+            capture, after, self.metrics, manifest, self.__start, self.__end
+        )
         # print(file_list)
 
-        if len(file_list) > 0:
-            self.batch_first_events_file = file_list[0]
-        
-        else:
-            self.batch_first_events_file, self.batch_last_events_file = (None, None)
+        self.batch_first_events_file, self.batch_last_events_file = (None, None)
 
-        self.__events = []
+        self.__bodies = []
         events_number = 0
 
-        for index, file_path in enumerate(file_list):
-            file_name = file_path.name
-
-            if file_path.stat().st_size > 0:
-                with open(file_path, "rb") as f:
-                 events_list = self.__process_file(f)
-
-                 events_number += len(events_list)
-
-                if events_number > MAX_EVENTS and index > 1:
-                    break
-
-                self.batch_last_events_file = file_name
-                self.__events += events_list
-
-                #if capture_processed is not None:
-                 #   bin_file_path = capture_processed / file_name
-                  #  file_path.rename(bin_file_path) 
-                    # Eliminamos el archivo y la carpeta padre 
-                   # bin_file_path.unlink()
-                    #parent_directory = file_path.parent
-                    # Verificar si la carpeta está vacía antes de eliminarla
-                    #if not any(parent_directory.iterdir()):
-                     #   shutil.rmtree(parent_directory)
-                
-        print(f"Number of downloaded events: {len(self.__events)}")
-
-
-    def __process_file(self, file_path):
-        
-            events_list = []
+        files = read_files(
+            file_list, manifest, self.__start, self.__end, workers, self.metrics, after
+        )
+        for index, file_path, bodies in files:
+            events_number += len(bodies)
 
-            avro_reader = reader(file_path)
+            if events_number > MAX_EVENTS and index > 1:
+                break
 
-            for reading in avro_reader:
-                parsed_json = json.loads(reading["Body"])
+            self.batch_first_events_file = self.batch_first_events_file or file_path.as_posix()
+            self.batch_last_events_file = file_path.as_posix()
+            self.__bodies.append(bodies)
 
-                events_list.append(parsed_json)
+            #if capture_processed is not None:
+             #   bin_file_path = capture_processed / file_name
+              #  file_path.rename(bin_file_path) 
+                # Eliminamos el archivo y la carpeta padre 
+               # bin_file_path.unlink()
+                #parent_directory = file_path.parent
+                # Verificar si la carpeta está vacía antes de eliminarla
+                #if not any(parent_directory.iterdir()):
+                 #   shutil.rmtree(parent_directory)
 
-            return events_list
+        self.__save_manifest(manifest)
 
     def upload_metadata(self):
-        #self.__upload_metadata( # "events_metadata.avro",)
-        self.__upload_metadata("events_metadata.json")
-
-    def __upload_metadata(self, container_name, path, schema):
-        metadata = {
-            "batch_first_events_file": self.batch_first_events_file,
-            "batch_last_events_file": self.batch_last_events_file,
-        }
-
-        with open(path, "w") as f:
-            json.dump(metadata, f)
+        """Guarda el lote en el checkpoint. Se llama una vez procesado el dataframe, para
+        que la siguiente ejecución empiece en el fichero posterior a batch_last_events_file."""
+        self.__checkpoint.save(self.batch_first_events_file, self.batch_last_events_file)
+        # los eventos del lote solo cuentan como vistos una vez procesado
+        self.__seen_events.save()
 
     def add_unit_type(self):
         if self.dataframe.shape[0] == 0:
             return None
 
-        evaluation_units_urls = ["ed12ad9791554f32b3327671030c0e5e"]  # complete
-
-        if not "unit_type" in self.dataframe:
-            self.dataframe["unit_type"] = "Content"
-        else:
-            self.dataframe["unit_type"] = self.dataframe["unit_type"].where(
-                ~self.dataframe["unit_type"].isna(), "Content"
-            )
-
-        self.dataframe["unit_type"] = self.dataframe["unit_type"].where(
-            ~self.dataframe["url"].isin(evaluation_units_urls), "Evaluation"
+        # unit_type siempre está (event_schema): las unidades de evaluación se reconocen
+        # por la url (url_dimension), y los eventos que no traen tipo son de contenido
+        url_unit_types = self.dataframe[["url"]].join(
+            self.__url_dimension.lookup(self.dataframe["url"].unique())["unit_type"], on="url"
+        )["unit_type"]
+        self.dataframe["unit_type"] = (
+            url_unit_types.astype(object)
+            .fillna(self.dataframe["unit_type"].astype(object))
+            .fillna("Content")
+            .astype("category")
         )
 
     def __add_author_unit(self):
         if self.dataframe.shape[0] > 0:
+            # cada url distinta se parte una sola vez (y se guarda para los siguientes
+            # lotes); author y unit se unen a los eventos por url
+            urls = self.__url_dimension.lookup(self.dataframe["url"].unique())
+            self.dataframe = self.dataframe.join(urls[["author", "unit"]], on="url")
 
-            urls = self.dataframe["url"]
-
-            url_author = urls.str.contains("/") & (urls != "/la/")
-
-            if url_author.any():
-                authors = pd.Series("anonymous", index=urls.index)
-
-                self.dataframe["author"] = authors.where(
-                    ~url_author, urls.str.split("/", expand=True).iloc[:, 1]
-                )
-
-                self.dataframe["unit"] = urls.where(
-                    ~url_author, urls.str.split("/", expand=True).iloc[:, 2]
-                )
-            else:
-                self.dataframe["author"] = "anonymous"
-                self.dataframe["unit"] = self.dataframe["url"]
 
 # ejemplo de carga de eventos, instanciando un objeto de la clase Events que hemos definido en este fichero.
+# Los tiempos y la memoria se miden con benchmarks/run_benchmarks.py
 if __name__ == "__main__":
     eventsla =  Events(
         Path("capture"),
         Path("capture_processed"), 
         after="/upctevents/upctforma/0/2023/06/14/03/41/43.avro"
 )
-print(eventsla.dataframe)  
-
-#def measure_events():
-#    """Función empleada para usar timeit y evaluar el tiempo de ejecución"""
-#    eventsla = Events(
-#        Path("capture"), 
-#        Path("capture_processed"), 
-#        after="/upctevents/upctforma/0/2023/06/14/03/41/43.avro"
-#)
-#tiempo = timeit.timeit(measure_events, number=500)
-#print(f"Tiempo de ejecución de eventsla: {tiempo} segundos")
\ No newline at end of file
+    print(eventsla.dataframe)
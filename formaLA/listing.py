@@ -0,0 +1,74 @@
+from constants import COMPACTED_SUFFIX, INGESTION_PREFIX
+from pathlib import Path
+import os
+
+
+def list_capture_files(capture, after="", skip=None):
+    """Ficheros .avro de la carpeta capture con ruta posterior a after, en orden.
+
+    Solo se baja a las carpetas que pueden contener ficheros posteriores a after (las que
+    están en la ruta de after o son posteriores a ella); el resto del árbol, es decir, el
+    histórico ya procesado, no se recorre. Devuelve lo mismo que filtrar y ordenar
+    capture.glob("**/*.avro") por is_after(file.as_posix(), after).
+
+    Con skip (p. ej. Manifest.skip_prefix) tampoco se recorren las carpetas para las que
+    skip("ruta/") es True, ni los ficheros compactados que las guardan."""
+    yield from _walk(Path(capture), after, skip)
+
+
+def capture_directories(capture, after=""):
+    """Carpetas de capture que pueden tener ficheros posteriores a after, empezando por
+    capture: las que recorre list_capture_files, sin ordenar."""
+    yield Path(capture)
+    for entry in os.scandir(capture):
+        if entry.is_dir():
+            prefix = Path(entry.path).as_posix() + "/"
+            if after.startswith(prefix) or prefix > after:
+                yield from capture_directories(entry.path, after)
+
+
+def _walk(directory, after, skip=None):
+    # Los directorios se ordenan como "nombre/" para que el recorrido siga el orden de
+    # las rutas completas, que es el que se compara con after
+    entries = sorted(
+        os.scandir(directory),
+        key=lambda entry: entry.name + "/" if entry.is_dir() else entry.name,
+    )
+
+    for entry in entries:
+        path = Path(entry.path)
+        if entry.is_dir():
+            prefix = path.as_posix() + "/"
+            if (after.startswith(prefix) or prefix > after) and not _skipped(prefix, skip):
+                yield from _walk(path, after, skip)
+        elif entry.name.endswith(".avro") and is_after(path.as_posix(), after):
+            name = path.as_posix()
+            if not (is_compacted(name) and _skipped(covered_prefix(name), skip)):
+                yield path
+
+
+def _skipped(prefix, skip):
+    return skip is not None and skip(prefix)
+
+
+def is_compacted(name):
+    return name.endswith(COMPACTED_SUFFIX)
+
+
+def covered_prefix(name):
+    """Prefijo de los ficheros que guarda el fichero compactado name:
+    .../2023/06/01.compacted.avro -> .../2023/06/01/"""
+    return name[: -len(COMPACTED_SUFFIX)] + "/"
+
+
+def is_after(name, after):
+    """Si el fichero (o blob) de captura name tiene algo posterior a after. Un fichero
+    compactado se ordena delante de sus originales ("." va antes que "/"), así que se
+    compara el prefijo que cubre: lo tiene si after está dentro o es anterior. Los blobs
+    de INGESTION_PREFIX (el checkpoint) no son de captura y nunca lo son."""
+    if name.startswith(INGESTION_PREFIX):
+        return False
+    if not is_compacted(name):
+        return name > after
+    prefix = covered_prefix(name)
+    return after.startswith(prefix) or prefix > after
@@ -0,0 +1,125 @@
+from functools import reduce
+from pathlib import Path
+import json
+import operator
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+ROLLUP_STORE_PATH = "rollups_store"
+
+# Un fichero por día, en carpetas event_day=YYYY-MM-DD
+PARTITIONING = ds.partitioning(pa.schema([("event_day", pa.string())]), flavor="hive")
+ROLLUP_FILE = "rollup.parquet"
+
+# Los agregados se guardan por día, curso, actividad, usuario y tipo de evento: todos se
+# pueden combinar (sumas y máximos), así que un lote nuevo se une a los de su día sin
+# volver a leer los eventos
+ROLLUP_KEYS = ["event_day", "course", "activity", "user", "type"]
+
+# Metadato de cada fichero con los lotes que ya se han sumado a ese día
+BATCHES_METADATA = b"rollup_batches"
+
+
+def merge_rollups(dataframe, batch, store=ROLLUP_STORE_PATH):
+    """Suma el dataframe de Events (tipos de event_schema) a los agregados diarios:
+    número de eventos (events), percentage máximo (max_percentage) y time_spent sumado.
+
+    Solo se leen y reescriben los ficheros de los días que trae el lote, de modo que el
+    coste depende de los eventos nuevos y no de todo lo cargado. batch identifica el lote
+    (como en event_store.write_events): un lote que ya se sumó a un día no se vuelve a
+    sumar, así que repetir un lote tras un fallo no cuenta sus eventos dos veces."""
+    if dataframe.shape[0] == 0:
+        return
+
+    events = dataframe.assign(
+        event_day=dataframe["timestamp"].dt.strftime("%Y-%m-%d"),
+        time_spent=dataframe["time_spent"] if "time_spent" in dataframe else float("nan"),
+    )
+    rollups = _aggregate(
+        events,
+        events=("timestamp", "size"),
+        max_percentage=("percentage", "max"),
+        time_spent=("time_spent", "sum"),
+    )
+
+    for day, day_rollups in rollups.groupby("event_day", observed=True, dropna=False):
+        path = Path(store) / f"event_day={day}" / ROLLUP_FILE
+        batches = []
+        if path.exists():
+            table = pq.read_table(path)
+            batches = json.loads(table.schema.metadata[BATCHES_METADATA])
+            if batch in batches:
+                continue
+            day_rollups = _aggregate(
+                pd.concat([_from_arrow(table).assign(event_day=day), day_rollups]),
+                events=("events", "sum"),
+                max_percentage=("max_percentage", "max"),
+                time_spent=("time_spent", "sum"),
+            )
+
+        table = pa.Table.from_pandas(day_rollups.drop(columns="event_day"), preserve_index=False)
+        table = table.replace_schema_metadata(
+            {BATCHES_METADATA: json.dumps(batches + [batch]).encode()}
+        )
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+
+
+def read_rollups(store=ROLLUP_STORE_PATH, first_day=None, last_day=None):
+    """Agregados guardados, por día, curso, actividad, usuario y tipo. first_day y
+    last_day ("YYYY-MM-DD", ambos incluidos) se aplican sobre las carpetas."""
+    conditions = []
+    if first_day is not None:
+        conditions.append(ds.field("event_day") >= first_day)
+    if last_day is not None:
+        conditions.append(ds.field("event_day") <= last_day)
+    dataset = ds.dataset(store, format="parquet", partitioning=PARTITIONING)
+    table = dataset.to_table(filter=reduce(operator.and_, conditions) if conditions else None)
+    return _from_arrow(table)[ROLLUP_KEYS + ["events", "max_percentage", "time_spent"]]
+
+
+def daily_summary(rollups):
+    """Resumen por día, curso y actividad de los agregados de read_rollups: eventos,
+    usuarios activos, percentage máximo, time_spent y una columna de eventos por tipo."""
+    keys = ["event_day", "course", "activity"]
+    groups = rollups.groupby(keys, observed=True, dropna=False)
+    summary = groups.agg(
+        events=("events", "sum"),
+        active_users=("user", "nunique"),
+        max_percentage=("max_percentage", "max"),
+        time_spent=("time_spent", "sum"),
+    )
+    by_type = rollups.pivot_table(
+        index=keys,
+        columns="type",
+        values="events",
+        aggfunc="sum",
+        fill_value=0,
+        observed=True,
+        dropna=False,
+    )
+    # merge y no join: join no empareja las claves nulas del índice
+    return summary.reset_index().merge(
+        by_type.add_prefix("events_").reset_index(), on=keys, how="left"
+    )
+
+
+def _aggregate(rows, **aggregations):
+    return (
+        rows.astype({key: "category" for key in ROLLUP_KEYS})
+        .groupby(ROLLUP_KEYS, observed=True, sort=False, dropna=False)
+        .agg(**aggregations)
+        .reset_index()
+    )
+
+
+def _from_arrow(table):
+    # Los tipos salen del esquema de arrow (categorías para las claves), no de los
+    # metadatos de pandas
+    return table.replace_schema_metadata().to_pandas()
@@ -0,0 +1,139 @@
+import pandas as pd
+
+
+# Sin eventos durante más de este tiempo, la sesión se da por terminada
+INACTIVITY_GAP = pd.Timedelta(minutes=30)
+
+# Las sesiones son de un usuario en una actividad
+SESSION_KEYS = ["user", "activity"]
+
+SESSION_DTYPES = {
+    "session_id": "int64",
+    "user": "category",
+    "activity": "category",
+    "start": "datetime64[us]",
+    "end": "datetime64[us]",
+    "duration": "timedelta64[us]",
+    "events": "int64",
+    "max_percentage": "float64",
+    "logged_out": "bool",
+}
+
+
+class SessionBuilder:
+    """Construye sesiones de forma incremental, lote a lote (por ejemplo, con los de
+    Events.iter_batches).
+
+    Los eventos de cada usuario y actividad se ordenan por timestamp, y un evento empieza
+    sesión nueva si es un LoggedIn, si el anterior era un LoggedOut o si han pasado más de
+    gap desde el anterior. Todo se hace con operaciones por grupo, sin recorrer los
+    usuarios en Python.
+
+    Las sesiones que pueden seguir en el lote siguiente (sin LoggedOut, sin otra posterior
+    del mismo usuario y actividad y con su último evento a menos de gap del evento más
+    reciente visto) se quedan en open_sessions y continúan con los eventos de ese lote."""
+
+    def __init__(self, gap=INACTIVITY_GAP):
+        self.gap = gap
+        self.next_session_id = 0
+        # timestamp más reciente visto hasta ahora
+        self.watermark = None
+        self.open_sessions = _empty_sessions()
+
+    def add(self, events):
+        """Añade un lote de eventos (con los tipos de event_schema). Devuelve (events,
+        sessions): los eventos con su session_id, con el mismo índice, y las sesiones que
+        se han cerrado con este lote, con start, end, duration, número de eventos (events)
+        y percentage máximo."""
+        if events.shape[0] == 0:
+            return events.assign(session_id=pd.Series(dtype="int64")), _empty_sessions()
+
+        open_sessions = self.open_sessions.set_index(SESSION_KEYS)[
+            ["session_id", "end", "logged_out"]
+        ].add_prefix("open_")
+        ordered = events[SESSION_KEYS + ["timestamp", "type", "percentage"]].sort_values(
+            SESSION_KEYS + ["timestamp"], kind="stable"
+        )
+        # el primer evento de cada usuario y actividad sigue a su sesión abierta
+        ordered = ordered.join(open_sessions, on=SESSION_KEYS)
+        groups = ordered.groupby(SESSION_KEYS, observed=True, sort=False)
+        previous_timestamp = groups["timestamp"].shift().fillna(ordered["open_end"])
+        previous_logged_out = (
+            (groups["type"].shift() == "LoggedOut")
+            .where(groups.cumcount() > 0, ordered["open_logged_out"])
+            .fillna(False)
+            .astype(bool)
+        )
+        new_session = (
+            previous_timestamp.isna()
+            | (ordered["timestamp"] - previous_timestamp > self.gap)
+            | (ordered["type"] == "LoggedIn")
+            | previous_logged_out
+        )
+        # el resto de eventos se quedan en la última sesión empezada antes que ellos
+        ordered["session_id"] = (
+            (self.next_session_id + new_session.cumsum() - 1)
+            .where(new_session)
+            .groupby([ordered[key] for key in SESSION_KEYS], observed=True, sort=False)
+            .ffill()
+            .fillna(ordered["open_session_id"])
+            .astype("int64")
+        )
+        self.next_session_id += int(new_session.sum())
+        batch_watermark = ordered["timestamp"].max()
+        self.watermark = max(self.watermark or batch_watermark, batch_watermark)
+
+        # session_id ya determina usuario y actividad; agruparlos también evita el
+        # first sobre categóricas, que pandas no hace vectorizado
+        session_groups = SESSION_KEYS + ["session_id"]
+        batch_sessions = (
+            ordered.assign(logged_out=ordered["type"] == "LoggedOut")
+            .groupby(session_groups, observed=True, sort=False)
+            .agg(
+                start=("timestamp", "min"),
+                end=("timestamp", "max"),
+                events=("timestamp", "size"),
+                max_percentage=("percentage", "max"),
+                logged_out=("logged_out", "last"),
+            )
+            .reset_index()
+        )
+        sessions = (
+            pd.concat([self.open_sessions, batch_sessions])
+            .sort_values("end", kind="stable")
+            .groupby(session_groups, observed=True, sort=False)
+            .agg(
+                start=("start", "min"),
+                end=("end", "max"),
+                events=("events", "sum"),
+                max_percentage=("max_percentage", "max"),
+                logged_out=("logged_out", "last"),
+            )
+            .reset_index()
+        )
+        sessions["duration"] = sessions["end"] - sessions["start"]
+        sessions = sessions.astype(SESSION_DTYPES)[list(SESSION_DTYPES)]
+
+        last_session = sessions.groupby(SESSION_KEYS, observed=True)["session_id"].transform(
+            "max"
+        )
+        closed = (
+            sessions["logged_out"]
+            | (sessions["session_id"] != last_session)
+            | (sessions["end"] < self.watermark - self.gap)
+        )
+        self.open_sessions = sessions[~closed].reset_index(drop=True)
+
+        events = events.assign(session_id=ordered["session_id"])
+        return events, sessions[closed].sort_values("start").reset_index(drop=True)
+
+    def close(self):
+        """Cierra y devuelve las sesiones que siguen abiertas, al acabar la carga."""
+        sessions, self.open_sessions = self.open_sessions, _empty_sessions()
+        return sessions.sort_values("start").reset_index(drop=True)
+
+
+def _empty_sessions():
+    return pd.DataFrame(
+        {column: pd.Series(dtype=dtype) for column, dtype in SESSION_DTYPES.items()}
+    )
@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+
+# Los módulos de formaLA se importan por nombre (from ordering import ...), como en los
+# cargadores
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,95 @@
+from pathlib import Path
+import json
+import pytest
+from checkpoint import LocalCheckpoint, PeriodicCheckpoint
+from ingestion import batches, list_files
+from metrics import Metrics
+
+
+def _touch(capture, name):
+    # name: YYYY/MM/DD/HH/MM/SS
+    path = Path(capture) / "upctevents/upctforma/0" / f"{name}.avro"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch()
+    return path.as_posix()
+
+
+def test_load_without_checkpoint_starts_from_the_beginning(tmp_path):
+    assert LocalCheckpoint(tmp_path / "events_metadata.json").load() == ""
+
+
+def test_save_replaces_the_checkpoint(tmp_path):
+    checkpoint = LocalCheckpoint(tmp_path / "events_metadata.json")
+    checkpoint.save("a", "b")
+    checkpoint.save("c", "d")
+    assert checkpoint.load() == "d"
+    assert json.loads(checkpoint.path.read_text()) == {
+        "batch_first_events_file": "c",
+        "batch_last_events_file": "d",
+    }
+    # el temporal se renombra sobre el checkpoint
+    assert [path.name for path in tmp_path.iterdir()] == ["events_metadata.json"]
+
+
+def test_interrupted_save_keeps_the_previous_checkpoint(tmp_path, monkeypatch):
+    checkpoint = LocalCheckpoint(tmp_path / "events_metadata.json")
+    checkpoint.save("a", "b")
+
+    def interrupted_dump(metadata, f):
+        f.write('{"batch_first_events_file": ')
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(json, "dump", interrupted_dump)
+    with pytest.raises(KeyboardInterrupt):
+        checkpoint.save("c", "d")
+    assert checkpoint.load() == "b"
+
+
+def test_empty_batch_keeps_the_previous_checkpoint(tmp_path):
+    checkpoint = LocalCheckpoint(tmp_path / "events_metadata.json")
+    checkpoint.save("a", "b")
+    checkpoint.save(None, None)
+    assert checkpoint.load() == "b"
+
+
+def test_resume_from_the_saved_cursor(tmp_path):
+    capture = tmp_path / "capture"
+    names = [_touch(capture, f"2023/06/01/00/{minute:02}/00") for minute in range(5)]
+    checkpoint = LocalCheckpoint(tmp_path / "events_metadata.json")
+
+    def run(stop=None):
+        # lotes de un fichero (con un evento cada uno) de lo posterior al checkpoint,
+        # hasta procesar stop
+        files = list_files(capture, checkpoint.load(), Metrics())
+        read = []
+        for batch, cursor in batches(
+            ((path.as_posix(), [path.as_posix()]) for path in files),
+            1,
+            lambda bodies: bodies,
+            checkpoint,
+        ):
+            read.extend(batch)
+            if cursor == stop:
+                break
+        return read
+
+    # la ejecución se corta tras procesar el segundo lote: el checkpoint se guarda al
+    # pedir el lote siguiente, así que queda en el primero
+    assert run(stop=names[1]) == [[names[0]], [names[1]]]
+    assert checkpoint.load() == names[0]
+    assert run() == [[name] for name in names[1:]]
+    assert checkpoint.load() == names[-1]
+    assert run() == []
+
+
+def test_periodic_checkpoint_writes_every_interval(tmp_path):
+    local = LocalCheckpoint(tmp_path / "events_metadata.json")
+    checkpoint = PeriodicCheckpoint(local, interval=3600)
+    assert checkpoint.load() == ""
+    checkpoint.save("a", "b")
+    assert checkpoint.load() == "b"
+    assert local.load() == ""
+
+    checkpoint.flush()
+    assert local.load() == "b"
+    assert PeriodicCheckpoint(local).load() == "b"
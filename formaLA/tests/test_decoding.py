@@ -0,0 +1,109 @@
+from fastavro import reader, writer
+from pathlib import Path
+import pytest
+import decoding
+from decoding import CHUNK_FILES, decode_files, read_batch
+from metrics import Metrics
+
+
+SCHEMA = {
+    "type": "record",
+    "name": "eventschema",
+    "fields": [{"name": "Body", "type": "string"}],
+}
+
+
+def _write(capture, name, bodies, **options):
+    # name: YYYY/MM/DD/HH/MM/SS; cada writer pone su propia marca de sincronización
+    path = Path(capture) / "upctevents/upctforma/0" / f"{name}.avro"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        writer(f, SCHEMA, [{"Body": body} for body in bodies], **options)
+    return path
+
+
+def _files(capture, n):
+    # ficheros de varios bloques, alguno vacío
+    return [
+        _write(
+            capture,
+            f"2023/06/01/00/{index // 60:02}/{index % 60:02}",
+            [f"e{index}-{event}" for event in range(index % 7)],
+            sync_interval=16,
+        )
+        for index in range(n)
+    ]
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return [record["Body"] for record in reader(f)]
+
+
+def _bodies(file_bodies):
+    return [list(bodies) for bodies in file_bodies]
+
+
+def test_read_batch_matches_reading_each_file(tmp_path):
+    paths = _files(tmp_path, 10)
+    assert _bodies(read_batch(paths)) == [_read(path) for path in paths]
+
+
+def test_files_with_the_same_header_reuse_it(tmp_path, monkeypatch):
+    paths = _files(tmp_path, 3)
+    # otro códec y otros metadatos: otra cabecera, que abre un lote aparte
+    paths.insert(1, _write(tmp_path, "2023/06/01/01/00/00", ["d1", "d2"], codec="deflate"))
+    paths.insert(2, _write(tmp_path, "2023/06/01/01/00/01", ["m1"], metadata={"k": "v"}))
+
+    headers = []
+    header_end = decoding.header_end
+
+    def recorded_header_end(buffer):
+        headers.append(bytes(buffer[:4]))
+        return header_end(buffer)
+
+    monkeypatch.setattr(decoding, "header_end", recorded_header_end)
+    assert _bodies(read_batch(paths)) == [_read(path) for path in paths]
+    # el primero, los dos distintos y el que vuelve a la cabecera del primero
+    assert len(headers) == 4
+
+    headers.clear()
+    same = _files(tmp_path / "same", 5)
+    assert _bodies(read_batch(same)) == [_read(path) for path in same]
+    assert len(headers) == 1
+
+
+def test_read_batch_records_the_seconds_of_each_file(tmp_path):
+    paths = _files(tmp_path, 4)
+    file_seconds = []
+    read_batch(paths, file_seconds)
+    assert len(file_seconds) == 4
+    assert all(seconds >= 0 for seconds in file_seconds)
+
+
+def test_truncated_files_are_rejected(tmp_path):
+    # sin cabecera entera, o cortado a mitad de un bloque
+    empty, truncated = _files(tmp_path, 4)[2:]
+    empty.write_bytes(b"")
+    truncated.write_bytes(truncated.read_bytes()[:-20])
+    for path in [empty, truncated]:
+        with pytest.raises(ValueError, match="truncated"):
+            read_batch([path])
+
+
+def test_workers_give_the_same_result(tmp_path):
+    paths = _files(tmp_path, 3 * CHUNK_FILES + 5)
+    expected = [_read(path) for path in paths]
+    for workers in [1, 2]:
+        metrics = Metrics()
+        # con un generador, como read_files
+        assert _bodies(decode_files(iter(paths), workers, metrics)) == expected
+        assert metrics.histograms["file_read_seconds"].count == len(paths)
+        assert metrics.histograms["chunk_decode_seconds"].count == 4
+
+
+def test_stopping_early_cancels_the_pending_chunks(tmp_path):
+    paths = _files(tmp_path, 10 * CHUNK_FILES)
+    decoded = decode_files(paths, workers=2)
+    assert list(next(decoded)) == _read(paths[0])
+    decoded.close()
@@ -0,0 +1,66 @@
+import pandas as pd
+from dedup import LocalSeenEvents, SeenEvents
+from event_schema import cast_events
+
+
+DAY = 24 * 60 * 60
+
+
+def _events(*rows):
+    # (usuario, segundos) de eventos Viewed del mismo elemento
+    return cast_events(
+        pd.DataFrame(
+            {
+                "user": [user for user, _ in rows],
+                "activity": ["a1"] * len(rows),
+                "timestamp": [float(seconds) for _, seconds in rows],
+                "type": ["Viewed"] * len(rows),
+                "element": ["e1"] * len(rows),
+            }
+        )
+    )
+
+
+def _users(events):
+    return events["user"].astype(str).tolist()
+
+
+def test_repeated_events_in_a_batch_are_dropped():
+    seen = SeenEvents()
+    kept = seen.deduplicate(_events(("u1", 0), ("u2", 0), ("u1", 0), ("u1", 1)))
+    assert _users(kept) == ["u1", "u2", "u1"]
+    assert kept["timestamp"].dt.second.tolist() == [0, 0, 1]
+
+
+def test_events_seen_in_earlier_batches_are_dropped():
+    seen = SeenEvents()
+    seen.deduplicate(_events(("u1", 0), ("u2", DAY)))
+    assert _users(seen.deduplicate(_events(("u2", DAY), ("u3", DAY), ("u1", 0)))) == ["u3"]
+
+
+def test_hashes_do_not_depend_on_the_category_codes():
+    seen = SeenEvents()
+    seen.deduplicate(_events(("u1", 0), ("u2", 0)))
+    # en este lote u2 tiene otro código de categoría (0 en lugar de 1)
+    batch = _events(("u2", 0), ("u3", 0))
+    assert batch["user"].cat.codes.tolist() == [0, 1]
+    assert _users(seen.deduplicate(batch)) == ["u3"]
+
+
+def test_seen_events_are_kept_between_loads(tmp_path):
+    seen = LocalSeenEvents(tmp_path).load()
+    seen.deduplicate(_events(("u1", 0), ("u2", DAY)))
+    seen.save()
+
+    seen = LocalSeenEvents(tmp_path).load()
+    assert _users(seen.deduplicate(_events(("u1", 0), ("u2", DAY), ("u3", DAY)))) == ["u3"]
+
+
+def test_days_older_than_the_retention_are_forgotten(tmp_path):
+    seen = LocalSeenEvents(tmp_path, retention_days=2).load()
+    seen.deduplicate(_events(("u1", 0)))
+    seen.deduplicate(_events(("u1", 3 * DAY)))
+    seen.save()
+    assert sorted(path.stem for path in tmp_path.glob("*.npy")) == ["1970-01-04"]
+    # el día olvidado ya no se puede comprobar: su evento se deja pasar
+    assert _users(LocalSeenEvents(tmp_path).load().deduplicate(_events(("u1", 0)))) == ["u1"]
@@ -0,0 +1,81 @@
+import pandas as pd
+from event_schema import EVENT_COLUMNS, cast_events, event_time
+from event_store import read_events, write_events
+from video import parse_notes
+
+
+DAY = 24 * 60 * 60
+NOTES = "{ 'video' : [ { 'Type' : 'Range', 'Ranges' : [{'start':0,'end':30}], 'Duration' : '187' }]}"
+
+
+def _events(*rows):
+    # (curso, segundos) de eventos de un lote, ya ordenados, como los deja Events: con
+    # todos los campos de event_schema, que son los que se guardan
+    columns = {column: ["x"] * len(rows) for column in EVENT_COLUMNS}
+    columns.update(
+        course=[course for course, _ in rows],
+        timestamp=[float(seconds) for _, seconds in rows],
+        percentage=[50.0] * len(rows),
+        time_spent=[1.0] * len(rows),
+        notes=[NOTES] * len(rows),
+    )
+    events = cast_events(pd.DataFrame(columns))
+    events["day"] = events["timestamp"].dt.floor("D")
+    events = parse_notes(events)
+    events["author"] = pd.Categorical(["author"] * len(rows))
+    events["unit"] = pd.Categorical(["unit"] * len(rows))
+    return events.sort_values("timestamp", kind="stable").reset_index(drop=True)
+
+
+def _read(store, **kwargs):
+    events = read_events(store, columns=["course", "timestamp"], **kwargs)
+    return [
+        (course, (timestamp - event_time(0)).total_seconds())
+        for course, timestamp in events.itertuples(index=False)
+    ]
+
+
+def test_batches_are_partitioned_by_day_and_course(tmp_path):
+    write_events(_events(("c1", 0), ("c2", 60), ("c1", DAY)), "b1", tmp_path)
+    assert sorted(path.relative_to(tmp_path).as_posix() for path in tmp_path.glob("*/*")) == [
+        "event_day=1970-01-01/course=c1",
+        "event_day=1970-01-01/course=c2",
+        "event_day=1970-01-02/course=c1",
+    ]
+    events = read_events(tmp_path)
+    assert events["course"].dtype == object
+    assert events["event_day"].dtype == object
+    assert events["video_duration"].dtype == "float64"
+    assert events["video_ranges"].iloc[0] == [{"start": 0.0, "end": 30.0}]
+
+
+def test_ordered_read_merges_the_batches(tmp_path):
+    # dos lotes que se solapan en el tiempo, con eventos del mismo día y curso
+    write_events(_events(("c1", 0), ("c1", 20), ("c2", 40), ("c1", DAY)), "b1", tmp_path)
+    write_events(_events(("c1", 10), ("c2", 30), ("c1", 50), ("c1", DAY + 10)), "b2", tmp_path)
+    assert _read(tmp_path, ordered=True) == [
+        ("c1", 0),
+        ("c1", 10),
+        ("c1", 20),
+        ("c2", 30),
+        ("c2", 40),
+        ("c1", 50),
+        ("c1", DAY),
+        ("c1", DAY + 10),
+    ]
+    assert _read(tmp_path, ordered=True, first_day="1970-01-02") == [
+        ("c1", DAY),
+        ("c1", DAY + 10),
+    ]
+    assert _read(tmp_path, ordered=True, last_day="1970-01-01", courses=["c2"]) == [
+        ("c2", 30),
+        ("c2", 40),
+    ]
+
+
+def test_writing_a_batch_again_does_not_duplicate_it(tmp_path):
+    batch = _events(("c1", 0), ("c1", DAY))
+    write_events(batch, "b1", tmp_path)
+    write_events(batch, "b1", tmp_path)
+    write_events(_events(("c1", 10)), "b2", tmp_path)
+    assert _read(tmp_path, ordered=True) == [("c1", 0), ("c1", 10), ("c1", DAY)]
@@ -0,0 +1,122 @@
+from pathlib import Path
+import os
+import listing
+from listing import covered_prefix, is_after, list_capture_files
+
+
+NAMES = [
+    "2023/05/31/23/59/00",
+    "2023/06/01/00/00/00",
+    "2023/06/01/00/15/00",
+    "2023/06/01/12/00/00",
+    "2023/06/02/00/00/00",
+    "2023/06/10/08/30/00",
+    "2023/07/01/00/00/00",
+    "2024/01/01/00/00/00",
+]
+
+
+def _touch(capture, name, partition="0"):
+    # name: YYYY/MM/DD/HH/MM/SS
+    path = Path(capture) / "upctevents/upctforma" / partition / f"{name}.avro"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch()
+    return path.as_posix()
+
+
+def _capture(capture):
+    for partition in ["0", "1"]:
+        for name in NAMES:
+            _touch(capture, name, partition)
+    # un fichero que no es de captura no se lista
+    (Path(capture) / "upctevents/upctforma/0/2023/06/01/notes.txt").touch()
+
+
+def _listed(capture, after="", skip=None):
+    return [path.as_posix() for path in list_capture_files(capture, after, skip)]
+
+
+def _filtered(capture, after):
+    return sorted(
+        path.as_posix()
+        for path in Path(capture).glob("**/*.avro")
+        if is_after(path.as_posix(), after)
+    )
+
+
+def test_listing_matches_a_filtered_glob(tmp_path):
+    _capture(tmp_path)
+    prefix = (tmp_path / "upctevents/upctforma").as_posix()
+    cursors = [""] + [
+        f"{prefix}/{partition}/{name}.avro" for partition in ["0", "1"] for name in NAMES
+    ]
+    # cursores que no son ficheros de la captura: a mitad de carpeta o tras todo
+    cursors += [f"{prefix}/0/2023/06/01/06", f"{prefix}/0/2023/06/05", f"{prefix}/2"]
+    for after in cursors:
+        assert _listed(tmp_path, after) == _filtered(tmp_path, after)
+
+
+def test_walk_prunes_the_processed_history(tmp_path, monkeypatch):
+    _capture(tmp_path)
+    walked = []
+    walk = listing._walk
+
+    def recorded_walk(directory, after, skip=None):
+        walked.append(Path(directory))
+        return walk(directory, after, skip)
+
+    monkeypatch.setattr(listing, "_walk", recorded_walk)
+    after = _touch(tmp_path, "2023/06/10/08/30/00", "1")
+    assert _listed(tmp_path, after) == [
+        _touch(tmp_path, "2023/07/01/00/00/00", "1"),
+        _touch(tmp_path, "2024/01/01/00/00/00", "1"),
+    ]
+    # ni la partición 0 ni los días anteriores al del cursor se recorren
+    partition = tmp_path / "upctevents/upctforma/1"
+    assert not any(
+        directory.is_relative_to(tmp_path / "upctevents/upctforma/0") for directory in walked
+    )
+    assert not any(
+        directory.is_relative_to(partition / "2023/06/01") for directory in walked
+    )
+    assert partition / "2023/06/10/08/30" in walked
+
+
+def test_skip_prunes_directories(tmp_path):
+    _capture(tmp_path)
+    skipped = (tmp_path / "upctevents/upctforma/0/2023/06").as_posix() + "/"
+    listed = _listed(tmp_path, skip=lambda prefix: prefix == skipped)
+    assert listed == [name for name in _filtered(tmp_path, "") if not name.startswith(skipped)]
+
+
+def test_compacted_names_are_after_a_cursor_inside_their_day():
+    day = "upctevents/upctforma/0/2023/06/01"
+    compacted = day + ".compacted.avro"
+    assert covered_prefix(compacted) == day + "/"
+    # el compactado va delante de sus originales en el orden de las rutas
+    assert compacted < day + "/00/00/00.avro"
+
+    assert is_after(compacted, "")
+    assert is_after(compacted, "upctevents/upctforma/0/2023/05/31/23/59/00.avro")
+    assert is_after(compacted, day + "/00/00/00.avro")
+    assert is_after(compacted, day + "/23/59/59.avro")
+    assert not is_after(compacted, "upctevents/upctforma/0/2023/06/02/00/00/00.avro")
+
+
+def test_compacted_files_are_listed_with_a_cursor_inside_their_day(tmp_path):
+    first = _touch(tmp_path, "2023/06/01/00/00/00")
+    compacted = Path(first).parents[3] / "01.compacted.avro"
+    compacted.touch()
+    os.remove(first)
+    last = _touch(tmp_path, "2023/06/02/00/00/00")
+
+    assert _listed(tmp_path) == [compacted.as_posix(), last]
+    assert _listed(tmp_path, first) == [compacted.as_posix(), last]
+    assert _listed(tmp_path, last) == []
+    # con skip no se lista el compactado que guarda una carpeta saltada
+    day = covered_prefix(compacted.as_posix())
+    assert _listed(tmp_path, skip=lambda prefix: prefix == day) == [last]
+
+
+def test_ingestion_blobs_are_never_after():
+    assert not is_after("ingestion/events_metadata.avro", "")
@@ -0,0 +1,120 @@
+from fastavro import writer
+from pathlib import Path
+from ingestion import read_files
+from manifest import LocalManifest, Manifest
+from metrics import Metrics
+
+
+SCHEMA = {
+    "type": "record",
+    "name": "eventschema",
+    "fields": [{"name": "Body", "type": "string"}],
+}
+
+
+def _body(timestamp):
+    return '{"timestamp": "%s", "verb": "viewed"}' % timestamp
+
+
+def _write(capture, name, timestamps):
+    # name: YYYY/MM/DD/HH/MM/SS
+    path = Path(capture) / "upctevents/upctforma/0" / f"{name}.avro"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        writer(f, SCHEMA, [{"Body": _body(timestamp)} for timestamp in timestamps])
+    return path
+
+
+def _manifest():
+    manifest = Manifest()
+    manifest.add("a/01.avro", 600, [])
+    manifest.add("a/02.avro", 700, [_body(100), _body(200.5)])
+    manifest.add("b/01.avro", 800, [_body(300)])
+    return manifest
+
+
+def test_empty_files_are_skipped():
+    manifest = _manifest()
+    assert manifest.get("a/01.avro", 600)["records"] == 0
+    assert manifest.skip("a/01.avro", 600)
+    assert manifest.skip("a/01.avro", 600, start=0, end=1000)
+
+
+def test_files_out_of_range_are_skipped():
+    manifest = _manifest()
+    assert manifest.get("a/02.avro", 700)["min_timestamp"] == 100
+    assert manifest.get("a/02.avro", 700)["max_timestamp"] == 200.5
+    assert not manifest.skip("a/02.avro", 700)
+    assert not manifest.skip("a/02.avro", 700, start=200.5, end=200.5)
+    assert not manifest.skip("a/02.avro", 700, start=0, end=100)
+    assert manifest.skip("a/02.avro", 700, start=201)
+    assert manifest.skip("a/02.avro", 700, end=99)
+
+
+def test_unknown_or_changed_files_are_not_skipped():
+    manifest = _manifest()
+    assert not manifest.skip("c/01.avro", 600)
+    assert manifest.size("c/01.avro") is None
+    # el blob ha cambiado de tamaño: la entrada no vale
+    assert manifest.get("a/01.avro", 601) is None
+    assert not manifest.skip("a/01.avro", 601)
+    # sin timestamps no se sabe si está fuera de rango
+    manifest.add("b/02.avro", 900, ['{"verb": "viewed"}'])
+    assert not manifest.skip("b/02.avro", 900, start=1000)
+
+
+def test_skip_prefix_needs_the_prefix_covered():
+    manifest = _manifest()
+    assert not manifest.skip_prefix("a/", start=1000)
+
+    manifest.cover("", "b/01.avro")
+    assert manifest.skip_prefix("a/", start=1000)
+    assert not manifest.skip_prefix("a/", start=150)
+    # b/ sigue abierto: puede haber ficheros posteriores a b/01.avro
+    assert not manifest.skip_prefix("b/", start=1000)
+
+    manifest.cover("b/01.avro", "c/01.avro")
+    assert manifest.covered == ["", "c/01.avro"]
+    assert manifest.skip_prefix("b/", start=1000)
+    assert not manifest.skip_prefix("b/", start=250)
+    # un tramo que no toca covered lo sustituye
+    manifest.cover("d/", "e/01.avro")
+    assert manifest.covered == ["d/", "e/01.avro"]
+    assert not manifest.skip_prefix("a/", start=1000)
+
+
+def test_save_and_load(tmp_path):
+    path = tmp_path / "ingestion" / "capture_manifest.json"
+    assert LocalManifest(path).load().files == {}
+
+    manifest = LocalManifest(path)
+    manifest.files = _manifest().files
+    manifest.cover("", "b/01.avro")
+    manifest.save()
+    loaded = LocalManifest(path).load()
+    assert loaded.files == manifest.files
+    assert loaded.covered == ["", "b/01.avro"]
+    assert loaded.skip_prefix("a/", start=1000)
+
+
+def test_read_files_does_not_open_skipped_files(tmp_path):
+    empty = _write(tmp_path, "2023/06/01/00/00/00", [])
+    old = _write(tmp_path, "2023/06/01/00/15/00", [100, 200])
+    new = _write(tmp_path, "2023/06/01/00/30/00", [300])
+    manifest = Manifest()
+
+    def read(start=None):
+        metrics = Metrics()
+        read = [
+            file_path
+            for _, file_path, _ in read_files(
+                [empty, old, new], manifest, start=start, metrics=metrics
+            )
+        ]
+        return read, metrics.counters.get("files_read", 0)
+
+    # la primera vez se abren todos (el vacío pesa lo que su cabecera)
+    assert read() == ([empty, old, new], 3)
+    assert manifest.get(empty.as_posix(), empty.stat().st_size)["records"] == 0
+    assert read() == ([old, new], 2)
+    assert read(start=250) == ([new], 1)
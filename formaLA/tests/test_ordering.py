@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+from metrics import Metrics
+from ordering import merge_order, sort_runs
+
+
+def _order(timestamps, runs):
+    return merge_order(np.array(timestamps, dtype="int64"), np.array(runs))
+
+
+def test_sorted_batch_is_left_alone():
+    assert _order([1, 2, 2, 5, 7], [0, 0, 1, 1, 2]) is None
+
+
+def test_runs_without_overlap_are_concatenated():
+    # el segundo fichero no está ordenado por dentro, pero no solapa con el primero
+    order = _order([1, 2, 3, 6, 4, 5], [0, 0, 0, 1, 1, 1])
+    assert order.tolist() == [0, 1, 2, 4, 5, 3]
+
+
+def test_overlapping_runs_are_interleaved():
+    order = _order([1, 3, 5, 7, 2, 4, 6, 8], [0, 0, 0, 0, 1, 1, 1, 1])
+    assert order.tolist() == [0, 4, 1, 5, 2, 6, 3, 7]
+
+
+def test_overlap_in_the_middle_of_both_runs():
+    # solo 5..7 del primero y 6..8 del segundo se intercalan
+    order = _order([1, 2, 5, 7, 6, 8, 9, 10], [0, 0, 0, 0, 1, 1, 1, 1])
+    assert order.tolist() == [0, 1, 2, 4, 3, 5, 6, 7]
+
+
+def test_equal_timestamps_keep_arrival_order():
+    order = _order([3, 5, 5, 1, 5, 5, 2, 5], [0, 0, 0, 1, 1, 1, 2, 2])
+    assert order.tolist() == [3, 6, 0, 1, 2, 4, 5, 7]
+
+
+def test_matches_a_stable_sort():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        sizes = rng.integers(1, 20, size=rng.integers(1, 8))
+        runs = np.repeat(np.arange(len(sizes)), sizes)
+        # ficheros casi ordenados, con timestamps repetidos y solapes entre ellos
+        timestamps = np.concatenate(
+            [np.sort(rng.integers(0, 50, size=size)) for size in sizes]
+        )
+        shuffled = rng.random(len(timestamps)) < 0.1
+        timestamps[shuffled] = rng.integers(0, 50, size=shuffled.sum())
+
+        order = merge_order(timestamps.copy(), runs)
+        if order is None:
+            order = np.arange(len(timestamps))
+        assert order.tolist() == np.argsort(timestamps, kind="stable").tolist()
+
+
+def test_sort_runs_uses_the_index_of_filtered_events():
+    batch = pd.DataFrame(
+        {"timestamp": pd.to_datetime([10, 30, 20, 40], unit="us")}, index=[0, 2, 3, 4]
+    )
+    # los dos primeros eventos vienen del primer fichero (de tres eventos, uno quitado)
+    metrics = Metrics()
+    ordered = sort_runs(batch, [3, 2], metrics)
+    assert ordered.index.tolist() == [0, 3, 2, 4]
+    # cada fichero viene ordenado: solo se mezclan
+    assert metrics.counters["unsorted_runs"] == 0
@@ -0,0 +1,69 @@
+import pandas as pd
+from event_schema import cast_events
+from sessions import SessionBuilder
+
+
+MINUTE = 60
+
+
+def _events(*rows):
+    # (usuario, segundos, tipo) de cada evento, todos de la misma actividad
+    return cast_events(
+        pd.DataFrame(
+            {
+                "user": [user for user, _, _ in rows],
+                "activity": ["a1"] * len(rows),
+                "timestamp": [float(seconds) for _, seconds, _ in rows],
+                "percentage": [0.0] * len(rows),
+                "type": [event_type for _, _, event_type in rows],
+            }
+        )
+    )
+
+
+def test_session_continues_in_the_next_batch():
+    builder = SessionBuilder()
+    events, closed = builder.add(_events(("u1", 0, "LoggedIn"), ("u1", 10 * MINUTE, "Viewed")))
+    assert closed.shape[0] == 0
+    first_id = events["session_id"].iloc[0]
+
+    events, closed = builder.add(_events(("u1", 20 * MINUTE, "Viewed")))
+    assert events["session_id"].tolist() == [first_id]
+    assert closed.shape[0] == 0
+
+    sessions = builder.close()
+    assert sessions["session_id"].tolist() == [first_id]
+    assert sessions["events"].tolist() == [3]
+    assert sessions["duration"].dt.total_seconds().tolist() == [20 * MINUTE]
+
+
+def test_gap_in_the_next_batch_closes_the_open_session():
+    builder = SessionBuilder()
+    builder.add(_events(("u1", 0, "Viewed")))
+    events, closed = builder.add(_events(("u1", 31 * MINUTE, "Viewed")))
+    assert closed["events"].tolist() == [1]
+    assert events["session_id"].iloc[0] != closed["session_id"].iloc[0]
+    assert builder.close()["events"].tolist() == [1]
+
+
+def test_logged_out_closes_the_session_in_its_batch():
+    builder = SessionBuilder()
+    _, closed = builder.add(
+        _events(("u1", 0, "Viewed"), ("u1", MINUTE, "LoggedOut"), ("u2", MINUTE, "Viewed"))
+    )
+    assert closed["user"].astype(str).tolist() == ["u1"]
+    assert closed["logged_out"].tolist() == [True]
+
+    # el siguiente evento de u1 empieza sesión aunque llegue enseguida
+    events, _ = builder.add(_events(("u1", 2 * MINUTE, "Viewed")))
+    assert events["session_id"].iloc[0] != closed["session_id"].iloc[0]
+    assert sorted(builder.close()["user"].astype(str).tolist()) == ["u1", "u2"]
+
+
+def test_logged_in_starts_a_new_session():
+    builder = SessionBuilder()
+    events, _ = builder.add(
+        _events(("u1", 0, "Viewed"), ("u1", MINUTE, "LoggedIn"), ("u1", 2 * MINUTE, "Viewed"))
+    )
+    first, second, third = events["session_id"].tolist()
+    assert first != second == third
@@ -0,0 +1,90 @@
+from event_schema import EVENT_DTYPES
+from pathlib import Path
+import json
+import os
+import pandas as pd
+
+
+# urls de las unidades de evaluación
+EVALUATION_UNITS_URLS = ["ed12ad9791554f32b3327671030c0e5e"]
+
+DIMENSION_COLUMNS = ["author", "unit", "unit_type"]
+
+
+def split_url(url):
+    """author, unit y unit_type de una url. Las urls "/<author>/<unit>/" se parten; el
+    resto (y "/la/") son de autor anónimo y la unidad es la propia url. unit_type solo se
+    fija aquí para las unidades de evaluación; si no, queda el que traiga el evento."""
+    unit_type = "Evaluation" if url in EVALUATION_UNITS_URLS else None
+    if "/" not in url or url == "/la/":
+        return {"author": "anonymous", "unit": url, "unit_type": unit_type}
+    parts = url.split("/")
+    return {
+        "author": parts[1],
+        "unit": parts[2] if len(parts) > 2 else "",
+        "unit_type": unit_type,
+    }
+
+
+class UrlDimension:
+    """Tabla de dimensión url -> author, unit, unit_type. Un lote tiene muchos eventos
+    pero pocas urls distintas, así que cada url se parte una sola vez y la tabla se une a
+    los eventos por url, en lugar de partir la url de cada fila.
+
+    Esta se queda en memoria (sirve para los lotes de una misma carga); LocalUrlDimension
+    la guarda además entre cargas."""
+
+    def __init__(self):
+        self.urls = {}
+        self.changed = False
+
+    def load(self):
+        return self
+
+    def save(self):
+        pass
+
+    def lookup(self, urls):
+        """DataFrame indexado por url con author, unit y unit_type de cada una de urls (sin
+        repetir), calculando solo las que aún no están en la tabla."""
+        urls = [url for url in urls if isinstance(url, str)]
+        for url in urls:
+            if url not in self.urls:
+                self.urls[url] = split_url(url)
+                self.changed = True
+        dimension = pd.DataFrame.from_dict(
+            {url: self.urls[url] for url in urls}, orient="index", columns=DIMENSION_COLUMNS
+        )
+        # author, unit y unit_type con los mismos tipos que en los eventos (event_schema)
+        return dimension.rename_axis("url").astype(
+            {column: EVENT_DTYPES[column] for column in DIMENSION_COLUMNS}
+        )
+
+
+class LocalUrlDimension(UrlDimension):
+    """Tabla de urls guardada en un fichero JSON local."""
+
+    def __init__(self, path="url_dimension.json"):
+        super().__init__()
+        self.path = Path(path)
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                self.urls = json.load(f)
+        except FileNotFoundError:
+            self.urls = {}
+        self.changed = False
+        return self
+
+    def save(self):
+        # solo se reescribe si el lote ha traído urls nuevas
+        if not self.changed:
+            return
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.urls, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.changed = False
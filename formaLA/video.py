@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+# En las Interaction de vídeo, notes es un literal de Python con los tramos vistos:
+# { 'video' : [ { 'Type' : 'Range', 'Ranges' : [{'start':..,'end':..}], 'Duration' : '187' }]}
+# Se leen con expresiones regulares sobre toda la columna, sin literal_eval por fila
+RANGE_PATTERN = r"'start'\s*:\s*(?P<start>[^,}\s]+)\s*,\s*'end'\s*:\s*(?P<end>[^,}\s]+)"
+DURATION_PATTERN = r"'Duration'\s*:\s*'?([0-9.]+)"
+
+RANGE_TYPE = pa.struct([("start", pa.float64()), ("end", pa.float64())])
+
+# La cobertura se calcula por usuario, actividad y elemento (cada vídeo)
+COVERAGE_KEYS = ["user", "activity", "element"]
+
+
+def parse_notes(events):
+    """Añade a los eventos video_ranges, la lista de tramos vistos como struct
+    {start, end} en segundos (columna de arrow), y video_duration, la duración del vídeo.
+    En los eventos que no son de vídeo las dos quedan a null."""
+    notes = events["notes"].reset_index(drop=True)
+    # una fila por tramo, con la posición del evento en el primer nivel del índice
+    matches = notes.str.extractall(RANGE_PATTERN).astype(float)
+    counts = np.bincount(
+        matches.index.get_level_values(0).to_numpy(dtype=np.intp), minlength=len(notes)
+    )
+    values = pa.StructArray.from_arrays(
+        [pa.array(matches["start"]), pa.array(matches["end"])], fields=list(RANGE_TYPE)
+    )
+    ranges = pa.ListArray.from_arrays(
+        pa.array(np.concatenate([[0], np.cumsum(counts)]), pa.int32()),
+        values,
+        mask=pa.array(counts == 0),
+    )
+    return events.assign(
+        video_ranges=pd.Series(pd.arrays.ArrowExtensionArray(ranges), index=events.index),
+        video_duration=notes.str.extract(DURATION_PATTERN, expand=False).astype(float).values,
+    )
+
+
+def video_coverage(events):
+    """Segundos vistos (watched_seconds) y porcentaje del vídeo visto (coverage) por
+    usuario, actividad y elemento, a partir de los video_ranges de todos sus eventos.
+
+    Los tramos de un mismo vídeo se solapan (se vuelve atrás, se ve dos veces...), así
+    que no se suman sin más: se ordenan por start y se unen los que se solapan antes de
+    sumar su longitud."""
+    videos = events[events["video_ranges"].notna()]
+    ranges = pa.array(videos["video_ranges"])
+    flat = pc.list_flatten(ranges)
+    spans = videos[COVERAGE_KEYS + ["video_duration"]].iloc[
+        pc.list_parent_indices(ranges).to_numpy()
+    ].reset_index(drop=True)
+    spans["start"] = flat.field("start").to_numpy(zero_copy_only=False)
+    spans["end"] = flat.field("end").to_numpy(zero_copy_only=False)
+
+    # los tramos se recortan a [0, duración]
+    spans["start"] = spans["start"].clip(lower=0)
+    spans["end"] = spans["end"].where(
+        ~(spans["end"] > spans["video_duration"]), spans["video_duration"]
+    )
+    spans = spans[spans["end"] > spans["start"]].sort_values(COVERAGE_KEYS + ["start"])
+
+    # un tramo empieza un nuevo intervalo si no solapa con ninguno de los anteriores del
+    # mismo vídeo, es decir, si empieza después del mayor end visto hasta él
+    first = spans[COVERAGE_KEYS].ne(spans[COVERAGE_KEYS].shift()).any(axis=1)
+    previous_end = (
+        spans.groupby(COVERAGE_KEYS, observed=True, sort=False)["end"]
+        .cummax()
+        .shift()
+        .mask(first)
+    )
+    spans["interval"] = (previous_end.isna() | (spans["start"] > previous_end)).cumsum()
+
+    intervals = spans.groupby(COVERAGE_KEYS + ["interval"], observed=True, sort=False).agg(
+        start=("start", "min"),
+        end=("end", "max"),
+        video_duration=("video_duration", "max"),
+    )
+    coverage = (
+        intervals.assign(watched_seconds=intervals["end"] - intervals["start"])
+        .groupby(level=COVERAGE_KEYS, observed=True)
+        .agg(
+            watched_seconds=("watched_seconds", "sum"),
+            video_duration=("video_duration", "max"),
+        )
+        .reset_index()
+    )
+    coverage["coverage"] = 100 * coverage["watched_seconds"] / coverage["video_duration"]
+    return coverage
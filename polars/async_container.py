@@ -0,0 +1,454 @@
+from fastavro import reader
+from avro_stream import AvroBlockDecoder
+from collections import defaultdict, deque
+from azure.core.exceptions import ResourceNotFoundError
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.storage.blob.aio import BlobPrefix, ContainerClient
+from listing import covered_prefix, is_after, is_compacted
+from constants import (
+    ASYNC_DOWNLOAD_CONCURRENCY,
+    COPY_POLL_INTERVAL,
+    DELETE_BATCH_SIZE,
+    STREAM_CHUNK_SIZE,
+)
+from metrics import Metrics
+import aiohttp
+import asyncio
+import io
+import re
+import threading
+
+
+class AsyncContainer:
+    """Container sobre azure.storage.blob.aio, para usar desde un bucle de eventos.
+
+    Todas las peticiones salen de un solo ContainerClient con una sola sesión de aiohttp,
+    así que comparten su pool de hasta max_connections conexiones en lugar de abrir
+    clientes y conexiones por blob. Se abre con open() (o async with) dentro del bucle en
+    el que se va a usar, y se cierra con close()."""
+
+    def __init__(
+        self,
+        container_name,
+        storage_connection_str,
+        metrics=None,
+        max_connections=ASYNC_DOWNLOAD_CONCURRENCY,
+    ):
+        self.container_name = container_name
+        self.storage_connection_str = storage_connection_str
+        self.metrics = metrics or Metrics()
+        self.max_connections = max_connections
+        self.session = None
+        self.container = None
+
+    async def open(self):
+        if self.container is None:
+            # los mismos ajustes que la sesión que abriría el transporte de Azure, pero
+            # con el límite de conexiones del pool
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                cookie_jar=aiohttp.DummyCookieJar(),
+                auto_decompress=False,
+                trust_env=True,
+            )
+            self.container = ContainerClient.from_connection_string(
+                self.storage_connection_str,
+                container_name=self.container_name,
+                transport=AioHttpTransport(session=self.session, session_owner=False),
+                max_single_get_size=STREAM_CHUNK_SIZE,
+                max_chunk_get_size=STREAM_CHUNK_SIZE,
+            )
+        return self
+
+    async def close(self):
+        if self.container is not None:
+            await self.container.close()
+            await self.session.close()
+            self.session, self.container = None, None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def retrieve_blob(self, path, backup_container=None):
+        if backup_container is not None:
+            fileReader = await self.download_blob(path)
+            if fileReader is None:
+                return defaultdict(lambda: None)
+            await backup_container.upload_blob(path, fileReader)
+            return next(reader(io.BytesIO(fileReader)))
+
+        # solo el primer registro, como Container.retrieve_blob
+        records = self.stream_blob(path)
+        try:
+            return await records.__anext__()
+        except ResourceNotFoundError:
+            return defaultdict(lambda: None)
+        finally:
+            await records.aclose()
+
+    async def download_blob(self, name):
+        """Contenido del blob, o None si no existe (una sola petición)."""
+        try:
+            return await self.fetch_blob(name)
+        except ResourceNotFoundError:
+            return None
+
+    async def fetch_blob(self, name):
+        """Contenido del blob; si no existe, ResourceNotFoundError."""
+        with self.metrics.timer("blob_download", "blob_download_seconds"):
+            downloader = await self.container.download_blob(name)
+            data = await downloader.readall()
+        self.metrics.count("downloaded_blobs")
+        self.metrics.count("downloaded_bytes", len(data))
+        return data
+
+    async def stream_blob(self, name, chunks=None, metadata=None):
+        """Registros del blob según llegan sus bloques (como Container.stream_blob)."""
+        downloader = await self.container.download_blob(name)
+        decoder = AvroBlockDecoder(metadata)
+        async for chunk in downloader.chunks():
+            self.metrics.count("downloaded_bytes", len(chunk))
+            if chunks is not None:
+                chunks.append(chunk)
+            for record in decoder.feed(chunk):
+                yield record
+        decoder.close()
+
+    async def decode_blob(self, name, decode, keep_data=False):
+        """(decode(registros del blob, metadatos), bytes del blob o None), como en
+        Container.decode_blob; decode recibe la lista de registros."""
+        chunks = [] if keep_data else None
+        metadata = {}
+        with self.metrics.timer("blob_download", "blob_download_seconds"):
+            records = [record async for record in self.stream_blob(name, chunks, metadata)]
+        self.metrics.count("downloaded_blobs")
+        return decode(records, metadata), b"".join(chunks) if keep_data else None
+
+    async def download_blobs(self, blob_names, max_concurrency=ASYNC_DOWNLOAD_CONCURRENCY):
+        """Descarga los blobs con hasta max_concurrency peticiones en vuelo y los
+        devuelve como (nombre, bytes) en el mismo orden en que se han pedido."""
+        async for name, data in self.__in_order(blob_names, self.fetch_blob, max_concurrency):
+            yield name, data
+
+    async def stream_blobs(
+        self, blob_names, decode, max_concurrency=ASYNC_DOWNLOAD_CONCURRENCY, keep_data=False
+    ):
+        """Como download_blobs, pero con decode_blob: devuelve (nombre, decodificado,
+        bytes), con bytes None salvo con keep_data."""
+        blobs = self.__in_order(
+            blob_names, lambda name: self.decode_blob(name, decode, keep_data), max_concurrency
+        )
+        async for name, (decoded, data) in blobs:
+            yield name, decoded, data
+
+    async def __in_order(self, blob_names, fetch, max_concurrency):
+        pending = deque()
+        try:
+            for name in blob_names:
+                pending.append((name, asyncio.ensure_future(fetch(name))))
+                if len(pending) >= max_concurrency:
+                    name, task = pending.popleft()
+                    yield name, await self.__wait(task)
+            while pending:
+                name, task = pending.popleft()
+                yield name, await self.__wait(task)
+        finally:
+            # si el consumidor corta antes, se cancelan las descargas que quedan
+            for _, task in pending:
+                task.cancel()
+
+    async def __wait(self, task):
+        with self.metrics.timer("download"):
+            return await task
+
+    async def upload_blob(self, name, data):
+        await self.container.upload_blob(name=name, data=data, overwrite=True)
+
+    async def list_blobs(self, pattern=".*", from_blob="", manifest=None, start=None, end=None):
+        p = re.compile(pattern)
+
+        skip = self.__skip_prefix(manifest, start, end)
+
+        with self.metrics.timer("list"):
+            blob_names = [
+                b.name
+                async for b in self.__list_blobs_from(
+                    "",
+                    from_blob,
+                    self.__day_prefix(from_blob),
+                    lambda name: p.search(name) is not None
+                    and name >= from_blob
+                    and not self.__skip_compacted(name, skip),
+                    skip,
+                    self.__known_prefix(manifest),
+                )
+                if manifest is None or not manifest.skip(b.name, b.size, start, end)
+            ]
+        return blob_names
+
+    async def list_blobs_after(self, after="", manifest=None, start=None, end=None):
+        """Blobs con nombre posterior a after, en orden de nombre, recorriendo solo los
+        prefijos que pueden tenerlos y, con un manifest, sin listar los que según él no
+        tienen nada que leer (como Container.list_blobs_after)."""
+        skip = self.__skip_prefix(manifest, start, end)
+        async for blob in self.__list_blobs_from(
+            "",
+            after,
+            self.__day_prefix(after),
+            lambda name: is_after(name, after) and not self.__skip_compacted(name, skip),
+            skip,
+            self.__known_prefix(manifest),
+        ):
+            if manifest is None or not manifest.skip(blob.name, blob.size, start, end):
+                yield blob
+
+    @staticmethod
+    def __day_prefix(after):
+        if after.count("/") <= 3:
+            return ""
+        return after.rsplit("/", 3)[0] + "/"
+
+    @classmethod
+    def __known_prefix(cls, manifest):
+        # día del último blob del que el manifiesto tiene todo lo anterior: hasta él se
+        # recorren los prefijos para descartar los que no hay que listar
+        if manifest is None or manifest.covered is None:
+            return ""
+        return cls.__day_prefix(manifest.covered[1])
+
+    @staticmethod
+    def __skip_prefix(manifest, start, end):
+        if manifest is None:
+            return None
+        return lambda prefix: manifest.skip_prefix(prefix, start, end)
+
+    @staticmethod
+    def __skip_compacted(name, skip):
+        # un blob compactado se descarta si se descarta el prefijo de sus originales
+        return skip is not None and is_compacted(name) and skip(covered_prefix(name))
+
+    async def __list_blobs_from(
+        self, prefix, after, day_prefix, keep, skip=None, known_prefix=""
+    ):
+        walk = after.startswith(prefix) and len(prefix) < len(day_prefix)
+        walk = walk or (prefix < known_prefix and len(prefix) < len(known_prefix))
+        if not walk:
+            async for blob in self.container.list_blobs(name_starts_with=prefix or None):
+                if keep(blob.name):
+                    yield blob
+            return
+
+        async for item in self.container.walk_blobs(
+            name_starts_with=prefix or None, delimiter="/"
+        ):
+            if isinstance(item, BlobPrefix):
+                if (after.startswith(item.name) or item.name > after) and not (
+                    skip is not None and skip(item.name)
+                ):
+                    async for blob in self.__list_blobs_from(
+                        item.name, after, day_prefix, keep, skip, known_prefix
+                    ):
+                        yield blob
+            elif keep(item.name):
+                yield item
+
+    async def delete_blobs(self, pattern=".*", from_blob="", blob_names=None):
+        """Borra los blobs de blob_names o, si es None, los que list_blobs(pattern,
+        from_blob) devuelve, DELETE_BATCH_SIZE por petición y con todos los lotes en
+        vuelo a la vez. Devuelve cuántos se han borrado."""
+        if blob_names is None:
+            blob_names = await self.list_blobs(pattern, from_blob)
+
+        batches = [
+            blob_names[start : start + DELETE_BATCH_SIZE]
+            for start in range(0, len(blob_names), DELETE_BATCH_SIZE)
+        ]
+        await asyncio.gather(*(self.container.delete_blobs(*batch) for batch in batches))
+        self.metrics.count("deleted_blobs", len(blob_names))
+
+        return len(blob_names)
+
+    async def copy_blobs(
+        self,
+        target_container,
+        pattern=".*",
+        from_blob="",
+        delete=False,
+        blob_names=None,
+        max_concurrency=ASYNC_DOWNLOAD_CONCURRENCY,
+    ):
+        """Copia a target_container (otro AsyncContainer abierto en el mismo bucle) los
+        blobs de blob_names o, si es None, los de list_blobs(pattern, from_blob), y con
+        delete los borra después de aquí. Como en Container.copy_blobs, la copia la hace
+        Azure y el origen se lee con la credencial del destino, salvo si target_container
+        es de otra cuenta: entonces cada blob se descarga y se sube desde aquí."""
+        if blob_names is None:
+            blob_names = await self.list_blobs(pattern, from_blob)
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+        await asyncio.gather(
+            *(self.__copy_blob(target_container, name, semaphore) for name in blob_names)
+        )
+
+        if delete:
+            await self.delete_blobs(blob_names=blob_names)
+
+    async def __copy_blob(self, target_container, name, semaphore):
+        source_client = self.container.get_blob_client(name)
+        target_client = target_container.container.get_blob_client(name)
+
+        async with semaphore:
+            if target_container.container.account_name != self.container.account_name:
+                with self.metrics.timer("blob_copy", "blob_copy_seconds"):
+                    await target_container.upload_blob(name, await self.fetch_blob(name))
+                self.metrics.count("copied_blobs")
+                return
+            with self.metrics.timer("blob_copy", "blob_copy_seconds"):
+                copy = await target_client.start_copy_from_url(source_client.url)
+                status = copy["copy_status"]
+                while status == "pending":
+                    await asyncio.sleep(COPY_POLL_INTERVAL)
+                    status = (await target_client.get_blob_properties()).copy.status
+
+        if status != "success":
+            raise RuntimeError(f"copy of blob {name} finished with status {status}")
+        self.metrics.count("copied_blobs")
+
+
+class EventLoopContainer:
+    """Container (el mismo interfaz síncrono) cuyas peticiones las hace un AsyncContainer
+    en un bucle de eventos en segundo plano, compartido por todos los EventLoopContainer.
+
+    Sirve para los cargadores de Events sin cambiarlos: download_blobs deja hasta
+    max_concurrency descargas en vuelo en el bucle (cientos, con
+    max_concurrency=ASYNC_DOWNLOAD_CONCURRENCY) sin un hilo por descarga, mientras el
+    cargador procesa los ficheros que ya han llegado."""
+
+    def __init__(
+        self,
+        container_name,
+        storage_connection_str,
+        metrics=None,
+        max_connections=ASYNC_DOWNLOAD_CONCURRENCY,
+    ):
+        self.container_name = container_name
+        self.storage_connection_str = storage_connection_str
+        self.metrics = metrics or Metrics()
+        self.loop = _event_loop()
+        self.container = AsyncContainer(
+            container_name, storage_connection_str, self.metrics, max_connections
+        )
+        self.__run(self.container.open())
+
+    def __run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def close(self):
+        self.__run(self.container.close())
+
+    def retrieve_blob(self, path, backup_container=None):
+        backup = backup_container.container if backup_container is not None else None
+        return self.__run(self.container.retrieve_blob(path, backup))
+
+    def download_blob(self, name):
+        return self.__run(self.container.download_blob(name))
+
+    def upload_blob(self, name, data):
+        self.__run(self.container.upload_blob(name, data))
+
+    def download_blobs(self, blob_names, max_concurrency=ASYNC_DOWNLOAD_CONCURRENCY):
+        """Como Container.download_blobs. Los nombres se piden aquí, en el hilo del
+        consumidor, porque pueden venir de list_blobs_after, que también usa el bucle."""
+        return self.__in_order(blob_names, self.container.fetch_blob, max_concurrency)
+
+    def stream_blobs(
+        self, blob_names, decode, max_concurrency=ASYNC_DOWNLOAD_CONCURRENCY, keep_data=False
+    ):
+        """Como Container.stream_blobs; decode se aplica en el bucle de eventos."""
+        blobs = self.__in_order(
+            blob_names,
+            lambda name: self.container.decode_blob(name, decode, keep_data),
+            max_concurrency,
+        )
+        for name, (decoded, data) in blobs:
+            yield name, decoded, data
+
+    def __in_order(self, blob_names, fetch, max_concurrency):
+        pending = deque()
+        try:
+            for name in blob_names:
+                pending.append(
+                    (name, asyncio.run_coroutine_threadsafe(fetch(name), self.loop))
+                )
+                if len(pending) >= max_concurrency:
+                    name, future = pending.popleft()
+                    yield name, self.__wait(future)
+            while pending:
+                name, future = pending.popleft()
+                yield name, self.__wait(future)
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+    def __wait(self, future):
+        with self.metrics.timer("download"):
+            return future.result()
+
+    def list_blobs(self, pattern=".*", from_blob="", manifest=None, start=None, end=None):
+        return self.__run(self.container.list_blobs(pattern, from_blob, manifest, start, end))
+
+    def list_blobs_after(self, after="", manifest=None, start=None, end=None):
+        return self.metrics.timed_iter(
+            "list", self.__iterate(self.container.list_blobs_after(after, manifest, start, end))
+        )
+
+    def __iterate(self, blobs):
+        # recorre un generador asíncrono del bucle, elemento a elemento
+        try:
+            while True:
+                try:
+                    yield self.__run(blobs.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            self.__run(blobs.aclose())
+
+    def delete_blobs(self, pattern=".*", from_blob="", blob_names=None):
+        return self.__run(self.container.delete_blobs(pattern, from_blob, blob_names))
+
+    def copy_blobs(
+        self,
+        target_container,
+        pattern=".*",
+        from_blob="",
+        delete=False,
+        blob_names=None,
+        max_concurrency=ASYNC_DOWNLOAD_CONCURRENCY,
+    ):
+        self.__run(
+            self.container.copy_blobs(
+                target_container.container,
+                pattern,
+                from_blob,
+                delete,
+                blob_names,
+                max_concurrency,
+            )
+        )
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _event_loop():
+    # bucle de eventos compartido, en un hilo que se arranca la primera vez
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, daemon=True).start()
+        return _loop
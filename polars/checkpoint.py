@@ -0,0 +1,130 @@
+from fastavro import writer
+from container import Container
+from constants import CHECKPOINT_INTERVAL, INGESTION_PREFIX
+from pathlib import Path
+import io
+import json
+import os
+import time
+
+
+METADATA_SCHEMA = {
+    "type": "record",
+    "name": "events_metadata",
+    "fields": [
+        {"name": "batch_first_events_file", "type": ["null", "string"]},
+        {"name": "batch_last_events_file", "type": ["null", "string"]},
+    ],
+}
+
+
+class LocalCheckpoint:
+    """Checkpoint de ingesta guardado en un fichero JSON local."""
+
+    def __init__(self, path="events_metadata.json"):
+        self.path = Path(path)
+
+    def load(self):
+        """Último fichero procesado, o "" si todavía no hay checkpoint."""
+        try:
+            with open(self.path) as f:
+                metadata = json.load(f)
+        except FileNotFoundError:
+            return ""
+        return metadata["batch_last_events_file"] or ""
+
+    def save(self, batch_first_events_file, batch_last_events_file):
+        if batch_last_events_file is None:
+            # lote vacío: se conserva el checkpoint anterior
+            return
+
+        metadata = {
+            "batch_first_events_file": batch_first_events_file,
+            "batch_last_events_file": batch_last_events_file,
+        }
+
+        # Se escribe en un temporal y se renombra, para que una ejecución que se corte a
+        # mitad nunca deje un checkpoint a medio escribir
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(metadata, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class BlobCheckpoint:
+    """Checkpoint de ingesta guardado como blob Avro en un contenedor de Azure. Por
+    defecto va bajo INGESTION_PREFIX, así que puede estar en el propio contenedor de la
+    captura sin que se lea como un blob de eventos."""
+
+    def __init__(
+        self,
+        container_name,
+        storage_connection_str,
+        path=INGESTION_PREFIX + "events_metadata.avro",
+    ):
+        self.container_name = container_name
+        self.storage_connection_str = storage_connection_str
+        self.path = path
+
+    def load(self):
+        """Último blob procesado, o "" si todavía no hay checkpoint."""
+        container = Container(self.container_name, self.storage_connection_str)
+        metadata = container.retrieve_blob(self.path)
+        container.close()
+        return metadata["batch_last_events_file"] or ""
+
+    def save(self, batch_first_events_file, batch_last_events_file):
+        if batch_last_events_file is None:
+            # lote vacío: se conserva el checkpoint anterior
+            return
+
+        fo = io.BytesIO()
+        writer(
+            fo,
+            METADATA_SCHEMA,
+            [
+                {
+                    "batch_first_events_file": batch_first_events_file,
+                    "batch_last_events_file": batch_last_events_file,
+                }
+            ],
+        )
+
+        # Un upload_blob con overwrite sustituye el blob completo de forma atómica
+        container = Container(self.container_name, self.storage_connection_str)
+        container.upload_blob(self.path, fo.getvalue())
+        container.close()
+
+
+class PeriodicCheckpoint:
+    """Checkpoint que lleva el cursor en memoria y solo lo escribe en checkpoint (un
+    LocalCheckpoint o BlobCheckpoint) cada interval segundos y con flush. Es el del modo
+    follow, en el que llega un lote cada pocos segundos."""
+
+    def __init__(self, checkpoint, interval=CHECKPOINT_INTERVAL):
+        self.checkpoint = checkpoint
+        self.interval = interval
+        self.cursor = None
+        self.pending = None
+        self.saved_at = time.monotonic()
+
+    def load(self):
+        if self.cursor is None:
+            self.cursor = self.checkpoint.load()
+        return self.cursor
+
+    def save(self, batch_first_events_file, batch_last_events_file):
+        if batch_last_events_file is None:
+            return
+        self.cursor = batch_last_events_file
+        self.pending = (batch_first_events_file, batch_last_events_file)
+        if time.monotonic() - self.saved_at >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if self.pending is not None:
+            self.checkpoint.save(*self.pending)
+            self.pending = None
+        self.saved_at = time.monotonic()
@@ -1,6 +1,27 @@
 BLOB_CONTAINER_NAME = "capture"
-
-
-
-
-
+DOWNLOAD_CONCURRENCY = 8
+# Blobs por petición del API de lotes de Azure (su máximo)
+DELETE_BATCH_SIZE = 256
+# Segundos entre consultas del estado de una copia en el servidor
+COPY_POLL_INTERVAL = 1
+# Peticiones en vuelo (y conexiones del pool) de los contenedores asíncronos: las
+# descargas de un bucle de eventos no ocupan un hilo cada una
+ASYNC_DOWNLOAD_CONCURRENCY = 256
+# Bytes de cada petición de una descarga (también de la primera): las descargas por
+# trozos se decodifican según llegan, bloque a bloque
+STREAM_CHUNK_SIZE = 4 * 1024 * 1024
+# Ficheros compactados (compaction.py): sufijo de su nombre, clave de sus metadatos con
+# los ficheros originales y códec con el que se comprimen
+COMPACTED_SUFFIX = ".compacted.avro"
+COMPACTION_METADATA = "capture.files"
+COMPACTION_CODEC = "deflate"
+# Prefijo de los blobs de estado de la ingesta (el checkpoint), fuera del árbol de la
+# captura (upctevents/): el listado de blobs de captura no los devuelve
+INGESTION_PREFIX = "ingestion/"
+# Modo follow: segundos entre listados del contenedor (y máximo que se espera a inotify
+# antes de volver a mirar la carpeta), segundos entre guardados del checkpoint y segundos
+# sin modificarse tras los que se da por completo un fichero local que no se ha visto
+# escribir
+FOLLOW_POLL_INTERVAL = 2
+CHECKPOINT_INTERVAL = 30
+SETTLE_SECONDS = 1
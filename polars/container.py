@@ -1,85 +1,301 @@
 from fastavro import reader
-from collections import defaultdict
-from azure.storage.blob import ContainerClient
+from avro_stream import stream_records
+from collections import defaultdict, deque
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import BlobPrefix, ContainerClient
+from listing import covered_prefix, is_after, is_compacted
+from constants import (
+    COPY_POLL_INTERVAL,
+    DELETE_BATCH_SIZE,
+    DOWNLOAD_CONCURRENCY,
+    STREAM_CHUNK_SIZE,
+)
+from metrics import Metrics
 import io
 import re
+import time
 
 
 class Container:
-    def __init__(self, container_name, storage_connection_str):
+    def __init__(self, container_name, storage_connection_str, metrics=None):
+        # las descargas llegan en trozos de STREAM_CHUNK_SIZE (también el primero), que
+        # stream_blob decodifica según llegan
         self.container = ContainerClient.from_connection_string(
-            storage_connection_str, container_name=container_name
+            storage_connection_str,
+            container_name=container_name,
+            max_single_get_size=STREAM_CHUNK_SIZE,
+            max_chunk_get_size=STREAM_CHUNK_SIZE,
         )
         self.container_name = container_name
+        self.storage_connection_str = storage_connection_str
+        # listados, descargas y copias; Events usa las mismas salvo que se le pasen otras
+        self.metrics = metrics or Metrics()
 
     def retrieve_blob(self, path, backup_container=None):
-        blob_client = ContainerClient.get_blob_client(self.container, blob=path)
-
-        if blob_client.exists():
-            fileReader = blob_client.download_blob().readall()
-            fo = io.BytesIO(fileReader)
-            object = next(reader(fo))
-
-            if backup_container is not None:
-                ContainerClient.upload_blob(
-                    backup_container.container,
-                    name=path,
-                    data=fileReader,
-                    overwrite=True,
-                )
-        else:
-            object = defaultdict(lambda: None)
+        if backup_container is not None:
+            # para la copia hace falta el blob entero
+            fileReader = self.download_blob(path)
+            if fileReader is None:
+                return defaultdict(lambda: None)
+            backup_container.upload_blob(path, fileReader)
+            return next(reader(io.BytesIO(fileReader)))
+
+        # solo el primer registro: se deja de descargar al completar el primer bloque
+        try:
+            with closing(self.stream_blob(path)) as records:
+                return next(records)
+        except ResourceNotFoundError:
+            return defaultdict(lambda: None)
+
+    def download_blob(self, name):
+        """Contenido del blob, o None si no existe. Es una sola petición: el 404 de la
+        descarga dice que no existe, sin preguntar antes con exists()."""
+        try:
+            return self.container.download_blob(name).readall()
+        except ResourceNotFoundError:
+            return None
+
+    def upload_blob(self, name, data):
+        self.container.upload_blob(name=name, data=data, overwrite=True)
+
+    def stream_blob(self, name, chunks=None, metadata=None):
+        """Registros del blob según llegan sus bloques, sin tener entero en memoria el
+        fichero (como mucho un bloque y un trozo de la descarga). Con una lista en chunks
+        se le añaden además los trozos descargados, p. ej. para copiarlo después, y con un
+        dict en metadata los metadatos de su cabecera."""
+        return stream_records(self.__chunks(name, chunks), metadata)
+
+    def __chunks(self, name, chunks):
+        for chunk in self.container.download_blob(name).chunks():
+            self.metrics.count("downloaded_bytes", len(chunk))
+            if chunks is not None:
+                chunks.append(chunk)
+            yield chunk
+
+    def decode_blob(self, name, decode, keep_data=False):
+        """(decode(registros del blob, metadatos), bytes del blob), con los registros de
+        stream_blob; los metadatos de la cabecera están en el dict en cuanto se empiezan a
+        recorrer los registros. Los bytes solo se guardan con keep_data (si no, None)."""
+        chunks = [] if keep_data else None
+        metadata = {}
+        with self.metrics.timer("blob_download", "blob_download_seconds"):
+            decoded = decode(self.stream_blob(name, chunks, metadata), metadata)
+        self.metrics.count("downloaded_blobs")
+        return decoded, b"".join(chunks) if keep_data else None
 
-        return object
+    def download_blobs(self, blob_names, max_concurrency=DOWNLOAD_CONCURRENCY):
+        """Descarga los blobs con hasta max_concurrency peticiones en vuelo y los
+        devuelve como (nombre, bytes) en el mismo orden en que se han pedido."""
+        return self.__in_order(blob_names, self.__download_blob, max_concurrency)
+
+    def stream_blobs(
+        self, blob_names, decode, max_concurrency=DOWNLOAD_CONCURRENCY, keep_data=False
+    ):
+        """Como download_blobs, pero cada blob se decodifica con decode_blob en el hilo
+        que lo descarga, según llegan sus bloques: devuelve (nombre, decodificado, bytes),
+        con bytes None salvo con keep_data."""
+        blobs = self.__in_order(
+            blob_names, lambda name: self.decode_blob(name, decode, keep_data), max_concurrency
+        )
+        for name, (decoded, data) in blobs:
+            yield name, decoded, data
+
+    def __in_order(self, blob_names, fetch, max_concurrency):
+        # fetch(nombre) de cada blob en un pool de hilos, devueltos en orden
+        executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        pending = deque()
+        try:
+            for name in blob_names:
+                pending.append((name, executor.submit(fetch, name)))
+                if len(pending) >= max_concurrency:
+                    name, future = pending.popleft()
+                    yield name, self.__wait(future)
+            while pending:
+                name, future = pending.popleft()
+                yield name, self.__wait(future)
+        finally:
+            # si el consumidor corta antes (MAX_EVENTS), no se lanzan más descargas
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def __wait(self, future):
+        # "download" es lo que el consumidor espera a las descargas, no su suma
+        with self.metrics.timer("download"):
+            return future.result()
+
+    def __download_blob(self, name):
+        with self.metrics.timer("blob_download", "blob_download_seconds"):
+            data = self.container.download_blob(name).readall()
+        self.metrics.count("downloaded_blobs")
+        self.metrics.count("downloaded_bytes", len(data))
+        return data
 
     def close(self):
         self.container.close()
 
-    def list_blobs(self, pattern=".*", from_blob=""):
-        blob_list = self.container.list_blobs()
-
+    def list_blobs(self, pattern=".*", from_blob="", manifest=None, start=None, end=None):
         p = re.compile(pattern)
 
-        blob_names = [
-            b.name
-            for b in blob_list
-            if (p.search(b.name) is not None and b.name >= from_blob)
-        ]
+        skip = self.__skip_prefix(manifest, start, end)
+
+        with self.metrics.timer("list"):
+            blob_names = [
+                b.name
+                for b in self.__list_blobs_from(
+                    "",
+                    from_blob,
+                    self.__day_prefix(from_blob),
+                    lambda name: p.search(name) is not None
+                    and name >= from_blob
+                    and not self.__skip_compacted(name, skip),
+                    skip,
+                    self.__known_prefix(manifest),
+                )
+                if manifest is None or not manifest.skip(b.name, b.size, start, end)
+            ]
         return blob_names
 
-    def delete_blobs(self, pattern=".*", from_blob=""):
-        container = self.container
+    def list_blobs_after(self, after="", manifest=None, start=None, end=None):
+        """Blobs con nombre posterior a after (o compactados con algún blob original
+        posterior, ver listing.is_after), en orden de nombre.
 
-        p = re.compile(pattern)
+        En lugar de listar todo el contenedor se baja por la ruta de after
+        (upctevents/upctforma/<partición>/YYYY/MM/DD) y solo se listan los prefijos que
+        pueden contener blobs posteriores: cada partición, año, mes o día posterior con un
+        name_starts_with y el día de after filtrando por nombre. Así el coste del listado
+        depende de los datos nuevos y no de todo el histórico del contenedor.
 
-        blob_list = container.list_blobs()
-        blob_list = [
-            b
-            for b in blob_list
-            if (p.search(b.name) is not None and b.name >= from_blob)
-        ]
+        Con un manifest se descartan además los blobs que según él están vacíos o no
+        tienen eventos con timestamp en [start, end], y los prefijos que ya conoce
+        (Manifest.covered) en los que no hay ninguno que leer ni siquiera se listan: solo
+        se lista entero lo posterior al último blob que tiene."""
+        skip = self.__skip_prefix(manifest, start, end)
+        blobs = self.__list_blobs_from(
+            "",
+            after,
+            self.__day_prefix(after),
+            lambda name: is_after(name, after) and not self.__skip_compacted(name, skip),
+            skip,
+            self.__known_prefix(manifest),
+        )
+        if manifest is not None:
+            blobs = (
+                blob for blob in blobs if not manifest.skip(blob.name, blob.size, start, end)
+            )
+        return self.metrics.timed_iter("list", blobs)
 
-        for blob in blob_list:
+    @staticmethod
+    def __day_prefix(after):
+        # upctevents/upctforma/0/2023/06/01/00/00/00.avro -> upctevents/upctforma/0/2023/06/01/
+        if after.count("/") <= 3:
+            return ""
+        return after.rsplit("/", 3)[0] + "/"
 
-            container.delete_blob(blob.name)
+    @classmethod
+    def __known_prefix(cls, manifest):
+        # día del último blob del que el manifiesto tiene todo lo anterior: hasta él se
+        # recorren los prefijos para descartar los que no hay que listar
+        if manifest is None or manifest.covered is None:
+            return ""
+        return cls.__day_prefix(manifest.covered[1])
 
-            print(f"blob {blob.name} deleted from {container.container_name}")
+    @staticmethod
+    def __skip_prefix(manifest, start, end):
+        if manifest is None:
+            return None
+        return lambda prefix: manifest.skip_prefix(prefix, start, end)
 
-    def copy_blobs(self, target_container, pattern=".*", from_blob="", delete=False):
+    @staticmethod
+    def __skip_compacted(name, skip):
+        # un blob compactado se descarta si se descarta el prefijo de sus originales
+        return skip is not None and is_compacted(name) and skip(covered_prefix(name))
 
-        container = self.container
+    def __list_blobs_from(self, prefix, after, day_prefix, keep, skip=None, known_prefix=""):
+        walk = after.startswith(prefix) and len(prefix) < len(day_prefix)
+        # los prefijos que conoce el manifiesto también se recorren, hasta el día
+        walk = walk or (prefix < known_prefix and len(prefix) < len(known_prefix))
+        if not walk:
+            # todo el prefijo es posterior a after (y a lo que conoce el manifiesto), o es
+            # ya un día: listado plano
+            for blob in self.container.list_blobs(name_starts_with=prefix or None):
+                if keep(blob.name):
+                    yield blob
+            return
 
-        p = re.compile(pattern)
+        for item in self.container.walk_blobs(name_starts_with=prefix or None, delimiter="/"):
+            if isinstance(item, BlobPrefix):
+                # los prefijos anteriores a after (y que no lo contienen) se descartan
+                # enteros, igual que los que según el manifiesto no hay que leer
+                if (after.startswith(item.name) or item.name > after) and not (
+                    skip is not None and skip(item.name)
+                ):
+                    yield from self.__list_blobs_from(
+                        item.name, after, day_prefix, keep, skip, known_prefix
+                    )
+            elif keep(item.name):
+                yield item
+
+    def delete_blobs(self, pattern=".*", from_blob="", blob_names=None):
+        """Borra los blobs de blob_names o, si es None, los que list_blobs(pattern,
+        from_blob) devuelve. Se borran con el API de lotes, DELETE_BATCH_SIZE por
+        petición, en lugar de una petición por blob. Devuelve cuántos se han borrado."""
+        if blob_names is None:
+            blob_names = self.list_blobs(pattern, from_blob)
+
+        for start in range(0, len(blob_names), DELETE_BATCH_SIZE):
+            batch = blob_names[start : start + DELETE_BATCH_SIZE]
+            self.container.delete_blobs(*batch)
+            self.metrics.count("deleted_blobs", len(batch))
 
-        blob_list = container.list_blobs()
-        blob_list = [
-            b
-            for b in blob_list
-            if (p.search(b.name) is not None and b.name >= from_blob)
-        ]
+        return len(blob_names)
 
-        for blob in blob_list:
-            _ = self.retrieve_blob(blob.name, backup_container=target_container)
+    def copy_blobs(
+        self,
+        target_container,
+        pattern=".*",
+        from_blob="",
+        delete=False,
+        blob_names=None,
+        max_concurrency=DOWNLOAD_CONCURRENCY,
+    ):
+        """Copia a target_container los blobs de blob_names o, si es None, los que
+        list_blobs(pattern, from_blob) devuelve, y con delete los borra después de aquí.
+
+        La copia la hace Azure de contenedor a contenedor (copy from URL), sin que los
+        datos pasen por aquí; se lanzan y se espera a que terminen hasta max_concurrency
+        a la vez. El listado se hace una sola vez y sirve también para el borrado. El
+        origen se lee con la credencial del destino, así que eso solo vale dentro de una
+        misma cuenta de almacenamiento: si target_container es de otra, cada blob se
+        descarga y se sube desde aquí."""
+        if blob_names is None:
+            blob_names = self.list_blobs(pattern, from_blob)
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            for _ in executor.map(
+                lambda name: self.__copy_blob(target_container, name), blob_names
+            ):
+                pass
 
         if delete:
-            self.delete_blobs(pattern, from_blob=from_blob)
+            self.delete_blobs(blob_names=blob_names)
+
+    def __copy_blob(self, target_container, name):
+        if target_container.container.account_name != self.container.account_name:
+            with self.metrics.timer("blob_copy", "blob_copy_seconds"):
+                target_container.upload_blob(name, self.download_blob(name))
+            self.metrics.count("copied_blobs")
+            return
+
+        source_client = ContainerClient.get_blob_client(self.container, blob=name)
+        target_client = ContainerClient.get_blob_client(target_container.container, blob=name)
+
+        with self.metrics.timer("blob_copy", "blob_copy_seconds"):
+            status = target_client.start_copy_from_url(source_client.url)["copy_status"]
+            while status == "pending":
+                time.sleep(COPY_POLL_INTERVAL)
+                status = target_client.get_blob_properties().copy.status
+
+        if status != "success":
+            raise RuntimeError(f"copy of blob {name} finished with status {status}")
+        self.metrics.count("copied_blobs")
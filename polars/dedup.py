@@ -0,0 +1,135 @@
+from pathlib import Path
+import numpy as np
+import os
+import polars as pl
+
+
+# Un evento repetido (la captura entrega al menos una vez, o se recarga con un after
+# antiguo) tiene los mismos valores en estas columnas
+DEDUP_KEYS = ["user", "activity", "timestamp", "type", "element"]
+
+# Días que se recuerdan los eventos ya vistos
+RETENTION_DAYS = 7
+
+
+def event_hashes(events):
+    """Hash (uint64) de DEDUP_KEYS de cada evento, calculado sobre toda la columna. Las
+    categóricas se pasan a texto antes, porque su código depende de la caché de cadenas
+    del proceso. El hash de polars puede cambiar entre versiones de polars: al
+    actualizarlo, los eventos vistos guardados dejan de reconocerse."""
+    return (
+        events.select(DEDUP_KEYS)
+        .with_columns(pl.col(pl.Categorical).cast(pl.Utf8))
+        .hash_rows(seed=0, seed_1=1, seed_2=2, seed_3=3)
+        .to_numpy()
+    )
+
+
+class SeenEvents:
+    """Hashes de los eventos ya cargados, partidos por día, para quitar los repetidos
+    sin volver a leer lo cargado antes.
+
+    Cada día es un array ordenado de hashes (8 bytes por evento), y solo se guardan los
+    retention_days días anteriores al evento más reciente visto: la memoria no crece con
+    el histórico. Los eventos de días ya olvidados no se pueden comprobar y se dejan pasar.
+
+    Esta se queda en memoria (quita los repetidos de una misma carga o de los lotes de un
+    iter_batches); LocalSeenEvents la guarda además entre cargas."""
+
+    def __init__(self, retention_days=RETENTION_DAYS):
+        self.retention_days = retention_days
+        self.days = {}
+        self.changed_days = set()
+        self.newest_day = None
+
+    def load(self):
+        return self
+
+    def save(self):
+        pass
+
+    def deduplicate(self, events):
+        """events sin los eventos ya vistos ni los repetidos dentro del propio lote, y
+        con sus hashes añadidos a los vistos. Se comprueba por día, con búsqueda binaria
+        en el array de ese día."""
+        if events.height == 0:
+            return events
+        hashes = event_hashes(events)
+        days = events["timestamp"].cast(pl.Datetime("us")).to_numpy().astype("datetime64[D]")
+        # el primero de cada hash repetido en el lote
+        new = np.zeros(len(hashes), dtype=bool)
+        new[np.unique(hashes, return_index=True)[1]] = True
+
+        for day in np.unique(days):
+            in_day = days == day
+            seen = self._day(str(day))
+            positions = np.searchsorted(seen, hashes[in_day]).clip(max=len(seen) - 1)
+            if len(seen) > 0:
+                new[in_day] &= seen[positions] != hashes[in_day]
+            added = hashes[in_day & new]
+            if len(added) > 0:
+                self.days[str(day)] = np.union1d(seen, added)
+                self.changed_days.add(str(day))
+
+        newest_day = str(days.max())
+        self.newest_day = max(self.newest_day or newest_day, newest_day)
+        self.__expire()
+        return events.filter(pl.Series(new))
+
+    def _day(self, day):
+        # hashes vistos de un día (vacío si no hay ninguno)
+        return self.days.setdefault(day, np.empty(0, dtype=np.uint64))
+
+    def _known_days(self):
+        return set(self.days)
+
+    def __expire(self):
+        oldest_day = str(np.datetime64(self.newest_day) - self.retention_days)
+        for day in self._known_days():
+            if day < oldest_day:
+                self.days.pop(day, None)
+                self.changed_days.add(day)
+
+
+class LocalSeenEvents(SeenEvents):
+    """Eventos vistos guardados en una carpeta local, un fichero .npy por día. Solo se
+    leen los días que traen los lotes, y solo se reescriben los que cambian."""
+
+    def __init__(self, path="seen_events", retention_days=RETENTION_DAYS):
+        super().__init__(retention_days)
+        self.path = Path(path)
+        self.stored_days = set()
+
+    def load(self):
+        self.days, self.changed_days = {}, set()
+        # días guardados; sus hashes se leen cuando un lote trae eventos de ese día
+        self.stored_days = {path.stem for path in self.path.glob("*.npy")}
+        self.newest_day = max(self.stored_days, default=None)
+        return self
+
+    def save(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        for day in self.changed_days:
+            path = self.path / f"{day}.npy"
+            if day not in self.days:
+                # día olvidado (más antiguo que retention_days)
+                path.unlink(missing_ok=True)
+                self.stored_days.discard(day)
+                continue
+            tmp_path = path.with_name(path.name + ".tmp")
+            with open(tmp_path, "wb") as f:
+                np.save(f, self.days[day])
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            self.stored_days.add(day)
+        self.changed_days = set()
+
+    def _day(self, day):
+        if day not in self.days:
+            path = self.path / f"{day}.npy"
+            self.days[day] = np.load(path) if path.exists() else np.empty(0, dtype=np.uint64)
+        return self.days[day]
+
+    def _known_days(self):
+        return set(self.days) | self.stored_days
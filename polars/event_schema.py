@@ -0,0 +1,105 @@
+import datetime as dt
+import polars as pl
+
+
+# Campos de los eventos, en el orden en que quedan en el dataframe. Las columnas que no
+# están aquí (campos nuevos) se dejan al final tal como vienen
+EVENT_COLUMNS = [
+    "user",
+    "name",
+    "email",
+    "url",
+    "title",
+    "course",
+    "domain",
+    "activity",
+    "date",
+    "profile",
+    "timestamp",
+    "percentage",
+    "type",
+    "element",
+    "notes",
+    "description",
+    "unit_type",
+    "activity_title",
+    "time_spent",
+]
+
+# Campos que no traen todos los eventos: si no aparecen en el lote se añaden vacíos, para
+# que todos los lotes tengan las mismas columnas
+OPTIONAL_COLUMNS = ["time_spent", "unit_type"]
+
+# user, course y activity no se guardan como enteros: los usuarios anónimos vienen con su
+# IP y hay cursos y actividades con identificadores hexadecimales. Como se repiten en
+# muchas filas, van como categóricas, igual que el resto de campos con pocos valores
+EVENT_DTYPES = {
+    "user": pl.Categorical,
+    "name": pl.Categorical,
+    "email": pl.Categorical,
+    "url": pl.Utf8,
+    "title": pl.Categorical,
+    "course": pl.Categorical,
+    "domain": pl.Categorical,
+    "activity": pl.Categorical,
+    "date": pl.Utf8,
+    "profile": pl.Categorical,
+    "timestamp": pl.Datetime("us"),
+    "percentage": pl.Float64,
+    "type": pl.Categorical,
+    "element": pl.Categorical,
+    "notes": pl.Utf8,
+    "description": pl.Categorical,
+    "unit_type": pl.Categorical,
+    "activity_title": pl.Categorical,
+    "time_spent": pl.Float64,
+    "author": pl.Categorical,
+    "unit": pl.Categorical,
+}
+
+
+def cast_events(events):
+    """Aplica EVENT_DTYPES a los eventos recién parseados (DataFrame o LazyFrame), con
+    los campos de OPTIONAL_COLUMNS que falten como columnas nulas y en el orden de
+    EVENT_COLUMNS. timestamp pasa de segundos (texto o número) a datetime."""
+    columns = events.columns
+    missing = [column for column in OPTIONAL_COLUMNS if column not in columns]
+    events = events.with_columns(
+        [_cast(column) for column in columns if column in EVENT_DTYPES]
+        + [pl.lit(None, dtype=EVENT_DTYPES[column]).alias(column) for column in missing]
+    )
+    columns = columns + missing
+    return events.select(
+        [column for column in EVENT_COLUMNS if column in columns]
+        + [column for column in columns if column not in EVENT_COLUMNS]
+    )
+
+
+def enable_string_cache():
+    """Activa la caché global de cadenas de polars. Los lotes se convierten a categóricas
+    por separado, y solo con ella comparten las mismas categorías y se pueden concatenar
+    o unir entre sí (SessionBuilder, merge_rollups). La activan los cargadores (Events) al
+    empezar una carga; quien use cast_events por su cuenta tiene que activarla también, o
+    trabajar dentro de un pl.StringCache()."""
+    pl.enable_string_cache(True)
+
+
+def event_time(seconds):
+    """Timestamp en segundos como datetime comparable con la columna timestamp."""
+    return dt.datetime(1970, 1, 1) + dt.timedelta(seconds=seconds)
+
+
+def _cast(column):
+    dtype = EVENT_DTYPES[column]
+    if column == "timestamp":
+        # en microsegundos, redondeando, para no perder los decimales que trae el evento
+        return (
+            (pl.col(column).cast(pl.Float64) * 1_000_000)
+            .round(0)
+            .cast(pl.Int64)
+            .cast(dtype)
+        )
+    if dtype == pl.Categorical:
+        # si el primer evento traía el campo como número, se pasa antes a texto
+        return pl.col(column).cast(pl.Utf8).cast(dtype)
+    return pl.col(column).cast(dtype)
@@ -0,0 +1,128 @@
+from functools import reduce
+from event_schema import EVENT_COLUMNS, EVENT_DTYPES
+from ordering import merge_order
+import hashlib
+import operator
+import polars as pl
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+
+EVENT_STORE_PATH = "events_store"
+
+# Carpetas event_day=YYYY-MM-DD/course=<curso>; las claves se leen siempre como texto
+# (si no, arrow convertiría event_day en fecha y course en entero)
+PARTITIONING = ds.partitioning(
+    pa.schema([("event_day", pa.string()), ("course", pa.string())]), flavor="hive"
+)
+
+# Tipo en los Parquet de cada dtype de EVENT_DTYPES
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+ARROW_TYPES = {
+    pl.Categorical: CATEGORY,
+    pl.Utf8: pa.large_string(),
+    pl.Datetime("us"): pa.timestamp("us"),
+    pl.Float64: pa.float64(),
+}
+# Tramo de video_ranges (video.parse_notes)
+VIDEO_RANGE = pa.struct([("start", pa.float64()), ("end", pa.float64())])
+
+# Esquema fijo del almacén: los campos de event_schema (cast_events trae siempre los
+# opcionales), los que Events añade detrás y las claves de partición. Se escribe y se lee
+# con él, así que leer no abre los ficheros de fuera de los días y cursos pedidos
+STORE_SCHEMA = pa.schema(
+    [
+        (column, ARROW_TYPES[EVENT_DTYPES[column]])
+        for column in EVENT_COLUMNS
+        if column not in PARTITIONING.schema.names
+    ]
+    + [
+        ("day", pa.large_string()),
+        ("video_ranges", pa.large_list(pa.field("element", VIDEO_RANGE))),
+        ("video_duration", pa.float64()),
+        ("author", CATEGORY),
+        ("unit", CATEGORY),
+    ]
+    + list(PARTITIONING.schema)
+)
+
+
+def write_events(dataframe, batch, store=EVENT_STORE_PATH):
+    """Añade el dataframe de Events (DataFrame o LazyFrame), ya limpio (tipos de
+    event_schema y columnas author/unit), al almacén Parquet, con un fichero por
+    día y curso.
+
+    batch identifica el lote (su batch_last_events_file, o el cursor de iter_batches):
+    los ficheros se nombran a partir de él, así que exportar otra vez el mismo lote los
+    sobrescribe en lugar de duplicar los eventos.
+
+    Como el dataframe de Events ya está ordenado por timestamp, cada fichero que se
+    escribe es un tramo ordenado: añadir un lote no toca ni reordena los anteriores, y
+    scan_events(ordered=True) los mezcla al leer."""
+    dataframe = dataframe.lazy().collect()
+    if dataframe.shape[0] == 0:
+        return
+
+    table = dataframe.with_columns(
+        pl.col("timestamp").dt.strftime("%Y-%m-%d").alias("event_day"),
+        pl.col("course").cast(pl.Utf8),
+    ).to_arrow()
+    # polars exporta large_string y categóricas con índices uint32: se pasan a los tipos
+    # de STORE_SCHEMA (las claves de partición tienen que ser string)
+    ds.write_dataset(
+        table.select(STORE_SCHEMA.names).cast(STORE_SCHEMA),
+        store,
+        schema=STORE_SCHEMA,
+        format="parquet",
+        partitioning=PARTITIONING,
+        basename_template=f"part-{hashlib.sha1(batch.encode()).hexdigest()[:16]}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+
+
+def scan_events(
+    store=EVENT_STORE_PATH, first_day=None, last_day=None, courses=None, ordered=False
+):
+    """LazyFrame sobre el almacén. Los filter y select que se le apliquen (además de
+    first_day y last_day, "YYYY-MM-DD" incluidos, y courses) se pasan al dataset de
+    arrow al hacer collect: solo se abren las carpetas de los días y cursos pedidos y
+    solo se leen las columnas que se usan.
+
+    Con ordered, los eventos salen ordenados por timestamp: cada fichero ya lo está, así
+    que se leen ya (solo los de first_day, last_day y courses) y se mezclan
+    (ordering.merge_order) en lugar de ordenar todo lo leído."""
+    if ordered:
+        return _read_ordered(store, first_day, last_day, courses).lazy()
+    events = pl.scan_pyarrow_dataset(_dataset(store))
+    if first_day is not None:
+        events = events.filter(pl.col("event_day") >= first_day)
+    if last_day is not None:
+        events = events.filter(pl.col("event_day") <= last_day)
+    if courses is not None:
+        events = events.filter(pl.col("course").is_in(list(courses)))
+    return events
+
+
+def _read_ordered(store, first_day, last_day, courses):
+    conditions = []
+    if first_day is not None:
+        conditions.append(ds.field("event_day") >= first_day)
+    if last_day is not None:
+        conditions.append(ds.field("event_day") <= last_day)
+    if courses is not None:
+        conditions.append(ds.field("course").isin(list(courses)))
+
+    dataset = _dataset(store)
+    # __fragment_index dice de qué fichero viene cada fila
+    table = dataset.to_table(
+        columns=dataset.schema.names + ["__fragment_index"],
+        filter=reduce(operator.and_, conditions) if conditions else None,
+    )
+    order = merge_order(table["timestamp"].to_numpy(), table["__fragment_index"].to_numpy())
+    if order is not None:
+        table = table.take(order)
+    return pl.from_arrow(table.drop(["__fragment_index"]))
+
+
+def _dataset(store):
+    return ds.dataset(store, schema=STORE_SCHEMA, format="parquet", partitioning=PARTITIONING)
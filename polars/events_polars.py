@@ -1,203 +1,360 @@
 import polars as pl
-from fastavro import reader, writer
-from azure.storage.blob import ContainerClient
-import json
 import os
 import io
-import time
 from dotenv import load_dotenv
 import datetime as dt
 from container import Container
+from constants import CHECKPOINT_INTERVAL, DOWNLOAD_CONCURRENCY, FOLLOW_POLL_INTERVAL
+from ingestion import backup_blob, blob_batches, download_blobs, follow_blobs
+from decoding import decode_bodies
+from checkpoint import BlobCheckpoint, PeriodicCheckpoint
+from url_dimension import UrlDimension
+from dedup import SeenEvents
+from event_schema import cast_events, enable_string_cache, event_time
+from video import parse_notes
+from ordering import BATCH_ROW, sort_runs
 
 BACKUP_INTERMEDIATE_CONTAINER_NAME = "capture_processed"
 MAX_EVENTS = 100000
 
 class Events:
-    def __init__(self, events_container, bin_container=None, after=""):
+    def __init__(
+        self,
+        events_container,
+        bin_container=None,
+        after="",
+        max_concurrency=DOWNLOAD_CONCURRENCY,
+        checkpoint=None,
+        manifest=None,
+        start=None,
+        end=None,
+        metrics=None,
+        url_dimension=None,
+        seen_events=None,
+        stream=False,
+    ):
+        # las categóricas de todos los lotes comparten categorías (event_schema)
+        enable_string_cache()
+        # Sin after explícito se reanuda a partir del último blob del checkpoint
+        self.__checkpoint = checkpoint or self.__default_checkpoint(events_container)
+        after = after or self.__checkpoint.load()
+        # Con start/end (timestamps en segundos) solo se cargan los eventos de ese rango
+        self.__start, self.__end = start, end
+        # Tiempos por etapa y contadores de la carga; por defecto, los del contenedor
+        self.metrics = metrics or events_container.metrics
+        # author/unit/unit_type por url distinta; por defecto, solo para esta carga
+        self.__url_dimension = (url_dimension or UrlDimension()).load()
+        # hashes de los eventos ya vistos; por defecto, solo los de esta carga
+        self.__seen_events = (seen_events or SeenEvents()).load()
+
         # En lugar de contenedores, hay que definir carpetas
-        download_start_time = time.time()
-        self.__retrieve_events(events_container, bin_container, after)
+        self.__retrieve_events(
+            events_container, bin_container, after, max_concurrency, manifest, stream
+        )
+        # como resultado de lo anterior, se ha completado el atributo __bodies de self.
+        self.__build_dataframe()
+        self.__url_dimension.save()
 
-        # como resultado de lo anterior, se ha completado el atributo __events de self.
-        download_end_time = time.time()
-        download_time = download_end_time - download_start_time
-        processing_start_time = time.time() 
-        self.dataframe = pl.DataFrame(self.__events)
+    @classmethod
+    def iter_batches(
+        cls,
+        events_container,
+        bin_container=None,
+        after="",
+        batch_events=MAX_EVENTS,
+        max_concurrency=DOWNLOAD_CONCURRENCY,
+        checkpoint=None,
+        manifest=None,
+        start=None,
+        end=None,
+        metrics=None,
+        url_dimension=None,
+        seen_events=None,
+        stream=False,
+    ):
+        """Recorre todos los blobs posteriores a after en un solo proceso y devuelve por
+        cada lote (dataframe, cursor), con como mucho batch_events eventos por lote (salvo
+        un blob que por sí solo los supere). cursor es el último blob del lote: pasándolo
+        como after se reanuda a partir del lote siguiente.
 
-        if self.dataframe.shape[0] > 0:
-            # In some old events avro, problem: we drop them
-            # Filtramos las filas del df, luego usamos drop para eliminarlas
-            self.dataframe = self.dataframe.filter(
-                pl.col("percentage") != ""
-            )  # hay que quitarlo
-            self.dataframe = self.dataframe.select(
-                [col for col in self.dataframe.columns if col not in ["_id", "state"]]
-            )
-            self.dataframe = self.dataframe.with_columns(
-                pl.col("percentage").cast(float), pl.col("timestamp").cast(float)
+        Sin after explícito se empieza en el checkpoint, y cada cursor se guarda en él
+        cuando se pide el lote siguiente, es decir, cuando el anterior ya se ha procesado.
+
+        Con un manifest (LocalManifest o BlobManifest) no se descargan los blobs que según
+        él están vacíos o no tienen eventos en [start, end], y se guarda con cada lote.
+        Los tiempos y contadores de todos los lotes se acumulan en metrics (por defecto,
+        los de events_container).
+        Con url_dimension (p. ej. un LocalUrlDimension) la tabla url -> author/unit/
+        unit_type se reutiliza entre lotes y entre cargas y se guarda con cada lote.
+        Los eventos repetidos se quitan con seen_events (p. ej. un LocalSeenEvents para
+        reconocer también los de cargas anteriores), que se guarda con cada lote.
+        Con stream cada blob se decodifica según llegan sus bloques, sin tenerlo entero
+        en memoria (salvo para copiarlo a bin_container)."""
+        enable_string_cache()
+        checkpoint = checkpoint or cls.__default_checkpoint(events_container)
+        metrics = metrics or events_container.metrics
+        url_dimension = (url_dimension or UrlDimension()).load()
+        seen_events = (seen_events or SeenEvents()).load()
+        after = after or checkpoint.load()
+        if manifest is not None:
+            manifest.load()
+        try:
+            yield from blob_batches(
+                events_container,
+                events_container.list_blobs_after(after, manifest, start, end),
+                batch_events,
+                lambda bodies: cls.__from_bodies(
+                    bodies, metrics, url_dimension, seen_events, start, end
+                ).dataframe,
+                checkpoint,
+                [manifest, url_dimension, seen_events],
+                max_concurrency,
+                manifest,
+                metrics,
+                stream,
+                bin_container,
+                after,
             )
+        finally:
+            events_container.close()
+            if bin_container is not None:
+                bin_container.close()
 
-            if "time_spent" in self.dataframe.columns:
-                self.dataframe = self.dataframe.with_columns(
-                    pl.col("time_spent").cast(float)
+    @classmethod
+    def follow(
+        cls,
+        events_container,
+        callback,
+        bin_container=None,
+        after="",
+        batch_events=MAX_EVENTS,
+        max_concurrency=DOWNLOAD_CONCURRENCY,
+        checkpoint=None,
+        manifest=None,
+        start=None,
+        end=None,
+        metrics=None,
+        url_dimension=None,
+        seen_events=None,
+        stream=False,
+        poll_interval=FOLLOW_POLL_INTERVAL,
+        checkpoint_interval=CHECKPOINT_INTERVAL,
+        stop=None,
+    ):
+        """iter_batches sin fin, para ingerir casi en tiempo real: tras los blobs
+        posteriores a after vuelve a listar el contenedor cada poll_interval segundos
+        (list_blobs_after solo recorre los prefijos a partir del cursor, así que cada
+        consulta cuesta unas pocas peticiones) y procesa los blobs nuevos. Cada lote pasa
+        por el mismo proceso que en iter_batches y se entrega a callback(dataframe, cursor).
+
+        El cursor se lleva en memoria y se guarda en checkpoint como mucho cada
+        checkpoint_interval segundos (PeriodicCheckpoint) y al salir; manifest,
+        url_dimension y seen_events se guardan con cada lote, como en iter_batches. Se
+        sale al activarse stop (un threading.Event) o si callback lanza una excepción."""
+        enable_string_cache()
+        checkpoint = PeriodicCheckpoint(
+            checkpoint or cls.__default_checkpoint(events_container), checkpoint_interval
+        )
+        metrics = metrics or events_container.metrics
+        url_dimension = (url_dimension or UrlDimension()).load()
+        seen_events = (seen_events or SeenEvents()).load()
+        after = after or checkpoint.load()
+        if manifest is not None:
+            manifest.load()
+        follow_blobs(
+            events_container,
+            callback,
+            batch_events,
+            lambda bodies: cls.__from_bodies(
+                bodies, metrics, url_dimension, seen_events, start, end
+            ).dataframe,
+            checkpoint,
+            [manifest, url_dimension, seen_events],
+            max_concurrency,
+            manifest,
+            start,
+            end,
+            metrics,
+            stream,
+            bin_container,
+            after,
+            poll_interval,
+            stop,
+        )
+
+    @staticmethod
+    def __default_checkpoint(events_container):
+        return BlobCheckpoint(
+            events_container.container_name, events_container.storage_connection_str
+        )
+
+    @staticmethod
+    def __save_manifest(manifest):
+        if manifest is not None:
+            manifest.save()
+
+    @classmethod
+    def __from_bodies(
+        cls, bodies, metrics, url_dimension, seen_events, start=None, end=None
+    ):
+        # Events de un lote ya descargado, sin pasar por __retrieve_events
+        events = cls.__new__(cls)
+        events.__bodies = bodies
+        events.__start, events.__end = start, end
+        events.metrics = metrics
+        events.__url_dimension = url_dimension
+        events.__seen_events = seen_events
+        events.__build_dataframe()
+        return events
+
+    def __build_dataframe(self):
+        with self.metrics.timer("json_parse"):
+            self.dataframe = decode_bodies(self.__bodies)
+        self.metrics.count("events", self.dataframe.shape[0])
+
+        if self.dataframe.shape[0] > 0:
+            with self.metrics.timer("cast"):
+                # posición en el lote, para saber de qué fichero viene cada evento al
+                # ordenar (sort_runs)
+                self.dataframe = self.dataframe.with_row_count(BATCH_ROW)
+                # In some old events avro, problem: we drop them
+                # Filtramos las filas del df, luego usamos drop para eliminarlas
+                self.dataframe = self.dataframe.filter(
+                    pl.col("percentage") != ""
+                )  # hay que quitarlo
+                self.dataframe = self.dataframe.select(
+                    [col for col in self.dataframe.columns if col not in ["_id", "state"]]
                 )
+                # tipos de event_schema, comunes a todos los cargadores
+                self.dataframe = cast_events(self.dataframe)
+                # los ficheros que solapan el rango pueden traer eventos de fuera de él
+                if self.__start is not None:
+                    self.dataframe = self.dataframe.filter(
+                        pl.col("timestamp") >= event_time(self.__start)
+                    )
+                if self.__end is not None:
+                    self.dataframe = self.dataframe.filter(
+                        pl.col("timestamp") <= event_time(self.__end)
+                    )
 
-            self.dataframe = self.dataframe.with_columns(
-                (pl.col("timestamp") * 1000) 
-                .cast(pl.Datetime)
-                .dt.with_time_unit("ms")
-                .dt.strftime("%d")
-                .alias("day")
-            )
-            self.__add_author_unit()
-            self.dataframe = self.dataframe.sort(by=pl.col("timestamp"))
-            processing_end_time = time.time()
-            processing_time = processing_end_time - processing_start_time
-            total_time = download_time + processing_time
-            print(f"Tiempo de descarga de archivos: {download_time} segundos")
-            print(f"Tiempo de procesado (excluyendo descarga de archivos): {processing_time} segundos")
-            print(f"Tiempo total (incluyendo descarga de archivos): {total_time} segundos")
+            with self.metrics.timer("dedup"):
+                # eventos repetidos en el lote o ya vistos en lotes anteriores
+                events_number = self.dataframe.shape[0]
+                self.dataframe = self.__seen_events.deduplicate(self.dataframe)
+                self.metrics.count("duplicates", events_number - self.dataframe.shape[0])
+            with self.metrics.timer("enrich"):
+                self.dataframe = self.dataframe.with_columns(
+                    pl.col("timestamp")
+                    .dt.strftime("%d")
+                    .alias("day")
+                )
+                # tramos de vídeo vistos y duración, a partir de notes
+                self.dataframe = parse_notes(self.dataframe)
+                self.__add_author_unit()
+            with self.metrics.timer("sort"):
+                # cada fichero ya viene (casi) ordenado: se mezclan en lugar de ordenar
+                # todo el lote
+                self.dataframe = sort_runs(
+                    self.dataframe, [len(bodies) for bodies in self.__bodies], self.metrics
+                ).drop(BATCH_ROW)
 
     #@profile
-    def __retrieve_events(self, events_container, bin_container, after=""):
-        blob_list = [
-            blob for blob in events_container.container.list_blobs() if blob.name > after
-        ]
-        
-        blob_list.sort(key=lambda b: b.name)
+    def __retrieve_events(
+        self,
+        events_container,
+        bin_container,
+        after="",
+        max_concurrency=DOWNLOAD_CONCURRENCY,
+        manifest=None,
+        stream=False,
+    ):
+        if manifest is not None:
+            manifest.load()
+        blob_list = events_container.list_blobs_after(
+            after, manifest, self.__start, self.__end
+        )
         # print(file_list)
 
-        if len(blob_list) > 0:
-            self.batch_first_events_file = blob_list[0]
-        
-        else:
-            self.batch_first_events_file, self.batch_last_events_file = (None, None)
+        self.batch_first_events_file, self.batch_last_events_file = (None, None)
 
-        self.__events = []
+        self.__bodies = []
         events_number = 0
 
-        for index, blob in enumerate(blob_list):
-            if blob.size > 508:
-                blob_client = ContainerClient.get_blob_client(
-                    events_container.container, blob=blob.name
-                )
-                fileReader = blob_client.download_blob().readall()
-                print("Downloaded a non empty blob: " + blob.name)
-                events_list = self.__process_blob(fileReader)
-                events_number += len(events_list)
-                if (events_number > MAX_EVENTS) & (index > 1):
-                    break
-
-                self.batch_last_events_file = blob.name
-                self.__events += events_list
-
-                if bin_container is not None:
-                    ContainerClient.upload_blob(
-                        bin_container.container,
-                        name=blob.name,
-                        data=fileReader,
-                        overwrite=True,
-                    )
-        print(f"Number of downloaded events: {len(self.__events)}")
-        events_container.container.close()
-        if bin_container is not None:
-            bin_container.container.close()
+        blobs = download_blobs(
+            events_container,
+            blob_list,
+            max_concurrency,
+            manifest,
+            self.metrics,
+            stream,
+            bin_container is not None,
+            after,
+        )
+        for index, blob, data, bodies in blobs:
+            events_number += len(bodies)
+            if (events_number > MAX_EVENTS) & (index > 1):
+                break
 
+            self.batch_first_events_file = self.batch_first_events_file or blob.name
+            self.batch_last_events_file = blob.name
+            self.__bodies.append(bodies)
 
-    def __process_blob(self, filename):
-        with io.BytesIO(filename) as f:
-            events_list = []
-            avro_reader = reader(f)
-            for reading in avro_reader:
-                parsed_json = json.loads(reading["Body"])
-                events_list.append(parsed_json)
-        return events_list
+            if bin_container is not None:
+                backup_blob(bin_container, blob, data)
+        blobs.close()
+        self.__save_manifest(manifest)
+        events_container.close()
+        if bin_container is not None:
+            bin_container.close()
 
     def upload_metadata(self):
-        self.__upload_metadata(
-            #BLOB_CONTAINER_NAME,
-            "events_metadata.avro"
-        )
-
-    def __upload_metadata(self, events_container, path, schema):
-        container = Container(events_container)
-        fo = io.BytesIO()
-        writer(
-            fo,
-                       [
-                {
-                    "batch_first_events_file": self.batch_first_events_file,
-                    "batch_last_events_file": self.batch_last_events_file,
-                }
-            ],
-        )
-        ContainerClient.upload_blob(
-            Container.container, name=path, data=fo.getvalue(), overwrite=True
-        )
-        Container.close()
+        """Guarda el lote en el checkpoint. Se llama una vez procesado el dataframe, para
+        que la siguiente ejecución empiece en el fichero posterior a batch_last_events_file."""
+        self.__checkpoint.save(self.batch_first_events_file, self.batch_last_events_file)
+        # los eventos del lote solo cuentan como vistos una vez procesado
+        self.__seen_events.save()
 
     def add_unit_type(self):
         if self.dataframe.shape[0] == 0:
             return None
 
-        evaluation_units_urls = ["ed12ad9791554f32b3327671030c0e5e"] 
-
-        if not pl.col("unit_type") in self.dataframe.columns:
-            self.dataframe = self.dataframe.with_columns(
-                pl.col("unit_type").fill_nan("Content")
-    )
-        else:
-            self.dataframe = self.dataframe.with_columns(
-                pl.when(pl.col("unit_type").is_null())
-                .then("Content")
-                .otherwise(pl.col("unit_type"))
+        # unit_type siempre está (event_schema): las unidades de evaluación se reconocen
+        # por la url (url_dimension), y los eventos que no traen tipo son de contenido
+        url_unit_types = self.__url_dimension.lookup(self.dataframe["url"].unique()).select(
+            "url", pl.col("unit_type").alias("url_unit_type")
+        )
+        self.dataframe = (
+            self.dataframe.join(url_unit_types, on="url", how="left")
+            .with_columns(
+                pl.coalesce(
+                    pl.col("url_unit_type").cast(pl.Utf8),
+                    pl.col("unit_type").cast(pl.Utf8),
+                    pl.lit("Content"),
+                )
+                .cast(pl.Categorical)
                 .alias("unit_type")
-    )
-        self.dataframe = self.dataframe.with_columns(
-            pl.when(
-            self.dataframe["url"] == pl.lit(evaluation_units_urls[0]))
-            .then(pl.lit("Evaluation"))
-            .otherwise(pl.col("unit_type"))
-            .alias('unit_type')
-    )
+            )
+            .drop("url_unit_type")
+        )
+
     def __add_author_unit(self):
         if self.dataframe.shape[0] > 0:
-            urls = self.dataframe["url"]
-            url_author = urls.str.contains("/") & (urls != "/la/")
-
-            if url_author.any():
-                # authors = pl.Series(["anonymous"] * len(urls), dtype=pl.Object) 
-
-                self.dataframe = self.dataframe.with_columns(
-                    pl.when(url_author)
-                    .then(
-                        urls.str.split("/").apply(lambda s: s[1] if len(s) > 1 else "")
-                    )
-                    .otherwise("anonymous")
-                    .alias("author"),
-                    pl.when(url_author)
-                    .then(
-                        urls.str.split("/").apply(lambda s: s[2] if len(s) > 2 else "")
-                    )
-                    .otherwise(urls)
-                    .alias("unit")
+            # cada url distinta se parte una sola vez (y se guarda para los siguientes
+            # lotes); author y unit se unen a los eventos por url
+            urls = self.__url_dimension.lookup(self.dataframe["url"].unique())
+            self.dataframe = self.dataframe.join(
+                urls.select("url", "author", "unit"), on="url", how="left"
             )
-                
-        else:
-            self.dataframe = self.dataframe.with_columns("author", "anonymous")
-            self.dataframe = self.dataframe.with_columns("unit", self.dataframe["url"])
 
 
-load_dotenv()
-anabel_storage_connection_str = os.environ["ANABEL_STORAGE_CONNECTION_STR"]
-capture_container = Container("capture", anabel_storage_connection_str)
-# print(capture_container.list_blobs())
-
 # ejemplo de carga de eventos, instanciando un objeto de la clase Events que hemos definido en este fichero.
 if __name__ == "__main__":
+    load_dotenv()
+    anabel_storage_connection_str = os.environ["ANABEL_STORAGE_CONNECTION_STR"]
+    capture_container = Container("capture", anabel_storage_connection_str)
+    #print(capture_container.list_blobs())
     eventsla =  Events(
         capture_container, 
         after="upctevents/upctforma/0/2023/06/01/00/00/00.avro"
 )
-print(eventsla.dataframe)  
-
+    print(eventsla.dataframe)
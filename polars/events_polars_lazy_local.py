@@ -2,215 +2,349 @@ import polars as pl
 import shutil
 from polars import LazyFrame
 from pathlib import Path
-from fastavro import reader
-import json
-import timeit
+from checkpoint import LocalCheckpoint, PeriodicCheckpoint
+from constants import CHECKPOINT_INTERVAL, FOLLOW_POLL_INTERVAL
+from url_dimension import UrlDimension
+from dedup import DEDUP_KEYS, SeenEvents
+from event_schema import cast_events, enable_string_cache, event_time
+from video import parse_notes
+from ordering import BATCH_ROW, sort_runs
+from ingestion import file_batches, follow_files, list_files, read_files
+from decoding import decode_bodies
+from metrics import Metrics
 import datetime as dt
 
 BACKUP_INTERMEDIATE_CONTAINER_NAME = "capture_processed"
 MAX_EVENTS = 1000 
 
 class Events:
-    def __init__(self, capture, capture_processed=None, after=""):
+    def __init__(
+        self,
+        capture,
+        capture_processed=None,
+        after="",
+        checkpoint=None,
+        manifest=None,
+        start=None,
+        end=None,
+        workers=1,
+        metrics=None,
+        url_dimension=None,
+        seen_events=None,
+    ):
+        # las categóricas de todos los lotes comparten categorías (event_schema)
+        enable_string_cache()
+        # Sin after explícito se reanuda a partir del último fichero del checkpoint
+        self.__checkpoint = checkpoint or LocalCheckpoint()
+        after = after or self.__checkpoint.load()
+        # Con start/end (timestamps en segundos) solo se cargan los eventos de ese rango
+        self.__start, self.__end = start, end
+        # Tiempos por etapa y contadores de la carga
+        self.metrics = metrics or Metrics()
+        # author/unit/unit_type por url distinta; por defecto, solo para esta carga
+        self.__url_dimension = (url_dimension or UrlDimension()).load()
+        # hashes de los eventos ya vistos; por defecto, solo los de esta carga
+        self.__seen_events = (seen_events or SeenEvents()).load()
+
         # En lugar de contenedores, hay que definir carpetas
-        self.__retrieve_events(capture, capture_processed, after)
-        # como resultado de lo anterior, se ha completado el atributo __events de self.
-        self.dataframe = pl.DataFrame(self.__events).lazy()
+        self.__retrieve_events(capture, capture_processed, after, manifest, workers)
+        # como resultado de lo anterior, se ha completado el atributo __bodies de self.
+        self.__build_dataframe()
+        self.__url_dimension.save()
 
-        if len(self.dataframe.collect()) > 0:
-            # In some old events avro, problem: we drop them
-            # Filtramos las filas del df, luego usamos drop para eliminarlas
-            self.dataframe = (
-            self.dataframe
-            .filter(pl.col("percentage") != "")
-            .select([col for col in self.dataframe.columns if col not in ["_id", "state"]])
-            .with_columns(
-                pl.col("percentage").cast(float),
-                pl.col("timestamp").cast(float),
-            )
-            .lazy()
+    @classmethod
+    def iter_batches(
+        cls,
+        capture,
+        after="",
+        batch_events=MAX_EVENTS,
+        checkpoint=None,
+        manifest=None,
+        start=None,
+        end=None,
+        workers=1,
+        metrics=None,
+        url_dimension=None,
+        seen_events=None,
+    ):
+        """Recorre todos los ficheros posteriores a after en un solo proceso y devuelve por
+        cada lote (dataframe, cursor), con como mucho batch_events eventos por lote (salvo
+        un fichero que por sí solo los supere). cursor es la ruta del último fichero del
+        lote: pasándola como after se reanuda a partir del lote siguiente.
+
+        Sin after explícito se empieza en el checkpoint, y cada cursor se guarda en él
+        cuando se pide el lote siguiente, es decir, cuando el anterior ya se ha procesado.
+
+        Con un LocalManifest no se abren los ficheros que según él están vacíos o no
+        tienen eventos en [start, end], y se guarda con cada lote. Con workers > 1 los
+        ficheros se decodifican en un pool de ese número de procesos. Los tiempos y
+        contadores de todos los lotes se acumulan en metrics.
+        Con url_dimension (p. ej. un LocalUrlDimension) la tabla url -> author/unit/
+        unit_type se reutiliza entre lotes y entre cargas y se guarda con cada lote.
+        Los eventos repetidos se quitan con seen_events (p. ej. un LocalSeenEvents para
+        reconocer también los de cargas anteriores), que se guarda con cada lote."""
+        enable_string_cache()
+        checkpoint = checkpoint or LocalCheckpoint()
+        metrics = metrics or Metrics()
+        url_dimension = (url_dimension or UrlDimension()).load()
+        seen_events = (seen_events or SeenEvents()).load()
+        after = after or checkpoint.load()
+        if manifest is not None:
+            manifest.load()
+        yield from file_batches(
+            list_files(capture, after, metrics, manifest, start, end),
+            batch_events,
+            lambda bodies: cls.__from_bodies(
+                bodies, metrics, url_dimension, seen_events, start, end
+            ).dataframe,
+            checkpoint,
+            [manifest, url_dimension, seen_events],
+            manifest,
+            start,
+            end,
+            workers,
+            metrics,
+            after,
+        )
+
+    @classmethod
+    def follow(
+        cls,
+        capture,
+        callback,
+        after="",
+        batch_events=MAX_EVENTS,
+        checkpoint=None,
+        manifest=None,
+        start=None,
+        end=None,
+        workers=1,
+        metrics=None,
+        url_dimension=None,
+        seen_events=None,
+        poll_interval=FOLLOW_POLL_INTERVAL,
+        checkpoint_interval=CHECKPOINT_INTERVAL,
+        stop=None,
+    ):
+        """iter_batches sin fin, para ingerir casi en tiempo real: tras los ficheros
+        posteriores a after se queda esperando con inotify (ver CaptureWatcher) a los que
+        van llegando a capture, y los procesa en cuanto están completos. Cada lote pasa por
+        el mismo proceso que en iter_batches y se entrega a callback(dataframe, cursor).
+
+        El cursor se lleva en memoria y se guarda en checkpoint como mucho cada
+        checkpoint_interval segundos (PeriodicCheckpoint) y al salir; manifest,
+        url_dimension y seen_events se guardan con cada lote, como en iter_batches. Se
+        sale al activarse stop (un threading.Event), que se mira al menos cada
+        poll_interval segundos, o si callback lanza una excepción."""
+        enable_string_cache()
+        checkpoint = PeriodicCheckpoint(checkpoint or LocalCheckpoint(), checkpoint_interval)
+        metrics = metrics or Metrics()
+        url_dimension = (url_dimension or UrlDimension()).load()
+        seen_events = (seen_events or SeenEvents()).load()
+        after = after or checkpoint.load()
+        if manifest is not None:
+            manifest.load()
+        follow_files(
+            capture,
+            callback,
+            batch_events,
+            lambda bodies: cls.__from_bodies(
+                bodies, metrics, url_dimension, seen_events, start, end
+            ).dataframe,
+            checkpoint,
+            [manifest, url_dimension, seen_events],
+            manifest,
+            start,
+            end,
+            workers,
+            metrics,
+            after,
+            poll_interval,
+            stop,
+        )
+
+    @staticmethod
+    def __save_manifest(manifest):
+        if manifest is not None:
+            manifest.save()
+
+    @classmethod
+    def __from_bodies(
+        cls, bodies, metrics, url_dimension, seen_events, start=None, end=None
+    ):
+        # Events de un lote ya leído, sin pasar por __retrieve_events
+        events = cls.__new__(cls)
+        events.__bodies = bodies
+        events.__start, events.__end = start, end
+        events.metrics = metrics
+        events.__url_dimension = url_dimension
+        events.__seen_events = seen_events
+        events.__build_dataframe()
+        return events
+
+    def __build_dataframe(self):
+        # Las filas que se cargan y su orden (filtros, repetidos y mezcla de los
+        # ficheros) se deciden sobre las claves de la tabla de Body ya parseada; el resto
+        # del lote queda en un único plan sobre sus filas, sin ningún collect hasta que lo
+        # pide quien usa el dataframe (self.collect).
+        # El lote entero se decodifica en memoria antes de empezar el plan (los vistos y
+        # la mezcla necesitan sus claves), y tomar sus filas en orden lo copia: el pico es
+        # de unas dos veces el lote. Lo que acota la memoria es el tamaño del lote
+        # (MAX_EVENTS, o batch_events en iter_batches), no el streaming
+        with self.metrics.timer("json_parse"):
+            decoded = decode_bodies(self.__bodies)
+        self.metrics.count("events", decoded.height)
+        self.dataframe = decoded.lazy()
+        # author/unit/unit_type de las urls del lote, sacadas de la tabla ya parseada
+        self.__urls = self.__url_dimension.lookup(
+            decoded["url"].unique() if "url" in decoded.columns else []
         )
 
-            if "time_spent" in self.dataframe.columns:
+        if decoded.height > 0:
+            with self.metrics.timer("cast"):
+                keys = self.__batch_keys(decoded)
+
+            with self.metrics.timer("dedup"):
+                # eventos repetidos en el lote o ya vistos en lotes anteriores. Se buscan
+                # en las claves: los vistos se anotan una sola vez y el plan no se parte
+                # con un collect
+                kept = self.__seen_events.deduplicate(keys)
+                self.metrics.count("duplicates", keys.height - kept.height)
+
+            with self.metrics.timer("sort"):
+                # cada fichero ya viene (casi) ordenado: se mezclan en lugar de ordenar
+                # todo el lote, y el plan parte de las filas que se cargan ya en ese orden
+                kept = sort_runs(kept, [len(bodies) for bodies in self.__bodies], self.metrics)
+                self.dataframe = decoded[kept[BATCH_ROW]].lazy()
+
+            with self.metrics.timer("cast"):
+                # tipos de event_schema, comunes a todos los cargadores
+                self.dataframe = cast_events(
+                    self.dataframe.select(
+                        [col for col in decoded.columns if col not in ["_id", "state"]]
+                    )
+                )
+
+            with self.metrics.timer("enrich"):
                 self.dataframe = self.dataframe.with_columns(
-                    pl.col("time_spent").cast(float)
+                    pl.col("timestamp")
+                    .dt.strftime("%d")
+                    .alias("day")
                 )
+                # tramos de vídeo vistos y duración, a partir de notes
+                self.dataframe = parse_notes(self.dataframe)
+                self.__add_author_unit()
 
-            self.dataframe = (
-            self.dataframe.with_columns(
-                (pl.col("timestamp") * 1000) 
-                .cast(pl.Datetime)
-                .dt.with_time_unit("ms")
-                .dt.strftime("%d")
-                .alias("day")
-            )
-            
-            .sort(by=pl.col("timestamp"))
-            .lazy()
+    def __batch_keys(self, decoded):
+        # BATCH_ROW (posición en el lote, para saber de qué fichero viene cada evento al
+        # ordenar) y DEDUP_KEYS, con los tipos de event_schema, de las filas del lote que
+        # se cargan
+        keys = cast_events(
+            decoded.with_row_count(BATCH_ROW)
+            # In some old events avro, problem: we drop them
+            .filter(pl.col("percentage") != "")
+            .select([BATCH_ROW] + DEDUP_KEYS)
         )
-        self.__add_author_unit()
+        # los ficheros que solapan el rango pueden traer eventos de fuera de él
+        if self.__start is not None:
+            keys = keys.filter(pl.col("timestamp") >= event_time(self.__start))
+        if self.__end is not None:
+            keys = keys.filter(pl.col("timestamp") <= event_time(self.__end))
+        return keys
+
+    def collect(self, streaming=False):
+        """Ejecuta el plan del lote. El plan parte de la tabla del lote ya decodificada
+        en memoria, así que streaming no permite cargar lotes que no quepan en ella: solo
+        cambia cómo se calculan las columnas que añade el plan, y sin él se puede usar
+        la eliminación de subplanes comunes, que no se puede combinar con streaming."""
+        with self.metrics.timer("collect"):
+            return self.dataframe.collect(
+                streaming=streaming, comm_subplan_elim=not streaming
+            )
 
     #@profile
-    def __retrieve_events(self, capture, capture_processed, after=""):
-        file_generator = (
-            file for file in capture.glob("**/*.avro") if file.as_posix() > after
+    def __retrieve_events(
+        self, capture, capture_processed, after="", manifest=None, workers=1
+    ):
+        if manifest is not None:
+            manifest.load()
+        file_generator = list_files(
+            capture, after, self.metrics, manifest, self.__start, self.__end
         )
-
-        # file_list.sort()
         # print(file_list)
 
-        # if len(file_list) > 0:
-         #   self.batch_first_events_file = file_list[0]
-        
-        #else:
         self.batch_first_events_file, self.batch_last_events_file = (None, None)
 
-        self.__events = []
+        self.__bodies = []
         events_number = 0
 
-        for index, file_path in enumerate(file_generator):
-            file_name = file_path.name
-            # Empleamos la función pl.read_avro()
-            if file_path.stat().st_size > 0:
-                with open(file_path, "rb") as f:
-                    events_list = self.__process_file(f)
-                    events_number += len(events_list)
-
-                if events_number > MAX_EVENTS and index > 1:
-                    break
-
-                self.batch_firts_events_file = self.batch_first_events_file or file_name
-                self.batch_last_events_file = file_name
-                self.__events += events_list
-                
-                # Para evaluar con timeit no se puede mover los archivos
-                # una vez procesados
-                #if capture_processed is not None:
-                 #   bin_file_path = capture_processed / file_name
-                  #  file_path.rename(bin_file_path) 
-                    # Eliminamos el archivo y la carpeta padre              
-                   # bin_file_path.unlink()
-                   # parent_directory = file_path.parent
-                    # Verificar si la carpeta está vacía antes de eliminarla
-                   # if not any(parent_directory.iterdir()):
-                    #    shutil.rmtree(parent_directory)
-                
-        print(f"Number of downloaded events: {len(self.__events)}")
-
-
-    def __process_file(self, file_name):
-            events_list = []
-            avro_reader = reader(file_name)
-
-            for reading in avro_reader:
-                parsed_json = json.loads(reading["Body"])
-                events_list.append(parsed_json)
-
-            return events_list
+        files = read_files(
+            file_generator, manifest, self.__start, self.__end, workers, self.metrics, after
+        )
+        for index, file_path, bodies in files:
+            events_number += len(bodies)
 
-    def upload_metadata(self):
-        #self.__upload_metadata( # "events_metadata.avro")
-        self.__upload_metadata("events_metadata.json")
+            if events_number > MAX_EVENTS and index > 1:
+                break
 
-    def __upload_metadata(self, capture, path, schema):
-        metadata = {
-            "batch_first_events_file": self.batch_first_events_file,
-            "batch_last_events_file": self.batch_last_events_file,
-        }
+            self.batch_first_events_file = self.batch_first_events_file or file_path.as_posix()
+            self.batch_last_events_file = file_path.as_posix()
+            self.__bodies.append(bodies)
 
-        with open(path, "w") as f:
-            json.dump(metadata, f)
+            #if capture_processed is not None:
+             #   bin_file_path = capture_processed / file_name
+              #  file_path.rename(bin_file_path) 
+                # Eliminamos el archivo y la carpeta padre 
+               # bin_file_path.unlink()
+                #parent_directory = file_path.parent
+                # Verificar si la carpeta está vacía antes de eliminarla
+                #if not any(parent_directory.iterdir()):
+                 #   shutil.rmtree(parent_directory)
+
+        self.__save_manifest(manifest)
+
+    def upload_metadata(self):
+        """Guarda el lote en el checkpoint. Se llama una vez procesado el dataframe, para
+        que la siguiente ejecución empiece en el fichero posterior a batch_last_events_file."""
+        self.__checkpoint.save(self.batch_first_events_file, self.batch_last_events_file)
+        # los eventos del lote solo cuentan como vistos una vez procesado
+        self.__seen_events.save()
 
     def add_unit_type(self):
-        if self.dataframe.shape[0] == 0:
+        if "url" not in self.dataframe.columns:
             return None
 
-        evaluation_units_urls = ["ed12ad9791554f32b3327671030c0e5e"] 
-
-        if not pl.col("unit_type") in self.dataframe.columns:
-            self.dataframe = self.dataframe.lazy().with_columns(
-                pl.col("unit_type").fill_nan("Content")
-    )
-        else:
-            self.dataframe = self.dataframe.lazy().with_columns(
-                pl.when(pl.col("unit_type").is_null())
-                .then("Content")
-                .otherwise(pl.col("unit_type"))
-                .alias("unit_type")
-    )
-        self.dataframe = self.dataframe.lazy().with_columns(
-            pl.when(
-            self.dataframe["url"] == pl.lit(evaluation_units_urls[0]))
-            .then(pl.lit("Evaluation"))
-            .otherwise(pl.col("unit_type"))
-            .alias('unit_type')
-    )
-    def __add_author_unit(self):
-        if len(self.dataframe.collect()) > 0:
-            urls = self.dataframe.select(pl.col("url"))
-            url_author = self.dataframe.filter(
-                (pl.col("url").str.contains("/")) & (pl.col("url") != "/la/")
-            ).collect()
-
-            if not url_author.is_empty():
-            # authors = pl.Series(["anonymous"] * len(urls), dtype=pl.Object) 
-            # Agregamos la columna "author" en función de los valores de "url"
-                self.dataframe = (
-                self.dataframe.lazy()
-                .with_columns(
-                    pl.when(
-                        (pl.col("url").str.contains("/"))
-                        & (pl.col("url") != "/la/")
-                    )
-                    .then(
-                        pl.col("url").str.split("/").apply(lambda s: s[1] if len(s) > 1 else "")
-                    )
-                    .otherwise("anonymous")
-                    .alias("author"),
+        # unit_type siempre está (event_schema): las unidades de evaluación se reconocen
+        # por la url (url_dimension), y los eventos que no traen tipo son de contenido
+        url_unit_types = self.__urls.select("url", pl.col("unit_type").alias("url_unit_type"))
+        self.dataframe = (
+            self.dataframe.join(url_unit_types.lazy(), on="url", how="left")
+            .with_columns(
+                pl.coalesce(
+                    pl.col("url_unit_type").cast(pl.Utf8),
+                    pl.col("unit_type").cast(pl.Utf8),
+                    pl.lit("Content"),
                 )
-                .lazy()
+                .cast(pl.Categorical)
+                .alias("unit_type")
             )
+            .drop("url_unit_type")
+        )
 
-            # Agregamos la columna "unit" en función de los valores de "url"
-            self.dataframe = (
-                self.dataframe.lazy()
-                .with_columns(
-                    pl.when(
-                        (pl.col("url").str.contains("/"))
-                        & (pl.col("url") != "/la/")
-                    )
-                    .then(
-                        pl.col("url").str.split("/").apply(lambda s: s[2] if len(s) > 2 else "")
-                    )
-                    .otherwise(pl.col("url"))
-                    .alias("unit"),
-                )
-                .lazy()
-            )
-        else:
-             self.dataframe = (
-                self.dataframe.lazy()
-                .with_columns("author", "anonymous")
-                .with_columns("unit", self.dataframe["url"])
-                .lazy()
+    def __add_author_unit(self):
+        # cada url distinta del lote se parte una sola vez (y se guarda para los
+        # siguientes lotes); author y unit se unen a los eventos por url dentro del plan
+        self.dataframe = self.dataframe.join(
+            self.__urls.select("url", "author", "unit").lazy(), on="url", how="left"
         )
 
 
 # ejemplo de carga de eventos, instanciando un objeto de la clase Events que hemos definido en este fichero.
+# Los tiempos y la memoria se miden con benchmarks/run_benchmarks.py
 if __name__ == "__main__":
     eventsla =  Events(
          Path("capture"),
          Path("capture_processed"), 
          after="/upctevents/upctforma/0/2023/06/17/14/56/43.avro"
 )
-print(eventsla.dataframe.collect())  
-
-def measure_events():
-    """Función empleada para usar timeit y evaluar el tiempo de ejecución"""
-    eventsla = Events(
-        Path("capture"), 
-        Path("capture_processed"), 
-        after="/upctevents/upctforma/0/2023/06/14/03/41/43.avro"
-)
-tiempo = timeit.timeit(measure_events, number=500)
-print(f"Tiempo de ejecución de eventsla: {tiempo} segundos")
\ No newline at end of file
+    print(eventsla.collect())
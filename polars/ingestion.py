@@ -0,0 +1,389 @@
+from compaction import CompactedFile, read_metadata, split_compacted, stored_name
+from constants import DOWNLOAD_CONCURRENCY, FOLLOW_POLL_INTERVAL
+from decoding import blob_bodies, decode_files, stream_bodies
+from listing import is_compacted, list_capture_files
+from metrics import Metrics
+from watcher import CaptureWatcher
+from itertools import takewhile, tee
+from pathlib import Path
+import io
+import threading
+
+
+# Lo que comparten los cargadores de eventos (Events) de esta carpeta, sea cual sea el
+# dataframe que construyen: el listado y la lectura de los ficheros locales, la descarga
+# de los blobs, con los compactados repartidos en sus ficheros originales, y el reparto
+# de lo leído en lotes para iter_batches y follow, y el bucle de follow
+
+
+def list_files(capture, after, metrics, manifest=None, start=None, end=None):
+    """Ficheros de la carpeta capture posteriores a after, en orden de ruta: un generador
+    que solo recorre las carpetas que pueden tenerlos. Con manifest tampoco recorre las
+    que según él no tienen nada que leer en [start, end] (Manifest.skip_prefix). Su
+    tiempo va a la etapa list."""
+    skip = None
+    if manifest is not None:
+        skip = lambda prefix: manifest.skip_prefix(prefix, start, end)
+    return metrics.timed_iter("list", list_capture_files(capture, after, skip))
+
+
+def read_files(
+    file_paths, manifest=None, start=None, end=None, workers=1, metrics=None, after=""
+):
+    """(índice, ruta, Body) de cada fichero de file_paths (ver list_files) con eventos.
+
+    Los ficheros se decodifican en orden (o en paralelo con workers > 1, pero se
+    devuelven igualmente en orden), así que el corte por MAX_EVENTS y el cursor no
+    dependen de workers. El índice es la posición en file_paths; los ficheros originales
+    de un compactado cuentan como ficheros de la lista. Con manifest no se abren los
+    ficheros que según él están vacíos o no tienen eventos en [start, end], de los que ya
+    tiene se usa el tamaño guardado en lugar de hacer stat, y se le añaden los que se
+    leen y no tenía."""
+    metrics = metrics or Metrics()
+    to_read, to_decode = tee(_files_to_read(file_paths, manifest, start, end))
+    decoded = metrics.timed_iter(
+        "avro_decode",
+        decode_files((file_path for _, file_path, _ in to_decode), workers, metrics),
+    )
+    try:
+        shift = 0
+        for (index, file_path, size), bodies in zip(to_read, decoded):
+            metrics.count("files_read")
+            metrics.count("bytes_read", size)
+            originals = list(_file_originals(file_path, size, bodies, after))
+            for position, (file_path, size, bodies) in enumerate(originals):
+                name = file_path.as_posix()
+                if manifest is not None:
+                    if manifest.get(name, size) is None:
+                        manifest.add(name, size, bodies)
+                    manifest.cover(after, name)
+                yield index + shift + position, file_path, bodies
+            shift += len(originals) - 1
+    finally:
+        decoded.close()
+
+
+def _files_to_read(file_paths, manifest, start, end):
+    # Los ficheros de captura vacíos no pesan 0 bytes (llevan la cabecera Avro): con el
+    # manifiesto se saltan sin abrirlos, igual que los que quedan fuera de rango. Solo se
+    # hace stat de los que no tiene
+    for index, file_path in enumerate(file_paths):
+        size = manifest.size(file_path.as_posix()) if manifest is not None else None
+        if size is None:
+            size = file_path.stat().st_size
+        if size == 0:
+            continue
+        if manifest is not None and manifest.skip(file_path.as_posix(), size, start, end):
+            continue
+        yield index, file_path, size
+
+
+def _file_originals(file_path, size, bodies, after):
+    # Un fichero compactado se reparte en sus ficheros originales posteriores a after, que
+    # son los que cuentan para el cursor, el manifiesto y el corte por MAX_EVENTS
+    if not is_compacted(file_path.as_posix()):
+        yield file_path, size, bodies
+        return
+    with open(file_path, "rb") as f:
+        metadata = read_metadata(f)
+    for name, size, bodies in split_compacted(file_path.as_posix(), metadata, bodies, after):
+        yield Path(name), size, bodies
+
+
+def download_blobs(
+    events_container,
+    blobs,
+    max_concurrency,
+    manifest=None,
+    metrics=None,
+    stream=False,
+    keep_data=False,
+    after="",
+):
+    """(índice, blob, bytes, Body) de cada blob de blobs (el listado de
+    list_blobs_after, que puede ser un generador) con eventos, descargados con hasta
+    max_concurrency peticiones en vuelo y en el orden del listado.
+
+    Con stream cada blob se decodifica en su descarga, según llegan sus bloques, y sus
+    bytes solo se guardan con keep_data (si no, None). Como en read_files, el índice es la
+    posición en el listado, los ficheros originales de un compactado cuentan como blobs
+    del listado y al manifest se le añaden los blobs que no tenía. Los bytes de un
+    compactado van con el primero de sus originales, y None con el resto."""
+    metrics = metrics or events_container.metrics
+    # El listado se sigue consumiendo de forma perezosa: tee reparte cada blob no vacío
+    # (uno compactado, comprimido, puede pesar menos que la cabecera de uno vacío) entre
+    # la etapa de descarga y el bucle, que los recibe en orden
+    non_empty_blobs, blobs_to_download = tee(
+        (index, blob)
+        for index, blob in enumerate(blobs)
+        if blob.size > 508 or is_compacted(blob.name)
+    )
+    names = (blob.name for _, blob in blobs_to_download)
+    if stream:
+        downloads = events_container.stream_blobs(
+            names, stream_bodies, max_concurrency, keep_data
+        )
+    else:
+        downloads = events_container.download_blobs(names, max_concurrency)
+    try:
+        shift = 0
+        for (index, blob), download in zip(non_empty_blobs, downloads):
+            if stream:
+                _, (bodies, metadata), data = download
+            else:
+                _, data = download
+                with metrics.timer("avro_decode", "file_decode_seconds"):
+                    bodies = blob_bodies(data)
+                metadata = None
+            metrics.count("files_read")
+            originals = list(_blob_originals(blob, bodies, data, metadata, after))
+            for position, (blob, bodies, data) in enumerate(originals):
+                if manifest is not None:
+                    if manifest.get(blob.name, blob.size) is None:
+                        manifest.add(blob.name, blob.size, bodies)
+                    manifest.cover(after, blob.name)
+                yield index + shift + position, blob, data, bodies
+            shift += len(originals) - 1
+    finally:
+        downloads.close()
+
+
+def _blob_originals(blob, bodies, data, metadata, after):
+    if not is_compacted(blob.name):
+        yield blob, bodies, data
+        return
+    if metadata is None:
+        metadata = read_metadata(io.BytesIO(data))
+    for name, size, bodies in split_compacted(blob.name, metadata, bodies, after):
+        yield CompactedFile(name, size, blob.name), bodies, data
+        data = None
+
+
+def backup_blob(bin_container, blob, data):
+    """Copia a bin_container el blob en el que está guardado blob (el compactado, si es
+    uno de sus originales), si download_blobs ha traído sus bytes."""
+    if data is not None:
+        bin_container.upload_blob(stored_name(blob), data)
+
+
+def backed_up_blobs(blobs, bin_container=None):
+    """(nombre, Body) de los blobs de download_blobs, para batches, copiando cada uno a
+    bin_container (si no es None) según se recorren."""
+    for _, blob, data, bodies in blobs:
+        if bin_container is not None:
+            backup_blob(bin_container, blob, data)
+        yield blob.name, bodies
+
+
+def batches(files, batch_events, build, checkpoint, states=()):
+    """Lotes de iter_batches y follow. Junta los Body de files, pares (nombre, Body) en
+    orden, en lotes de como mucho batch_events eventos (salvo un fichero que por sí solo
+    los supere) y devuelve por cada lote (build(Body de cada fichero), cursor), con cursor
+    el nombre del último fichero del lote.
+
+    El estado se guarda cuando se pide el lote siguiente, es decir, cuando el anterior ya
+    se ha procesado: primero states (el manifiesto, url_dimension, seen_events; los None
+    se saltan) y después el checkpoint. Al acabar se guarda también si solo quedaban
+    ficheros vacíos, para no volver a leerlos."""
+    batch_bodies, events_number, batch_first, cursor = [], 0, None, None
+    for name, bodies in files:
+        if events_number > 0 and events_number + len(bodies) > batch_events:
+            yield build(batch_bodies), cursor
+            _save(checkpoint, states, batch_first, cursor)
+            batch_bodies, events_number, batch_first = [], 0, None
+
+        batch_bodies.append(bodies)
+        events_number += len(bodies)
+        batch_first = batch_first or name
+        cursor = name
+
+    if cursor is None:
+        # no había ficheros
+        return
+    if events_number > 0:
+        yield build(batch_bodies), cursor
+    _save(checkpoint, states, batch_first, cursor)
+
+
+def _save(checkpoint, states, batch_first, cursor):
+    for state in states:
+        if state is not None:
+            state.save()
+    checkpoint.save(batch_first, cursor)
+
+
+def file_batches(
+    file_paths,
+    batch_events,
+    build,
+    checkpoint,
+    states=(),
+    manifest=None,
+    start=None,
+    end=None,
+    workers=1,
+    metrics=None,
+    after="",
+):
+    """batches de los ficheros de file_paths, leídos con read_files."""
+    files = read_files(file_paths, manifest, start, end, workers, metrics, after)
+    return batches(
+        ((file_path.as_posix(), bodies) for _, file_path, bodies in files),
+        batch_events,
+        build,
+        checkpoint,
+        states,
+    )
+
+
+def follow_files(
+    capture,
+    callback,
+    batch_events,
+    build,
+    checkpoint,
+    states=(),
+    manifest=None,
+    start=None,
+    end=None,
+    workers=1,
+    metrics=None,
+    after="",
+    poll_interval=FOLLOW_POLL_INTERVAL,
+    stop=None,
+):
+    """Bucle de follow de los cargadores locales: espera con inotify (ver
+    CaptureWatcher) a los ficheros que van llegando a capture y entrega cada lote de
+    file_batches de los que ya están completos a callback(dataframe, cursor).
+
+    checkpoint es un PeriodicCheckpoint, del que se toma el cursor tras cada tanda y que
+    se vacía al salir. Se sale al activarse stop (un threading.Event), que se mira al
+    menos cada poll_interval segundos, o si callback lanza una excepción."""
+    metrics = metrics or Metrics()
+    watcher = CaptureWatcher(capture)
+    try:
+        while stop is None or not stop.is_set():
+            # se vigila antes de listar: lo que llegue mientras se procesa despierta el
+            # wait siguiente
+            watcher.watch(after)
+            file_list = list(
+                takewhile(
+                    watcher.ready, list_files(capture, after, metrics, manifest, start, end)
+                )
+            )
+            if len(file_list) > 0:
+                for dataframe, cursor in file_batches(
+                    file_list,
+                    batch_events,
+                    build,
+                    checkpoint,
+                    states,
+                    manifest,
+                    start,
+                    end,
+                    workers,
+                    metrics,
+                    after,
+                ):
+                    callback(dataframe, cursor)
+                after = checkpoint.cursor or after
+            watcher.wait(poll_interval)
+    finally:
+        checkpoint.flush()
+        watcher.close()
+
+
+def blob_batches(
+    events_container,
+    blobs,
+    batch_events,
+    build,
+    checkpoint,
+    states=(),
+    max_concurrency=DOWNLOAD_CONCURRENCY,
+    manifest=None,
+    metrics=None,
+    stream=False,
+    bin_container=None,
+    after="",
+):
+    """batches de los blobs de blobs, descargados con download_blobs y copiados a
+    bin_container (si no es None)."""
+    downloads = download_blobs(
+        events_container,
+        blobs,
+        max_concurrency,
+        manifest,
+        metrics,
+        stream,
+        bin_container is not None,
+        after,
+    )
+    try:
+        yield from batches(
+            backed_up_blobs(downloads, bin_container),
+            batch_events,
+            build,
+            checkpoint,
+            states,
+        )
+    finally:
+        downloads.close()
+
+
+def follow_blobs(
+    events_container,
+    callback,
+    batch_events,
+    build,
+    checkpoint,
+    states=(),
+    max_concurrency=DOWNLOAD_CONCURRENCY,
+    manifest=None,
+    start=None,
+    end=None,
+    metrics=None,
+    stream=False,
+    bin_container=None,
+    after="",
+    poll_interval=FOLLOW_POLL_INTERVAL,
+    stop=None,
+):
+    """Bucle de follow de los cargadores de blobs: vuelve a listar events_container cada
+    poll_interval segundos (list_blobs_after solo recorre los prefijos a partir del
+    cursor) y entrega cada lote de blob_batches de los blobs nuevos a
+    callback(dataframe, cursor).
+
+    checkpoint es un PeriodicCheckpoint, como en follow_files. Al salir, al activarse
+    stop o si callback lanza una excepción, se vacía y se cierran los contenedores."""
+    stop = stop or threading.Event()
+    try:
+        while not stop.is_set():
+            blob_list = list(events_container.list_blobs_after(after, manifest, start, end))
+            if len(blob_list) > 0:
+                new_batches = blob_batches(
+                    events_container,
+                    blob_list,
+                    batch_events,
+                    build,
+                    checkpoint,
+                    states,
+                    max_concurrency,
+                    manifest,
+                    metrics,
+                    stream,
+                    bin_container,
+                    after,
+                )
+                try:
+                    for dataframe, cursor in new_batches:
+                        callback(dataframe, cursor)
+                finally:
+                    new_batches.close()
+                after = checkpoint.cursor or after
+            stop.wait(poll_interval)
+    finally:
+        checkpoint.flush()
+        events_container.close()
+        if bin_container is not None:
+            bin_container.close()
@@ -0,0 +1,165 @@
+from container import Container
+from constants import INGESTION_PREFIX
+from pathlib import Path
+import bisect
+import json
+import os
+import re
+
+
+# Los Body guardan el timestamp como texto ("1685583189.169"), aunque se acepta también
+# como número
+TIMESTAMP_PATTERN = re.compile(r'"timestamp":\s*"?(-?[0-9][0-9.eE+-]*)')
+
+
+class Manifest:
+    """Índice de ficheros de captura con, por fichero, tamaño, número de eventos y
+    timestamp mínimo y máximo. Se completa con los ficheros que se van leyendo, de modo
+    que en las siguientes cargas los vacíos o fuera del rango pedido se descartan sin
+    abrirlos ni descargarlos.
+
+    Las claves son las mismas rutas que se usan como cursor (nombre del blob, o ruta local
+    con as_posix()). Los ficheros de captura no se reescriben: de un fichero local que ya
+    está en el manifiesto se usa el tamaño guardado, sin stat, y si cambia el tamaño de un
+    blob la entrada se ignora y se vuelve a calcular.
+
+    covered es el tramo (primero, último] de rutas del que el manifiesto tiene todos los
+    ficheros con eventos (los vacíos no se guardan), o None. Dentro de él las carpetas y
+    prefijos en los que no hay que leer nada se descartan sin listarlos (skip_prefix)."""
+
+    def __init__(self):
+        self.files = {}
+        self.covered = None
+        # claves de files en orden, para skip_prefix; se calculan al usarlas
+        self._names = None
+
+    def size(self, name):
+        """Tamaño guardado del fichero, o None si no está en el manifiesto."""
+        stats = self.files.get(name)
+        return None if stats is None else stats["size"]
+
+    def get(self, name, size):
+        """Estadísticas del fichero, o None si no está en el manifiesto o ha cambiado."""
+        stats = self.files.get(name)
+        if stats is None or stats["size"] != size:
+            return None
+        return stats
+
+    def add(self, name, size, bodies):
+        """Registra el fichero a partir de los Body que se han leído de él."""
+        timestamps = [
+            float(match.group(1))
+            for match in map(TIMESTAMP_PATTERN.search, bodies)
+            if match is not None
+        ]
+        if self._names is not None and name not in self.files:
+            bisect.insort(self._names, name)
+        self.files[name] = {
+            "size": size,
+            "records": len(bodies),
+            "min_timestamp": min(timestamps, default=None),
+            "max_timestamp": max(timestamps, default=None),
+        }
+
+    def cover(self, after, name):
+        """Anota que el manifiesto tiene todos los ficheros con eventos posteriores a
+        after hasta name, que es el último leído (o descartado) de una carga a partir de
+        after. Se une a covered si lo toca; si no, lo sustituye."""
+        if self.covered is not None and after <= self.covered[1] and name >= self.covered[0]:
+            self.covered = [min(self.covered[0], after), max(self.covered[1], name)]
+        else:
+            self.covered = [after, name]
+
+    def skip(self, name, size, start=None, end=None):
+        """True si el manifiesto ya sabe que el fichero no tiene eventos, o ninguno con
+        timestamp en [start, end]. Los ficheros que no están en él nunca se descartan."""
+        stats = self.get(name, size)
+        if stats is None:
+            return False
+        if stats["records"] == 0:
+            return True
+        if stats["min_timestamp"] is None:
+            return False
+        return (start is not None and stats["max_timestamp"] < start) or (
+            end is not None and stats["min_timestamp"] > end
+        )
+
+    def skip_prefix(self, prefix, start=None, end=None):
+        """True si todo el prefijo (una carpeta o prefijo de blobs terminado en "/") está
+        dentro de covered y skip descarta todos sus ficheros: no hace falta listarlo."""
+        if self.covered is None:
+            return False
+        first, last = self.covered
+        if not first < prefix < last or last.startswith(prefix):
+            return False
+        if self._names is None:
+            self._names = sorted(self.files)
+        for name in self._names[bisect.bisect_left(self._names, prefix) :]:
+            if not name.startswith(prefix):
+                break
+            if not self.skip(name, self.files[name]["size"], start, end):
+                return False
+        return True
+
+    def _from_json(self, data):
+        self.files = data.get("files", {})
+        self.covered = data.get("covered")
+        self._names = None
+        return self
+
+    def _to_json(self):
+        return json.dumps({"files": self.files, "covered": self.covered})
+
+
+class LocalManifest(Manifest):
+    """Manifiesto guardado en un fichero JSON local. Por defecto va en la carpeta
+    INGESTION_PREFIX, aparte de la de la captura."""
+
+    def __init__(self, path=Path(INGESTION_PREFIX) / "capture_manifest.json"):
+        super().__init__()
+        self.path = Path(path)
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return self._from_json(json.load(f))
+        except FileNotFoundError:
+            return self._from_json({})
+
+    def save(self):
+        # igual que el checkpoint: temporal y os.replace, para no dejarlo a medio escribir
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            f.write(self._to_json())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class BlobManifest(Manifest):
+    """Manifiesto guardado como blob JSON en un contenedor de Azure. Como el checkpoint,
+    por defecto va bajo INGESTION_PREFIX, para que el listado de la captura no lo
+    devuelva como un blob de eventos."""
+
+    def __init__(
+        self,
+        container_name,
+        storage_connection_str,
+        path=INGESTION_PREFIX + "capture_manifest.json",
+    ):
+        super().__init__()
+        self.container_name = container_name
+        self.storage_connection_str = storage_connection_str
+        self.path = path
+
+    def load(self):
+        container = Container(self.container_name, self.storage_connection_str)
+        data = container.download_blob(self.path)
+        container.close()
+        return self._from_json(json.loads(data) if data is not None else {})
+
+    def save(self):
+        container = Container(self.container_name, self.storage_connection_str)
+        container.upload_blob(self.path, self._to_json().encode())
+        container.close()
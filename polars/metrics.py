@@ -0,0 +1,153 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+import json
+import os
+import threading
+import time
+
+
+# Límites (en segundos) de los buckets de los histogramas de latencia por fichero (o por
+# tanda de ficheros decodificados juntos)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    """Histograma acumulado al estilo de Prometheus: número de observaciones, suma y,
+    por cada límite de LATENCY_BUCKETS, cuántas observaciones no lo superan."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": {str(bound): count for bound, count in zip(self.buckets, self.counts)},
+        }
+
+
+class Metrics:
+    """Métricas de una o varias cargas: segundos por etapa (list, download, avro_decode,
+    json_parse, cast, dedup, enrich, sort), contadores de ficheros, bytes y eventos, y
+    histogramas de latencia por fichero o por tanda de ficheros. Se van acumulando, así
+    que un mismo objeto puede recoger varias cargas seguidas (por ejemplo, las de
+    iter_batches).
+
+    Se consultan con to_dict() o se vuelcan con to_json() o to_prometheus(), en lugar
+    de imprimir por consola en mitad de la carga."""
+
+    def __init__(self):
+        self.timers = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.histograms = defaultdict(Histogram)
+        # las descargas se registran desde los hilos del pool
+        self.__lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, stage, histogram=None):
+        """Suma a stage lo que tarda el bloque y, con histogram, lo registra también
+        como una observación de ese histograma."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.add_time(stage, elapsed)
+            if histogram is not None:
+                self.observe(histogram, elapsed)
+
+    def add_time(self, stage, seconds):
+        with self.__lock:
+            self.timers[stage] += seconds
+
+    def count(self, name, value=1):
+        with self.__lock:
+            self.counters[name] += value
+
+    def observe(self, name, seconds):
+        with self.__lock:
+            self.histograms[name].observe(seconds)
+
+    def timed_iter(self, stage, iterable, histogram=None):
+        """Recorre iterable sumando a stage solo el tiempo que se pasa dentro de él (y
+        no el del consumidor), para etapas que son generadores, como los listados. Con
+        histogram se registra además lo que tarda cada elemento."""
+        iterator = iter(iterable)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed = time.perf_counter() - start
+                    self.add_time(stage, elapsed)
+                if histogram is not None:
+                    self.observe(histogram, elapsed)
+                yield item
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    def to_dict(self):
+        with self.__lock:
+            return {
+                "timers": dict(self.timers),
+                "counters": dict(self.counters),
+                "histograms": {
+                    name: histogram.to_dict() for name, histogram in self.histograms.items()
+                },
+            }
+
+    def to_json(self, path=None):
+        """Las métricas en JSON; con path se escriben además en ese fichero."""
+        text = json.dumps(self.to_dict(), indent=2)
+        if path is not None:
+            _write_atomic(path, text)
+        return text
+
+    def to_prometheus(self, path=None, prefix="formala"):
+        """Las métricas en el formato de texto de Prometheus; con path se escriben
+        además en ese fichero (p. ej. para el textfile collector de node_exporter)."""
+        metrics = self.to_dict()
+        lines = [f"# TYPE {prefix}_stage_seconds_total counter"]
+        for stage, seconds in sorted(metrics["timers"].items()):
+            lines.append(f'{prefix}_stage_seconds_total{{stage="{stage}"}} {seconds}')
+
+        for name, value in sorted(metrics["counters"].items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+
+        for name, histogram in sorted(metrics["histograms"].items()):
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            for bound, count in histogram["buckets"].items():
+                lines.append(f'{prefix}_{name}_bucket{{le="{bound}"}} {count}')
+            lines.append(f'{prefix}_{name}_bucket{{le="+Inf"}} {histogram["count"]}')
+            lines.append(f"{prefix}_{name}_sum {histogram['sum']}")
+            lines.append(f"{prefix}_{name}_count {histogram['count']}")
+
+        text = "\n".join(lines) + "\n"
+        if path is not None:
+            _write_atomic(path, text)
+        return text
+
+
+def _write_atomic(path, text):
+    # temporal y os.replace, para que quien lea el fichero nunca lo vea a medias
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(text)
+    os.replace(tmp_path, path)
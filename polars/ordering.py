@@ -0,0 +1,78 @@
+import numpy as np
+import polars as pl
+
+
+# Posición de cada evento en el lote, para saber de qué fichero viene tras los filter
+BATCH_ROW = "batch_row"
+
+
+def merge_order(timestamps, runs, metrics=None):
+    """Posiciones que ordenan timestamps (array de numpy), o None si ya está ordenado.
+
+    runs dice de qué tramo (fichero de captura, fichero del almacén...) viene cada fila.
+    Los ficheros ya vienen casi ordenados, así que en lugar de ordenar todo: se
+    comprueba cada tramo y solo se ordenan los que no lo están, y luego se mezclan los
+    tramos ordenados resultantes (k-way merge, por parejas). Dos tramos que no se solapan,
+    lo normal entre ficheros seguidos, se mezclan sin más que concatenarlos. La mezcla es
+    estable: a igual timestamp se conserva el orden de llegada."""
+    timestamps = timestamps.view("int64")
+    descending = timestamps[1:] < timestamps[:-1]
+    if not descending.any():
+        return None
+
+    order = np.arange(len(timestamps))
+    unsorted_runs = np.unique(runs[1:][descending & (runs[1:] == runs[:-1])])
+    if metrics is not None:
+        metrics.count("unsorted_runs", len(unsorted_runs))
+    if len(unsorted_runs) > 0:
+        positions = np.flatnonzero(np.isin(runs, unsorted_runs))
+        order[positions] = positions[np.lexsort((timestamps[positions], runs[positions]))]
+
+    # tramos ordenados máximos: se corta donde el timestamp baja
+    ordered = timestamps[order]
+    bounds = np.flatnonzero(ordered[1:] < ordered[:-1]) + 1
+    # cada tramo lleva sus filas y sus timestamps, para no volver a buscarlos al mezclar
+    segments = list(zip(np.split(order, bounds), np.split(ordered, bounds)))
+    while len(segments) > 1:
+        segments = [_merge(*segments[index : index + 2]) for index in range(0, len(segments), 2)]
+    return segments[0][0]
+
+
+def sort_runs(dataframe, file_sizes, metrics=None):
+    """dataframe de un lote ordenado por timestamp con merge_order. Su columna
+    BATCH_ROW tiene las posiciones de los eventos en el lote (with_row_count antes de
+    quitar filas), y file_sizes es el número de eventos de cada fichero del lote, en
+    orden."""
+    runs = np.searchsorted(np.cumsum(file_sizes), dataframe[BATCH_ROW].to_numpy(), side="right")
+    order = merge_order(
+        dataframe["timestamp"].cast(pl.Datetime("us")).to_numpy(), runs, metrics
+    )
+    return dataframe if order is None else dataframe[order]
+
+
+def _merge(first, second=None):
+    if second is None:
+        return first
+    (first_rows, first_times), (second_rows, second_times) = first, second
+    # solo hay que intercalar donde los dos tramos se solapan: lo de first anterior al
+    # inicio de second va delante y lo de second posterior al final de first, detrás
+    low = np.searchsorted(first_times, second_times[0], "right")
+    high = np.searchsorted(second_times, first_times[-1], "left")
+    # en el solape, cada fila acaba en su posición en su tramo más las del otro que van
+    # antes que ella (a igual timestamp, primero las de first)
+    positions = (
+        np.arange(len(first_times) - low)
+        + np.searchsorted(second_times[:high], first_times[low:], "left"),
+        np.arange(high) + np.searchsorted(first_times[low:], second_times[:high], "right"),
+    )
+    return (
+        _interleave(first_rows, second_rows, low, high, positions),
+        _interleave(first_times, second_times, low, high, positions),
+    )
+
+
+def _interleave(first, second, low, high, positions):
+    overlap = np.empty(len(first) - low + high, dtype=first.dtype)
+    overlap[positions[0]] = first[low:]
+    overlap[positions[1]] = second[:high]
+    return np.concatenate([first[:low], overlap, second[high:]])
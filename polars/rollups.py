@@ -0,0 +1,123 @@
+from pathlib import Path
+import json
+import os
+import polars as pl
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+ROLLUP_STORE_PATH = "rollups_store"
+
+# Un fichero por día, en carpetas event_day=YYYY-MM-DD
+PARTITIONING = ds.partitioning(pa.schema([("event_day", pa.string())]), flavor="hive")
+ROLLUP_FILE = "rollup.parquet"
+
+# Los agregados se guardan por día, curso, actividad, usuario y tipo de evento: todos se
+# pueden combinar (sumas y máximos), así que un lote nuevo se une a los de su día sin
+# volver a leer los eventos
+ROLLUP_KEYS = ["event_day", "course", "activity", "user", "type"]
+
+# Metadato de cada fichero con los lotes que ya se han sumado a ese día
+BATCHES_METADATA = b"rollup_batches"
+
+
+def merge_rollups(dataframe, batch, store=ROLLUP_STORE_PATH):
+    """Suma el dataframe de Events (DataFrame o LazyFrame, tipos de event_schema) a los
+    agregados diarios: número de eventos (events), percentage máximo (max_percentage) y
+    time_spent sumado.
+
+    Solo se leen y reescriben los ficheros de los días que trae el lote, de modo que el
+    coste depende de los eventos nuevos y no de todo lo cargado. batch identifica el lote
+    (como en event_store.write_events): un lote que ya se sumó a un día no se vuelve a
+    sumar, así que repetir un lote tras un fallo no cuenta sus eventos dos veces. Como
+    los agregados guardados se unen a los del lote, necesita la caché global de cadenas
+    (event_schema.enable_string_cache), que activan los cargadores."""
+    events = dataframe.lazy()
+    if "time_spent" not in events.columns:
+        events = events.with_columns(pl.lit(None, pl.Float64).alias("time_spent"))
+    rollups = (
+        events.with_columns(
+            pl.col("timestamp").dt.strftime("%Y-%m-%d").alias("event_day"),
+            # percentage trae NaN en los eventos sin porcentaje; como null, max los ignora
+            # igual que en pandas
+            pl.col("percentage").fill_nan(None),
+        )
+        .groupby(ROLLUP_KEYS)
+        .agg(
+            pl.count().cast(pl.Int64).alias("events"),
+            pl.col("percentage").max().alias("max_percentage"),
+            pl.col("time_spent").sum(),
+        )
+        .collect()
+    )
+
+    for day_rollups in rollups.partition_by("event_day"):
+        day = day_rollups["event_day"][0]
+        path = Path(store) / f"event_day={day}" / ROLLUP_FILE
+        batches = []
+        if path.exists():
+            table = pq.read_table(path)
+            batches = json.loads(table.schema.metadata[BATCHES_METADATA])
+            if batch in batches:
+                continue
+            day_rollups = (
+                pl.concat(
+                    [
+                        pl.from_arrow(table).with_columns(pl.lit(day).alias("event_day")),
+                        day_rollups,
+                    ],
+                    how="diagonal",
+                )
+                .groupby(ROLLUP_KEYS)
+                .agg(
+                    pl.col("events").sum(),
+                    pl.col("max_percentage").max(),
+                    pl.col("time_spent").sum(),
+                )
+            )
+
+        table = day_rollups.drop("event_day").to_arrow()
+        table = table.replace_schema_metadata(
+            {BATCHES_METADATA: json.dumps(batches + [batch]).encode()}
+        )
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+
+
+def scan_rollups(store=ROLLUP_STORE_PATH, first_day=None, last_day=None):
+    """LazyFrame sobre los agregados guardados, por día, curso, actividad, usuario y
+    tipo. first_day y last_day ("YYYY-MM-DD", ambos incluidos) se aplican sobre las
+    carpetas, como en event_store.scan_events."""
+    rollups = pl.scan_pyarrow_dataset(
+        ds.dataset(store, format="parquet", partitioning=PARTITIONING)
+    )
+    if first_day is not None:
+        rollups = rollups.filter(pl.col("event_day") >= first_day)
+    if last_day is not None:
+        rollups = rollups.filter(pl.col("event_day") <= last_day)
+    return rollups.select(ROLLUP_KEYS + ["events", "max_percentage", "time_spent"])
+
+
+def daily_summary(rollups):
+    """Resumen por día, curso y actividad de los agregados de scan_rollups (DataFrame o
+    LazyFrame): eventos, usuarios activos, percentage máximo, time_spent y una columna
+    de eventos por tipo."""
+    keys = ["event_day", "course", "activity"]
+    rollups = rollups.lazy().collect()
+    summary = rollups.groupby(keys).agg(
+        pl.col("events").sum(),
+        pl.col("user").n_unique().alias("active_users"),
+        pl.col("max_percentage").max(),
+        pl.col("time_spent").sum(),
+    )
+    by_type = rollups.with_columns(
+        ("events_" + pl.col("type").cast(pl.Utf8)).alias("type")
+    ).pivot(values="events", index=keys, columns="type", aggregate_function="sum")
+    return (
+        summary.join(by_type, on=keys, how="left")
+        .with_columns(pl.col("^events_.*$").fill_null(0))
+        .sort(keys)
+    )
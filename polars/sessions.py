@@ -0,0 +1,147 @@
+import datetime as dt
+import polars as pl
+
+
+# Sin eventos durante más de este tiempo, la sesión se da por terminada
+INACTIVITY_GAP = dt.timedelta(minutes=30)
+
+# Las sesiones son de un usuario en una actividad
+SESSION_KEYS = ["user", "activity"]
+
+SESSION_SCHEMA = {
+    "session_id": pl.Int64,
+    "user": pl.Categorical,
+    "activity": pl.Categorical,
+    "start": pl.Datetime("us"),
+    "end": pl.Datetime("us"),
+    "duration": pl.Duration("us"),
+    "events": pl.Int64,
+    "max_percentage": pl.Float64,
+    "logged_out": pl.Boolean,
+}
+
+
+class SessionBuilder:
+    """Construye sesiones de forma incremental, lote a lote (por ejemplo, con los de
+    Events.iter_batches).
+
+    Los eventos de cada usuario y actividad se ordenan por timestamp, y un evento empieza
+    sesión nueva si es un LoggedIn, si el anterior era un LoggedOut o si han pasado más de
+    gap desde el anterior. Todo se hace con operaciones por grupo, sin recorrer los
+    usuarios en Python.
+
+    Las sesiones que pueden seguir en el lote siguiente (sin LoggedOut, sin otra posterior
+    del mismo usuario y actividad y con su último evento a menos de gap del evento más
+    reciente visto) se quedan en open_sessions y continúan con los eventos de ese lote.
+    Como se unen a las de lotes anteriores, necesita la caché global de cadenas
+    (event_schema.enable_string_cache), que activan los cargadores."""
+
+    def __init__(self, gap=INACTIVITY_GAP):
+        self.gap = gap
+        self.next_session_id = 0
+        # timestamp más reciente visto hasta ahora
+        self.watermark = None
+        self.open_sessions = pl.DataFrame(schema=SESSION_SCHEMA)
+
+    def add(self, events):
+        """Añade un lote de eventos (DataFrame o LazyFrame, con los tipos de event_schema).
+        Devuelve (events, sessions): los eventos con su session_id, en el mismo orden, y
+        las sesiones que se han cerrado con este lote, con start, end, duration, número
+        de eventos (events) y percentage máximo."""
+        events = events.lazy().collect()
+        if events.shape[0] == 0:
+            return events, pl.DataFrame(schema=SESSION_SCHEMA)
+        columns = events.columns
+
+        open_sessions = self.open_sessions.select(
+            SESSION_KEYS
+            + [
+                pl.col("session_id").alias("open_session_id"),
+                pl.col("end").alias("open_end"),
+                pl.col("logged_out").alias("open_logged_out"),
+            ]
+        )
+        events = (
+            events.with_row_count("row")
+            .sort(SESSION_KEYS + ["timestamp"])
+            .join(open_sessions, on=SESSION_KEYS, how="left")
+            # el primer evento de cada usuario y actividad sigue a su sesión abierta
+            .with_columns(
+                pl.col("timestamp")
+                .shift(1)
+                .over(SESSION_KEYS)
+                .fill_null(pl.col("open_end"))
+                .alias("previous_timestamp"),
+                (pl.col("type").cast(pl.Utf8).shift(1).over(SESSION_KEYS) == "LoggedOut")
+                .fill_null(pl.col("open_logged_out"))
+                .fill_null(False)
+                .alias("previous_logged_out"),
+            )
+            .with_columns(
+                (
+                    pl.col("previous_timestamp").is_null()
+                    | (pl.col("timestamp") - pl.col("previous_timestamp") > self.gap)
+                    | (pl.col("type").cast(pl.Utf8) == "LoggedIn")
+                    | pl.col("previous_logged_out")
+                ).alias("new_session")
+            )
+            .with_columns(
+                pl.when(pl.col("new_session"))
+                .then(self.next_session_id + pl.col("new_session").cumsum() - 1)
+                .alias("new_session_id")
+            )
+            # el resto de eventos se quedan en la última sesión empezada antes que ellos
+            .with_columns(
+                pl.col("new_session_id")
+                .forward_fill()
+                .over(SESSION_KEYS)
+                .fill_null(pl.col("open_session_id"))
+                .cast(pl.Int64)
+                .alias("session_id")
+            )
+        )
+        self.next_session_id += int(events["new_session"].sum())
+        batch_watermark = events["timestamp"].max()
+        self.watermark = max(self.watermark or batch_watermark, batch_watermark)
+
+        batch_sessions = events.groupby("session_id").agg(
+            pl.col("user").first(),
+            pl.col("activity").first(),
+            pl.col("timestamp").min().alias("start"),
+            pl.col("timestamp").max().alias("end"),
+            pl.count().cast(pl.Int64).alias("events"),
+            pl.col("percentage").max().alias("max_percentage"),
+            (pl.col("type").cast(pl.Utf8).sort_by("timestamp").last() == "LoggedOut").alias(
+                "logged_out"
+            ),
+        )
+        sessions = (
+            pl.concat([self.open_sessions.drop("duration"), batch_sessions], how="diagonal")
+            .groupby("session_id")
+            .agg(
+                pl.col("user").first(),
+                pl.col("activity").first(),
+                pl.col("start").min(),
+                pl.col("end").max(),
+                pl.col("events").sum(),
+                pl.col("max_percentage").max(),
+                pl.col("logged_out").sort_by("end").last(),
+            )
+            .with_columns((pl.col("end") - pl.col("start")).alias("duration"))
+            .select(list(SESSION_SCHEMA))
+        )
+        closed = (
+            pl.col("logged_out")
+            | (pl.col("session_id") != pl.col("session_id").max().over(SESSION_KEYS))
+            | (pl.col("end") < self.watermark - self.gap)
+        )
+        self.open_sessions = sessions.filter(~closed)
+
+        events = events.sort("row").select(columns + ["session_id"])
+        return events, sessions.filter(closed).sort("start")
+
+    def close(self):
+        """Cierra y devuelve las sesiones que siguen abiertas, al acabar la carga."""
+        sessions, self.open_sessions = self.open_sessions, pl.DataFrame(schema=SESSION_SCHEMA)
+        return sessions.sort("start")
+
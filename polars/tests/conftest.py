@@ -0,0 +1,18 @@
+import sys
+from pathlib import Path
+
+import polars as pl
+import pytest
+
+
+# Los módulos de polars se importan por nombre (from ordering import ...), como en los
+# cargadores
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+@pytest.fixture(autouse=True)
+def string_cache():
+    # Las pruebas convierten los lotes con cast_events sin pasar por los cargadores, que
+    # son los que activan la caché global de cadenas (event_schema.enable_string_cache)
+    with pl.StringCache():
+        yield
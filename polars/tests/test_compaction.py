@@ -0,0 +1,81 @@
+from fastavro import reader, writer
+from pathlib import Path
+import polars as pl
+from compaction import compact_capture, compacted_files, split_compacted
+from listing import list_capture_files
+
+
+SCHEMA = {
+    "type": "record",
+    "name": "eventschema",
+    "fields": [{"name": "Body", "type": "string"}],
+}
+
+
+def _write(capture, name, bodies):
+    # name: YYYY/MM/DD/HH/MM/SS
+    path = Path(capture) / "upctevents/upctforma/0" / f"{name}.avro"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        writer(f, SCHEMA, [{"Body": body} for body in bodies])
+    return path.as_posix()
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        avro = reader(f)
+        return [record["Body"] for record in avro], avro.metadata
+
+
+def _originals(path, metadata):
+    return [name for name, _, _, _ in compacted_files(path.as_posix(), metadata)]
+
+
+def test_each_day_is_compacted_except_the_last(tmp_path):
+    first = _write(tmp_path, "2023/06/01/00/00/00", ["a", "b"])
+    second = _write(tmp_path, "2023/06/01/00/15/00", [])
+    third = _write(tmp_path, "2023/06/01/23/45/00", ["c"])
+    last = _write(tmp_path, "2023/06/02/00/00/00", ["d"])
+
+    (compacted,) = compact_capture(tmp_path)
+    assert compacted.name == "01.compacted.avro"
+    bodies, metadata = _read(compacted)
+    assert bodies == ["a", "b", "c"]
+    assert _originals(compacted, metadata) == [first, second, third]
+    assert [path.as_posix() for path in list_capture_files(tmp_path)] == [
+        compacted.as_posix(),
+        last,
+    ]
+
+
+def test_late_files_are_compacted_with_their_day(tmp_path):
+    first = _write(tmp_path, "2023/06/01/00/00/00", ["a"])
+    third = _write(tmp_path, "2023/06/01/12/00/00", ["c"])
+    (compacted,) = compact_capture(tmp_path, keep_last=False)
+
+    # un fichero que llega tarde, entre los dos ya compactados
+    second = _write(tmp_path, "2023/06/01/06/00/00", ["b"])
+    assert compact_capture(tmp_path, keep_last=False) == [compacted]
+    bodies, metadata = _read(compacted)
+    assert bodies == ["a", "b", "c"]
+    assert _originals(compacted, metadata) == [first, second, third]
+    assert [path.as_posix() for path in list_capture_files(tmp_path)] == [compacted.as_posix()]
+
+    # un día ya compactado y sin ficheros nuevos no se reescribe
+    assert compact_capture(tmp_path, keep_last=False) == []
+
+
+def test_split_compacted_returns_the_originals_after_the_cursor(tmp_path):
+    first = _write(tmp_path, "2023/06/01/00/00/00", ["a", "b"])
+    second = _write(tmp_path, "2023/06/01/06/00/00", [])
+    third = _write(tmp_path, "2023/06/01/12/00/00", ["c"])
+    (compacted,) = compact_capture(tmp_path, keep_last=False)
+    bodies, metadata = _read(compacted)
+
+    split = [
+        (name, body.to_list())
+        for name, _, body in split_compacted(
+            compacted.as_posix(), metadata, pl.Series("Body", bodies), after=first
+        )
+    ]
+    assert split == [(second, []), (third, ["c"])]
@@ -0,0 +1,83 @@
+import polars as pl
+from event_schema import EVENT_COLUMNS, cast_events, event_time
+from event_store import scan_events, write_events
+from video import parse_notes
+
+
+DAY = 24 * 60 * 60
+NOTES = "{ 'video' : [ { 'Type' : 'Range', 'Ranges' : [{'start':0,'end':30}], 'Duration' : '187' }]}"
+
+
+def _events(*rows):
+    # (curso, segundos) de eventos de un lote, ya ordenados, como los deja Events: con
+    # todos los campos de event_schema, que son los que se guardan
+    columns = {column: pl.Series(column, ["x"] * len(rows)) for column in EVENT_COLUMNS}
+    columns.update(
+        course=pl.Series("course", [course for course, _ in rows]),
+        timestamp=pl.Series("timestamp", [float(seconds) for _, seconds in rows]),
+        percentage=pl.Series("percentage", [50.0] * len(rows)),
+        time_spent=pl.Series("time_spent", [1.0] * len(rows)),
+        notes=pl.Series("notes", [NOTES] * len(rows)),
+    )
+    events = cast_events(pl.DataFrame(list(columns.values())))
+    return parse_notes(
+        events.with_columns(
+            pl.col("timestamp").dt.strftime("%d").alias("day"),
+            pl.lit("author").cast(pl.Categorical).alias("author"),
+            pl.lit("unit").cast(pl.Categorical).alias("unit"),
+        )
+    ).sort("timestamp")
+
+
+def _read(store, **kwargs):
+    events = scan_events(store, **kwargs).collect()
+    return [
+        (course, (timestamp - event_time(0)).total_seconds())
+        for course, timestamp in events.select(["course", "timestamp"]).rows()
+    ]
+
+
+def test_batches_are_partitioned_by_day_and_course(tmp_path):
+    write_events(_events(("c1", 0), ("c2", 60), ("c1", DAY)), "b1", tmp_path)
+    assert sorted(path.relative_to(tmp_path).as_posix() for path in tmp_path.glob("*/*")) == [
+        "event_day=1970-01-01/course=c1",
+        "event_day=1970-01-01/course=c2",
+        "event_day=1970-01-02/course=c1",
+    ]
+    events = scan_events(tmp_path).collect()
+    assert events.schema["course"] == pl.Utf8
+    assert events.schema["event_day"] == pl.Utf8
+    assert events.schema["video_duration"] == pl.Float64
+    assert events["video_ranges"].to_list()[0] == [{"start": 0.0, "end": 30.0}]
+
+
+def test_ordered_read_merges_the_batches(tmp_path):
+    # dos lotes que se solapan en el tiempo, con eventos del mismo día y curso
+    write_events(_events(("c1", 0), ("c1", 20), ("c2", 40), ("c1", DAY)), "b1", tmp_path)
+    write_events(_events(("c1", 10), ("c2", 30), ("c1", 50), ("c1", DAY + 10)), "b2", tmp_path)
+    assert _read(tmp_path, ordered=True) == [
+        ("c1", 0),
+        ("c1", 10),
+        ("c1", 20),
+        ("c2", 30),
+        ("c2", 40),
+        ("c1", 50),
+        ("c1", DAY),
+        ("c1", DAY + 10),
+    ]
+    assert _read(tmp_path, ordered=True, first_day="1970-01-02") == [
+        ("c1", DAY),
+        ("c1", DAY + 10),
+    ]
+    assert _read(tmp_path, ordered=True, last_day="1970-01-01", courses=["c2"]) == [
+        ("c2", 30),
+        ("c2", 40),
+    ]
+
+
+def test_writing_a_batch_again_does_not_duplicate_it(tmp_path):
+    batch = _events(("c1", 0), ("c1", DAY))
+    write_events(batch, "b1", tmp_path)
+    write_events(batch, "b1", tmp_path)
+    write_events(_events(("c1", 10)), "b2", tmp_path)
+    assert _read(tmp_path, ordered=True) == [("c1", 0), ("c1", 10), ("c1", DAY)]
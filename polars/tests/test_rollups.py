@@ -0,0 +1,71 @@
+import polars as pl
+from event_schema import cast_events
+from rollups import daily_summary, merge_rollups, scan_rollups
+
+
+DAY = 24 * 60 * 60
+
+
+def _events(*rows, course="c1"):
+    # (usuario, segundos, percentage) de eventos Viewed de la misma actividad
+    return cast_events(
+        pl.DataFrame(
+            {
+                "user": [user for user, _, _ in rows],
+                "course": pl.Series([course] * len(rows), dtype=pl.Utf8),
+                "activity": ["a1"] * len(rows),
+                "timestamp": [float(seconds) for _, seconds, _ in rows],
+                "percentage": [percentage for _, _, percentage in rows],
+                "type": ["Viewed"] * len(rows),
+            }
+        )
+    )
+
+
+def _rollups(store):
+    return (
+        scan_rollups(store)
+        .collect()
+        .with_columns(pl.col(pl.Categorical).cast(pl.Utf8))
+        .sort(["event_day", "user"])
+        .select(["event_day", "user", "events", "max_percentage"])
+        .rows()
+    )
+
+
+def test_batches_are_added_to_their_days(tmp_path):
+    merge_rollups(_events(("u1", 0, 10.0), ("u1", 60, 30.0), ("u2", DAY, 5.0)), "b1", tmp_path)
+    merge_rollups(_events(("u1", 120, 20.0), ("u2", DAY + 60, 50.0)), "b2", tmp_path)
+    assert _rollups(tmp_path) == [
+        ("1970-01-01", "u1", 3, 30.0),
+        ("1970-01-02", "u2", 2, 50.0),
+    ]
+
+
+def test_merging_a_batch_again_leaves_the_rollups_unchanged(tmp_path):
+    batch = _events(("u1", 0, 10.0), ("u2", DAY, 5.0))
+    merge_rollups(batch, "b1", tmp_path)
+    merge_rollups(_events(("u1", 60, 30.0)), "b2", tmp_path)
+    rollups = _rollups(tmp_path)
+
+    # p. ej., el lote se repite tras un fallo antes de guardar el checkpoint
+    merge_rollups(batch, "b1", tmp_path)
+    assert _rollups(tmp_path) == rollups
+
+
+def test_events_without_user_or_course_are_kept(tmp_path):
+    merge_rollups(_events(("u1", 0, 10.0), (None, 60, 20.0)), "b1", tmp_path)
+    merge_rollups(_events((None, 120, 30.0), course=None), "b2", tmp_path)
+    # el evento sin usuario de c1 y el sin usuario ni curso quedan en filas distintas
+    assert sorted(_rollups(tmp_path), key=lambda row: (row[1] or "", row[3])) == [
+        ("1970-01-01", None, 1, 20.0),
+        ("1970-01-01", None, 1, 30.0),
+        ("1970-01-01", "u1", 1, 10.0),
+    ]
+    summary = daily_summary(scan_rollups(tmp_path)).with_columns(
+        pl.col(pl.Categorical).cast(pl.Utf8)
+    )
+    assert sorted(
+        summary.select(["course", "events", "events_Viewed"]).rows(),
+        key=lambda row: row[0] or "",
+    ) == [(None, 1, 1), ("c1", 2, 2)]
@@ -0,0 +1,72 @@
+import numpy as np
+import polars as pl
+import pytest
+from event_schema import cast_events, event_time
+from timeline import Timeline
+
+
+USERS = ["u1", "u2", "u3", "10.0.0.1"]
+COURSES = ["c1", "c2"]
+
+
+def _events(n=200, seed=0):
+    # eventos sin ordenar de varios usuarios y cursos, con timestamps repetidos
+    rng = np.random.default_rng(seed)
+    return cast_events(
+        pl.DataFrame(
+            {
+                "user": pl.Series(rng.choice(USERS, n), dtype=pl.Utf8),
+                "course": pl.Series(rng.choice(COURSES, n), dtype=pl.Utf8),
+                "timestamp": rng.integers(0, 1000, n).astype(float),
+                "row": np.arange(n),
+            }
+        )
+    )
+
+
+def _expected(events, key, value, start=None, end=None):
+    events = events.filter(pl.col(key).cast(pl.Utf8) == value)
+    if start is not None:
+        events = events.filter(pl.col("timestamp") >= start)
+    if end is not None:
+        events = events.filter(pl.col("timestamp") < end)
+    return events.sort(["timestamp", "row"])["row"].to_list()
+
+
+def test_lookups_match_a_filtered_sort():
+    events = _events()
+    timeline = Timeline(events)
+    for key, values in [("user", USERS), ("course", COURSES)]:
+        for value in values:
+            for start, end in [(None, None), (250, None), (None, 700), (250, 700), (300, 300)]:
+                start = None if start is None else event_time(start)
+                end = None if end is None else event_time(end)
+                result = timeline.timeline(start=start, end=end, **{key: value})
+                assert result["row"].to_list() == _expected(events, key, value, start, end)
+
+
+def test_unknown_keys_have_no_events():
+    timeline = Timeline(_events())
+    assert timeline.timeline(user="u9").shape[0] == 0
+    assert timeline.timeline(course="c9").shape[0] == 0
+
+
+def test_exactly_one_key_is_needed():
+    timeline = Timeline(_events())
+    with pytest.raises(ValueError):
+        timeline.timeline()
+    with pytest.raises(ValueError):
+        timeline.timeline(user="u1", course="c1")
+
+
+def test_recent_lookups_are_cached():
+    timeline = Timeline(_events(), cache_size=2)
+    u1 = timeline.timeline(user="u1")
+    u2 = timeline.timeline(user="u2")
+    assert timeline.timeline(user="u1") is u1
+    # u2 es la consulta usada hace más tiempo: sale de la caché al entrar c1
+    timeline.timeline(course="c1")
+    assert list(timeline.cache) == [("user", "u1", None, None), ("course", "c1", None, None)]
+    assert timeline.timeline(user="u2") is not u2
+    assert timeline.timeline(user="u2")["row"].to_list() == u2["row"].to_list()
+    assert list(timeline.cache) == [("course", "c1", None, None), ("user", "u2", None, None)]
@@ -0,0 +1,77 @@
+from collections import OrderedDict
+from event_schema import EVENT_DTYPES
+from event_store import EVENT_STORE_PATH, scan_events
+import numpy as np
+import polars as pl
+
+
+# Claves por las que se indexan los eventos
+TIMELINE_KEYS = ["user", "course"]
+
+# Número de consultas recientes que se guardan
+CACHE_SIZE = 128
+
+
+class Timeline:
+    """Consultas de la historia de un usuario o de un curso sobre unos eventos ya
+    cargados (el dataframe de Events, o los del almacén con from_store).
+
+    Al crearla se ordenan una sola vez las filas por (user, timestamp) y por (course,
+    timestamp); cada consulta busca en esos índices con búsqueda binaria y devuelve solo
+    su tramo de filas, sin recorrer el dataframe entero. Las últimas cache_size consultas
+    se guardan (LRU), porque las herramientas interactivas repiten mucho los mismos
+    usuarios."""
+
+    def __init__(self, events, cache_size=CACHE_SIZE):
+        self.events = events.lazy().collect()
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.indexes = {
+            key: self.__index(self.events[key], self.events["timestamp"])
+            for key in TIMELINE_KEYS
+        }
+
+    @classmethod
+    def from_store(cls, store=EVENT_STORE_PATH, cache_size=CACHE_SIZE, **filters):
+        """Timeline sobre los eventos del almacén Parquet; filters (first_day, last_day,
+        courses) se pasan a event_store.scan_events."""
+        return cls(scan_events(store, **filters), cache_size)
+
+    def timeline(self, user=None, course=None, start=None, end=None):
+        """Eventos de un usuario (user) o de un curso (course), ordenados por timestamp.
+        start y end (fechas o textos que entienda numpy, start incluido y end no) acotan
+        el intervalo de tiempo."""
+        if (user is None) == (course is None):
+            raise ValueError("timeline needs exactly one of user or course")
+        key, value = ("user", user) if user is not None else ("course", course)
+
+        cache_key = (key, value, start, end)
+        if cache_key in self.cache:
+            self.cache.move_to_end(cache_key)
+            return self.cache[cache_key]
+
+        codes, timestamps, rows = self.indexes[key]
+        # con la caché global de cadenas (event_schema), el código de value es el mismo
+        # que tiene en los eventos; si no aparece en ellos, no está en codes
+        code = pl.Series([str(value)]).cast(EVENT_DTYPES[key]).to_physical()[0]
+        first = np.searchsorted(codes, code, side="left")
+        last = np.searchsorted(codes, code, side="right")
+        # dentro del tramo de la clave las filas ya están ordenadas por timestamp
+        if start is not None:
+            first += np.searchsorted(timestamps[first:last], np.datetime64(start, "us"))
+        if end is not None:
+            last = first + np.searchsorted(timestamps[first:last], np.datetime64(end, "us"))
+        result = self.events[rows[first:last]]
+
+        self.cache[cache_key] = result
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result
+
+    def __index(self, keys, timestamps):
+        # Las claves se ordenan por su código de categoría (los del almacén vienen como
+        # texto y se convierten), con el timestamp como segundo criterio
+        codes = keys.cast(EVENT_DTYPES[keys.name]).to_physical().to_numpy()
+        timestamps = timestamps.cast(pl.Datetime("us")).to_numpy()
+        rows = np.lexsort((timestamps, codes))
+        return codes[rows], timestamps[rows], rows
@@ -0,0 +1,88 @@
+import polars as pl
+
+
+# En las Interaction de vídeo, notes es un literal de Python con los tramos vistos:
+# { 'video' : [ { 'Type' : 'Range', 'Ranges' : [{'start':..,'end':..}], 'Duration' : '187' }]}
+# Se leen con expresiones regulares sobre toda la columna, sin literal_eval por fila
+RANGE_PATTERN = r"\{\s*'start'[^}]*\}"
+START_PATTERN = r"'start'\s*:\s*([^,}\s]+)"
+END_PATTERN = r"'end'\s*:\s*([^,}\s]+)"
+DURATION_PATTERN = r"'Duration'\s*:\s*'?([0-9.]+)"
+
+# La cobertura se calcula por usuario, actividad y elemento (cada vídeo)
+COVERAGE_KEYS = ["user", "activity", "element"]
+
+
+def parse_notes(events):
+    """Añade a los eventos (DataFrame o LazyFrame) video_ranges, la lista de tramos
+    vistos como struct {start, end} en segundos, y video_duration, la duración del vídeo.
+    En los eventos que no son de vídeo las dos quedan a null."""
+    ranges = pl.col("notes").str.extract_all(RANGE_PATTERN)
+    return events.with_columns(
+        # sin tramos, null (como en pandas) y no una lista vacía
+        pl.when(ranges.list.lengths() > 0)
+        .then(
+            ranges.list.eval(
+                pl.struct(
+                    [
+                        pl.element().str.extract(START_PATTERN, 1).cast(pl.Float64).alias("start"),
+                        pl.element().str.extract(END_PATTERN, 1).cast(pl.Float64).alias("end"),
+                    ]
+                )
+            )
+        )
+        .alias("video_ranges"),
+        pl.col("notes").str.extract(DURATION_PATTERN, 1).cast(pl.Float64).alias("video_duration"),
+    )
+
+
+def video_coverage(events):
+    """Segundos vistos (watched_seconds) y porcentaje del vídeo visto (coverage) por
+    usuario, actividad y elemento, a partir de los video_ranges de todos sus eventos.
+
+    Los tramos de un mismo vídeo se solapan (se vuelve atrás, se ve dos veces...), así
+    que no se suman sin más: se ordenan por start y se unen los que se solapan antes de
+    sumar su longitud. Devuelve un LazyFrame si events lo es."""
+    ranges = (
+        events.lazy()
+        .filter(pl.col("video_ranges").list.lengths() > 0)
+        .select(COVERAGE_KEYS + ["video_duration", "video_ranges"])
+        .explode("video_ranges")
+        .unnest("video_ranges")
+        # los tramos se recortan a [0, duración]
+        .with_columns(
+            pl.when(pl.col("start") < 0).then(0.0).otherwise(pl.col("start")).alias("start"),
+            pl.when(pl.col("end") > pl.col("video_duration"))
+            .then(pl.col("video_duration"))
+            .otherwise(pl.col("end"))
+            .alias("end"),
+        )
+        .filter(pl.col("end") > pl.col("start"))
+        .sort(COVERAGE_KEYS + ["start"])
+        # un tramo empieza un nuevo intervalo si no solapa con ninguno de los anteriores
+        # del mismo vídeo, es decir, si empieza después del mayor end visto hasta él
+        .with_columns(pl.col("end").cummax().shift(1).over(COVERAGE_KEYS).alias("previous_end"))
+        .with_columns(
+            (pl.col("previous_end").is_null() | (pl.col("start") > pl.col("previous_end")))
+            .cumsum()
+            .alias("interval")
+        )
+    )
+    coverage = (
+        ranges.groupby(COVERAGE_KEYS + ["interval"])
+        .agg(
+            pl.col("start").min(),
+            pl.col("end").max(),
+            pl.col("video_duration").max(),
+        )
+        .groupby(COVERAGE_KEYS)
+        .agg(
+            (pl.col("end") - pl.col("start")).sum().alias("watched_seconds"),
+            pl.col("video_duration").max(),
+        )
+        .with_columns(
+            (100 * pl.col("watched_seconds") / pl.col("video_duration")).alias("coverage")
+        )
+        .sort(COVERAGE_KEYS)
+    )
+    return coverage if isinstance(events, pl.LazyFrame) else coverage.collect()
@@ -0,0 +1,122 @@
+from constants import SETTLE_SECONDS
+from listing import capture_directories
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+
+# Eventos de inotify (<sys/inotify.h>)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+# Cabecera de cada evento: wd, mask, cookie y longitud del nombre que va detrás
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class CaptureWatcher:
+    """Espera a los ficheros nuevos de una carpeta de captura con inotify. Solo se vigilan
+    las carpetas en las que pueden aparecer ficheros posteriores al cursor (las que
+    recorre list_capture_files), que watch(after) actualiza. Sin inotify (fuera de
+    Linux) wait se limita a esperar.
+
+    ready(path) dice si un fichero ya se puede leer: uno que se ha visto crear, cuando
+    se cierra tras escribirlo o llega con un rename; el resto (p. ej. los de una carpeta
+    nueva que se han escrito antes de vigilarla), cuando lleva SETTLE_SECONDS sin
+    modificarse."""
+
+    def __init__(self, capture):
+        self.capture = capture
+        # wd -> carpeta
+        self.watches = {}
+        self.writing, self.closed = set(), set()
+        self.fd = _inotify_init()
+
+    def watch(self, after):
+        if self.fd is None:
+            return
+        directories = {path.as_posix() for path in capture_directories(self.capture, after)}
+        for wd, directory in list(self.watches.items()):
+            if directory not in directories:
+                _libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+        for directory in directories - set(self.watches.values()):
+            wd = _libc.inotify_add_watch(self.fd, directory.encode(), WATCH_MASK)
+            if wd >= 0:
+                self.watches[wd] = directory
+        # lo ya procesado no se vuelve a preguntar
+        self.writing = {name for name in self.writing if name > after}
+        self.closed = {name for name in self.closed if name > after}
+
+    def wait(self, timeout):
+        """Espera hasta timeout segundos a que cambie algo en las carpetas vigiladas."""
+        if self.fd is None:
+            time.sleep(timeout)
+        elif select.select([self.fd], [], [], timeout)[0]:
+            self.__read_events()
+
+    def ready(self, path):
+        name = path.as_posix()
+        if name in self.closed:
+            return True
+        if name in self.writing:
+            return False
+        return time.time() - path.stat().st_mtime >= SETTLE_SECONDS
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __read_events(self):
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            position = 0
+            while position < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, position)
+                position += EVENT_HEADER.size
+                name = data[position : position + length].rstrip(b"\0").decode()
+                position += length
+                self.__event(wd, mask, name)
+
+    def __event(self, wd, mask, name):
+        if mask & IN_IGNORED:
+            # carpeta borrada (p. ej. al compactar) o que se ha dejado de vigilar
+            self.watches.pop(wd, None)
+            return
+        if mask & IN_ISDIR or wd not in self.watches:
+            # las carpetas nuevas se vigilan en el siguiente watch
+            return
+        path = self.watches[wd] + "/" + name
+        if mask & IN_CREATE:
+            self.writing.add(path)
+        else:
+            self.writing.discard(path)
+            self.closed.add(path)
+
+
+def _load_libc():
+    try:
+        return ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    except (OSError, TypeError):
+        return None
+
+
+_libc = _load_libc()
+
+
+def _inotify_init():
+    # descriptor de inotify no bloqueante, o None si el sistema no tiene inotify
+    if _libc is None or not hasattr(_libc, "inotify_init1"):
+        return None
+    fd = _libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    return fd if fd >= 0 else None